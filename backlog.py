@@ -0,0 +1,445 @@
+'''
+Bulk processing of a backlog of existing recordings.
+
+Uploads the videos listed in a manifest file into new jobs in the uploads bucket, which triggers the deployed pipeline
+exactly like an upload from the UI. Videos are admitted under a global limit on concurrent Transcribe jobs, read from
+the job-state table, and on the Bedrock tokens per minute of the pipeline's model, read from Amazon CloudWatch.
+Progress and ETA are printed while the backlog runs, and the state is saved after every change, so that an interrupted
+run continues where it stopped when it is started again with the same manifest. Per-video timings are reported at the end.
+
+The manifest is a CSV file with a "source" column (a local path or an s3:// URI of an mp4 video) and an optional
+"module" column with the module name of the job, which defaults to the video's file name.
+
+Example:
+    python backlog.py --bucket ai-tutor-uploads-<account id> --manifest recordings.csv --max-transcribe-jobs 10 --max-tokens-per-minute 400000 --report timings.csv
+'''
+from lambdas.lib import (
+    batch,
+    bedrock,
+    job_tracker,
+    manifest,
+    s3,
+    utils
+)
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+
+poll_interval = 15          # seconds between reads of the job manifest, the job-state table and the token metrics
+token_window = 5            # minutes over which the Bedrock token rate is averaged
+max_uploads = 4             # concurrent uploads
+job_timeout = 6 * 3600      # seconds after its upload at which a video that has not completed is marked as failed
+
+# video statuses in the backlog state: the pipeline's job statuses, preceded by the backlog's own
+pending_statuses = ['pending', 'uploading']
+finished_statuses = ['complete', 'failed']
+
+
+def load_backlog(manifest_path: str) -> list:
+    '''
+    Reads the manifest of videos to process. The videos are tracked by source, so a source that is listed again, e.g.
+    under another module, is skipped with a warning.
+    Returns a list of dictionaries containing {'source': str, 'module': str}.
+    '''
+
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    videos = []
+    modules = {}    # {source: module}
+
+    for row in rows:
+        source = (row.get('source') or "").strip()
+        if source == "":
+            continue
+
+        junk, sep, filename = source.rpartition('/')
+        name, sep, ext = filename.rpartition('.')
+        module = (row.get('module') or "").strip() or name
+
+        if source in modules:
+            print(f"WARNING: {source} is listed more than once, skipping it for module '{module}' (kept for '{modules[source]}')")
+            continue
+
+        modules[source] = module
+        videos.append({'source': source, 'module': module})
+
+    return videos
+
+
+def load_state(state_path: str, videos: list, retry_failed: bool = False) -> dict:
+    '''
+    Merges the manifest with the state of a previous run, matched by source. Failed videos are restarted in a new job
+    prefix if retry_failed is True.
+    Returns the state as a dictionary of {'videos': [video]}.
+    '''
+
+    previous = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            previous = {v['source']: v for v in json.load(f)['videos']}
+
+    state = {'videos': []}
+
+    for v in videos:
+        video = previous.get(v['source'], {**v, 'status': 'pending', 'job_prefix': "", 'video_key': "", 'times': {}, 'error': ""})
+
+        if video['status'] == 'failed' and retry_failed:
+            video.update({'status': 'pending', 'job_prefix': "", 'video_key': "", 'times': {}, 'error': ""})
+
+        state['videos'].append(video)
+
+    return state
+
+
+def save_state(state_path: str, state: dict) -> None:
+    '''
+    Writes the state atomically, so that an interruption never leaves a partial file.
+    '''
+
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1)
+    os.replace(temp_path, state_path)
+
+
+def get_job_prefix(module_name: str) -> str:
+    '''
+    Returns a new, unique S3 prefix for a job, e.g. "<module_name>-uuid-<uuid>", in the format used by the UI.
+    '''
+
+    return f"{module_name.strip().replace(' ', '-').replace('/', '-')}-uuid-{uuid.uuid4()}"
+
+
+def upload_video(bucket: str, video: dict, batch_mode: bool = False) -> str:
+    '''
+    Uploads the video from a local path, or copies it from an s3:// URI, into the video's job prefix.
+    In batch mode, the job is first marked to be processed by batch inference jobs (see lambdas/lib/batch.py).
+    Returns the S3 key of the uploaded video.
+    '''
+
+    if batch_mode:
+        s3.write_json(bucket, f"{video['job_prefix']}/{batch.request_filename}", {'requested': int(time.time())})
+
+    source = video['source']
+    junk, sep, filename = source.rpartition('/')
+    video_key = f"{video['job_prefix']}/vid-{filename}"
+
+    if source[:5] == 's3://':
+        source_bucket, sep, source_key = source[5:].partition('/')
+        return s3.copy_object(bucket, source_key, video_key, source_bucket=source_bucket)
+
+    report = s3.upload_files([source], bucket, video['job_prefix'], object_names=[f"vid-{filename}"])[0]
+    if report['error'] != "":
+        raise RuntimeError(report['error'])
+
+    return report['key']
+
+
+def get_transcribe_in_flight(bucket: str, entries: dict) -> int:
+    '''
+    Counts the queued and running Transcribe jobs in the job-state table, across all jobs in the bucket. Jobs whose
+    transcript has already reached processing according to the job manifest are not counted, so that a missed
+    Transcribe state change event does not hold back the backlog.
+    Returns an integer.
+    '''
+
+    table = job_tracker.load_table(bucket)
+    in_flight = 0
+
+    for status in job_tracker.in_flight_statuses:
+        for job in job_tracker.get_jobs(table, status).values():
+            job_prefix, sep, filename = job['media_key'].rpartition('/')
+            if entries.get(job_prefix, {}).get('status', 'transcribing') in ['uploaded', 'transcribing']:
+                in_flight += 1
+
+    return in_flight
+
+
+def get_token_rate(model_id: str) -> float:
+    '''
+    Reads the input and output tokens of the model from the AWS/Bedrock CloudWatch metrics over the last token_window
+    minutes. The metrics cover all callers of the model in the account and region, and lag by a minute or two.
+    Returns the average tokens per minute.
+    '''
+
+    end = datetime.datetime.now(datetime.timezone.utc)
+    queries = [{
+        'Id': metric.lower(),
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/Bedrock',
+                'MetricName': metric,
+                'Dimensions': [{'Name': 'ModelId', 'Value': model_id}],
+            },
+            'Period': 60,
+            'Stat': 'Sum',
+        }}
+        for metric in ['InputTokenCount', 'OutputTokenCount']
+    ]
+
+    response = utils.get_client('cloudwatch').get_metric_data(
+        MetricDataQueries=queries,
+        StartTime=end - datetime.timedelta(minutes=token_window),
+        EndTime=end,
+    )
+
+    return sum([sum(r['Values']) for r in response['MetricDataResults']]) / token_window
+
+
+def refresh_videos(videos: list, entries: dict) -> None:
+    '''
+    Updates the status of the submitted videos from the job manifest entries, recording when each status was first
+    seen. The manifest's update time is used when available, so the timings do not depend on the poll interval.
+    Videos that have not completed within job_timeout of their upload are marked as failed.
+    '''
+
+    now = time.time()
+
+    for video in videos:
+        if video['status'] in pending_statuses + finished_statuses:
+            continue
+
+        entry = entries.get(video['job_prefix'])
+
+        if entry is not None and entry['status'] != video['status']:
+            video['status'] = entry['status']
+            video['times'].setdefault(entry['status'], min(entry.get('updated', now), now))
+            video['error'] = entry.get('error', "")
+
+        if video['status'] not in finished_statuses and now - video['times'].get('uploaded', now) > job_timeout:
+            video['status'] = 'failed'
+            video['times']['failed'] = now
+            video['error'] = f"Not complete after {job_timeout}s"
+
+
+def get_admission(videos: list, transcribe_in_flight: int, token_rate: float, args) -> str:
+    '''
+    Decides if the next video can be submitted. Videos that are uploading or were uploaded but whose Transcribe job is
+    not registered yet count towards the Transcribe limit. For the token limit, each submitted video that has not reached
+    processing is expected to add the current per-job token rate once it does.
+    Returns an empty string if the video can be submitted, otherwise the limit that holds it back.
+    '''
+
+    counts = {}
+    for v in videos:
+        counts[v['status']] = counts.get(v['status'], 0) + 1
+
+    starting = counts.get('uploading', 0) + counts.get('uploaded', 0)
+    if transcribe_in_flight + starting >= args.max_transcribe_jobs:
+        return 'transcribe'
+
+    if args.max_tokens_per_minute > 0:
+        processing = counts.get('processing', 0)
+        per_job_rate = token_rate / processing if processing > 0 else 0
+        projected = token_rate + per_job_rate * (starting + counts.get('transcribing', 0))
+        if projected >= args.max_tokens_per_minute:
+            return 'tokens'
+
+    return ""
+
+
+def get_timings(video: dict) -> dict:
+    '''
+    Returns the seconds spent by the video in upload, transcription and processing, and in total.
+    Stages that were not observed, e.g. for a video deduplicated from a prior job, are None.
+    '''
+
+    times = video['times']
+
+    def elapsed(start, end):
+        return round(times[end] - times[start], 1) if start in times and end in times else None
+
+    return {
+        'upload_s': elapsed('uploading', 'uploaded'),
+        'transcribe_s': elapsed('uploaded', 'processing'),
+        'process_s': elapsed('processing', 'complete'),
+        'total_s': elapsed('uploading', 'complete'),
+    }
+
+
+def format_duration(seconds: float) -> str:
+    '''
+    Formats seconds as e.g. "2h 05m" or "4m 10s".
+    '''
+
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def format_progress(videos: list, completed_at_start: int, run_start: float, transcribe_in_flight: int, token_rate: float, held: str, args) -> str:
+    '''
+    Formats a progress line with the video counts, the current usage of the limits, and the throughput and ETA of this run.
+    Returns a string.
+    '''
+
+    counts = {}
+    for v in videos:
+        counts[v['status']] = counts.get(v['status'], 0) + 1
+
+    finished = counts.get('complete', 0) + counts.get('failed', 0)
+    remaining = len(videos) - finished
+    hours = (time.time() - run_start) / 3600
+    throughput = (finished - completed_at_start) / hours if hours > 0 else 0
+    eta = format_duration(remaining / throughput * 3600) if throughput > 0 else "--"
+    tokens = f"{token_rate:.0f}/{args.max_tokens_per_minute}" if args.max_tokens_per_minute > 0 else "unlimited"
+
+    return (f"[{time.strftime('%H:%M:%S')}] {counts.get('complete', 0)}/{len(videos)} complete, {counts.get('failed', 0)} failed, "
+        f"{remaining - counts.get('pending', 0)} in progress, {counts.get('pending', 0)} pending | "
+        f"transcribe jobs {transcribe_in_flight}/{args.max_transcribe_jobs}, tokens/min {tokens}"
+        f"{', held by ' + held + ' limit' if held != '' and counts.get('pending', 0) > 0 else ''} | "
+        f"{throughput:.1f} videos/h, ETA {eta}")
+
+
+def write_report(report_path: str, videos: list) -> None:
+    '''
+    Prints a summary of the per-video timings, and writes them as CSV to report_path if given.
+    '''
+
+    rows = [{'source': v['source'], 'job_prefix': v['job_prefix'], 'status': v['status'], **get_timings(v), 'error': v['error']} for v in videos]
+    totals = sorted([r['total_s'] for r in rows if r['total_s'] is not None])
+
+    if len(totals) > 0:
+        p90 = totals[min(int(len(totals) * 0.9), len(totals) - 1)]
+        print(f"\nCompleted {len(totals)} videos: median {format_duration(statistics.median(totals))}, p90 {format_duration(p90)}, max {format_duration(totals[-1])}")
+
+    for r in [r for r in rows if r['status'] == 'failed']:
+        print(f"FAILED {r['source']}: {r['error']}")
+
+    if report_path != "":
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if len(rows) > 0 else ['source'])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Per-video timings written to {report_path}")
+
+
+def run(args) -> dict:
+    '''
+    Submits the backlog under the limits and waits until every video is complete or failed.
+    Returns the state.
+    '''
+
+    state_path = args.state if args.state != "" else f"{args.manifest}.state.json"
+    state = load_state(state_path, load_backlog(args.manifest), args.retry_failed)
+    videos = state['videos']
+
+    # uploads interrupted by the previous run are restarted in the same job prefix, unless they completed
+    for video in [v for v in videos if v['status'] == 'uploading']:
+        junk, sep, filename = video['source'].rpartition('/')
+        if s3.object_exists(args.bucket, f"{video['job_prefix']}/vid-{filename}"):
+            video['status'] = 'uploaded'
+            video['times']['uploaded'] = time.time()
+        else:
+            video['status'] = 'pending'
+
+    save_state(state_path, state)
+
+    uploads = {}    # {source: future}
+    run_start = time.time()
+    completed_at_start = len([v for v in videos if v['status'] in finished_statuses])
+    token_error = ""
+
+    with ThreadPoolExecutor(max_workers=max_uploads) as pool:
+        while True:
+            # collect finished uploads
+            for source, future in list(uploads.items()):
+                if not future.done():
+                    continue
+
+                video = next(v for v in videos if v['source'] == source)
+                del uploads[source]
+
+                try:
+                    video['video_key'] = future.result()
+                    video['status'] = 'uploaded'
+                    video['times']['uploaded'] = time.time()
+                except Exception as e:
+                    print(f"\nERROR uploading {source}: {e}")
+                    video['status'] = 'failed'
+                    video['error'] = str(e)
+
+            entries = manifest.read_manifest(args.bucket) or {}
+            refresh_videos(videos, entries)
+
+            if all([v['status'] in finished_statuses for v in videos]):
+                save_state(state_path, state)
+                break
+
+            transcribe_in_flight = get_transcribe_in_flight(args.bucket, entries)
+            token_rate = 0
+
+            if args.max_tokens_per_minute > 0:
+                try:
+                    token_rate = get_token_rate(args.model_id)
+                    token_error = ""
+                except Exception as e:
+                    if token_error != str(e):
+                        print(f"\nERROR reading the Bedrock token metrics, only the Transcribe limit is applied: {e}")
+                    token_error = str(e)
+
+            # submit pending videos while the limits allow
+            held = ""
+            for video in [v for v in videos if v['status'] == 'pending']:
+                held = get_admission(videos, transcribe_in_flight, token_rate, args)
+                if held != "":
+                    break
+
+                if not video['source'].lower().endswith('.mp4'):
+                    video['status'] = 'failed'
+                    video['error'] = "Only mp4 videos are supported"
+                    continue
+
+                video['job_prefix'] = video['job_prefix'] or get_job_prefix(video['module'])
+                video['status'] = 'uploading'
+                video['times']['uploading'] = time.time()
+                uploads[video['source']] = pool.submit(upload_video, args.bucket, video, args.batch)
+
+            save_state(state_path, state)
+            print(format_progress(videos, completed_at_start, run_start, transcribe_in_flight, token_rate, held, args), flush=True)
+            time.sleep(args.poll_interval)
+
+    return state
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(description="Submits a backlog of recordings to the AI Tutor pipeline under global throughput limits.")
+    parser.add_argument('--bucket', required=True, help="The uploads bucket of the deployed stack")
+    parser.add_argument('--manifest', required=True, help="CSV file with a 'source' column (local path or s3:// URI) and an optional 'module' column")
+    parser.add_argument('--state', default='', help="State file for resuming, defaults to <manifest>.state.json")
+    parser.add_argument('--max-transcribe-jobs', type=int, default=10, help="Concurrent Transcribe jobs in the bucket, including jobs not started by the backlog")
+    parser.add_argument('--max-tokens-per-minute', type=int, default=0, help="Bedrock input and output tokens per minute of the model, 0 for no limit")
+    parser.add_argument('--model-id', default=bedrock.default_model, help="The model whose token metrics are limited")
+    parser.add_argument('--poll-interval', type=float, default=poll_interval, help="Seconds between status updates")
+    parser.add_argument('--retry-failed', action='store_true', help="Resubmits the videos that failed in a previous run")
+    parser.add_argument('--batch', action='store_true', help="Processes the videos with Bedrock batch inference jobs instead of on-demand calls")
+    parser.add_argument('--report', default='', help="Writes the per-video timings to this CSV file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> dict:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    try:
+        state = run(args)
+
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Run the same command again to resume.")
+        return {}
+
+    write_report(args.report, state['videos'])
+    return state
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,700 @@
+'''
+Local stand-ins for the Amazon S3, Amazon Transcribe, Amazon Bedrock and Amazon SQS clients used by the Lambdas.
+The fakes implement only the client operations that the pipeline calls and count every call, so that
+the handlers can be benchmarked end-to-end without an AWS account.
+'''
+from botocore.exceptions import ClientError
+from collections import Counter
+from contextlib import contextmanager
+from . import synthetic
+import boto3
+import datetime
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+
+def estimate_tokens(text: str) -> int:
+    '''
+    Rough token estimate (~4 characters per token). Returns an int.
+    '''
+
+    return max(1, len(text) // 4)
+
+
+def client_error(code: str, operation: str, message: str = "", status: int = 400) -> ClientError:
+    '''
+    Builds a botocore ClientError with the given error code, as raised by the real clients.
+    '''
+
+    return ClientError({
+        'Error': {'Code': code, 'Message': message or code},
+        'ResponseMetadata': {'HTTPStatusCode': status},
+        }, operation)
+
+
+class CallLog:
+    '''
+    Thread-safe counter of calls per (service, operation) and per pipeline stage.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = Counter()
+        self.stages = Counter()
+        self.throttled = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def count(self, service: str, operation: str) -> None:
+        with self.lock:
+            self.operations[f"{service}.{operation}"] += 1
+
+    def count_stage(self, stage: str, input_tokens: int, output_tokens: int) -> None:
+        with self.lock:
+            self.stages[stage] += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def count_throttle(self) -> None:
+        with self.lock:
+            self.throttled += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'operations': dict(sorted(self.operations.items())),
+            'bedrock_calls_by_stage': dict(sorted(self.stages.items())),
+            'bedrock_throttled': self.throttled,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+        }
+
+
+class LatencyModel:
+    '''
+    Samples per-call latency in seconds from a fixed, uniform, normal or lognormal distribution.
+    For the lognormal distribution, mean is the median latency and spread is the shape parameter (sigma).
+    '''
+
+    def __init__(self, dist: str = 'fixed', mean: float = 0.0, spread: float = 0.0, seed: int = 0):
+        if dist not in ['fixed', 'uniform', 'normal', 'lognormal']:
+            raise ValueError(f"Unknown latency distribution: {dist}")
+
+        self.dist = dist
+        self.mean = mean
+        self.spread = spread
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self.lock:
+            if self.dist == 'uniform':
+                value = self.rng.uniform(self.mean - self.spread, self.mean + self.spread)
+            elif self.dist == 'normal':
+                value = self.rng.gauss(self.mean, self.spread)
+            elif self.dist == 'lognormal':
+                value = self.mean * self.rng.lognormvariate(0, self.spread) if self.mean > 0 else 0
+            else:
+                value = self.mean
+
+        return max(0.0, value)
+
+
+class FakeBody:
+    '''
+    Minimal stand-in for botocore's StreamingBody.
+    '''
+
+    def __init__(self, data: bytes):
+        self.stream = io.BytesIO(data)
+
+    def read(self, amt: int = None) -> bytes:
+        return self.stream.read(amt)
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self.stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class FakeS3:
+    '''
+    In-memory S3 client. Objects are stored as {bucket: {key: {'data', 'etag', 'last_modified', 'metadata'}}}.
+    '''
+
+    def __init__(self, log: CallLog):
+        self.log = log
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.uploads = {}   # {upload_id: {'bucket', 'key', 'parts': {part_number: bytes}}}
+
+    # region helpers
+    def put(self, bucket: str, key: str, data: bytes, metadata: dict = None) -> str:
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+
+        with self.lock:
+            self.buckets.setdefault(bucket, {})[key] = {
+                'data': data,
+                'etag': etag,
+                'last_modified': datetime.datetime.now(datetime.timezone.utc),
+                'metadata': metadata or {},
+            }
+
+        return etag
+
+    def get(self, bucket: str, key: str, operation: str) -> dict:
+        with self.lock:
+            obj = self.buckets.get(bucket, {}).get(key)
+
+        if obj is None:
+            raise client_error('NoSuchKey' if operation != 'HeadObject' else '404', operation, status=404)
+
+        return obj
+
+    def keys(self, bucket: str) -> list:
+        with self.lock:
+            return sorted(self.buckets.get(bucket, {}).keys())
+    # endregion
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.log.count('s3', 'upload_file')
+        with open(Filename, 'rb') as f:
+            data = f.read()
+        self.put(Bucket, Key, data, (ExtraArgs or {}).get('Metadata'))
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        self.log.count('s3', 'download_file')
+        obj = self.get(Bucket, Key, 'GetObject')
+        with open(Filename, 'wb') as f:
+            f.write(obj['data'])
+
+    def put_object(self, Bucket, Key, Body=b"", IfMatch=None, IfNoneMatch=None, Metadata=None, **kwargs):
+        self.log.count('s3', 'put_object')
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+
+        with self.lock:
+            existing = self.buckets.get(Bucket, {}).get(Key)
+
+            if IfNoneMatch == '*' and existing is not None:
+                raise client_error('PreconditionFailed', 'PutObject', status=412)
+            if IfMatch is not None and (existing is None or existing['etag'] != IfMatch):
+                raise client_error('PreconditionFailed', 'PutObject', status=412)
+
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            self.buckets.setdefault(Bucket, {})[Key] = {
+                'data': data,
+                'etag': etag,
+                'last_modified': datetime.datetime.now(datetime.timezone.utc),
+                'metadata': Metadata or {},
+            }
+
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, Range=None, **kwargs):
+        self.log.count('s3', 'get_object')
+        obj = self.get(Bucket, Key, 'GetObject')
+
+        if IfNoneMatch is not None and IfNoneMatch == obj['etag']:
+            raise client_error('304', 'GetObject', 'Not Modified', status=304)
+
+        data = obj['data']
+        if Range is not None:
+            start, sep, end = Range.replace('bytes=', '').partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+
+        return {
+            'Body': FakeBody(data),
+            'ETag': obj['etag'],
+            'ContentLength': len(data),
+            'LastModified': obj['last_modified'],
+            'Metadata': obj['metadata'],
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.log.count('s3', 'head_object')
+        obj = self.get(Bucket, Key, 'HeadObject')
+
+        return {
+            'ETag': obj['etag'],
+            'ContentLength': len(obj['data']),
+            'LastModified': obj['last_modified'],
+            'Metadata': obj['metadata'],
+        }
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.log.count('s3', 'copy_object')
+        obj = self.get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        etag = self.put(Bucket, Key, obj['data'], obj['metadata'])
+        return {'CopyObjectResult': {'ETag': etag}}
+
+    def delete_object(self, Bucket, Key, IfMatch=None, **kwargs):
+        self.log.count('s3', 'delete_object')
+        with self.lock:
+            existing = self.buckets.get(Bucket, {}).get(Key)
+
+            if IfMatch is not None and existing is None:
+                raise client_error('NoSuchKey', 'DeleteObject', status=404)
+            if IfMatch is not None and existing['etag'] != IfMatch:
+                raise client_error('PreconditionFailed', 'DeleteObject', status=412)
+
+            self.buckets.get(Bucket, {}).pop(Key, None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self.log.count('s3', 'list_objects_v2')
+
+        keys = [k for k in self.keys(Bucket) if k.startswith(Prefix)]
+        contents = []
+        prefixes = []
+
+        for k in keys:
+            if Delimiter != "" and Delimiter in k[len(Prefix):]:
+                common = k[:len(Prefix) + k[len(Prefix):].index(Delimiter) + len(Delimiter)]
+                if common not in prefixes:
+                    prefixes.append(common)
+            else:
+                contents.append(k)
+
+        entries = [('key', k) for k in contents] + [('prefix', p) for p in prefixes]
+        entries = sorted(entries, key=lambda x: x[1])
+        start = int(ContinuationToken or 0)
+        page = entries[start:start + MaxKeys]
+        is_truncated = start + MaxKeys < len(entries)
+
+        response = {'IsTruncated': is_truncated, 'KeyCount': len(page)}
+        page_keys = [k for t, k in page if t == 'key']
+        page_prefixes = [p for t, p in page if t == 'prefix']
+
+        if len(page_keys) > 0:
+            with self.lock:
+                objects = self.buckets.get(Bucket, {})
+                response['Contents'] = [{
+                    'Key': k,
+                    'ETag': objects[k]['etag'],
+                    'Size': len(objects[k]['data']),
+                    'LastModified': objects[k]['last_modified'],
+                    } for k in page_keys if k in objects]
+        if len(page_prefixes) > 0:
+            response['CommonPrefixes'] = [{'Prefix': p} for p in page_prefixes]
+        if is_truncated:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.log.count('s3', 'create_multipart_upload')
+        upload_id = hashlib.md5(f"{Bucket}/{Key}/{len(self.uploads)}".encode('utf-8')).hexdigest()
+        with self.lock:
+            self.uploads[upload_id] = {'bucket': Bucket, 'key': Key, 'parts': {}}
+        return {'UploadId': upload_id}
+
+    def get_upload(self, UploadId: str, operation: str) -> dict:
+        with self.lock:
+            upload = self.uploads.get(UploadId)
+        if upload is None:
+            raise client_error('NoSuchUpload', operation, status=404)
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.log.count('s3', 'upload_part')
+        data = Body if isinstance(Body, bytes) else Body.read()
+        upload = self.get_upload(UploadId, 'UploadPart')
+        with self.lock:
+            upload['parts'][PartNumber] = data
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000, **kwargs):
+        self.log.count('s3', 'list_parts')
+        upload = self.get_upload(UploadId, 'ListParts')
+        numbers = sorted([n for n in upload['parts'] if n > int(PartNumberMarker)])
+        page = numbers[:MaxParts]
+        response = {
+            'Parts': [{'PartNumber': n, 'ETag': f'"{hashlib.md5(upload["parts"][n]).hexdigest()}"', 'Size': len(upload['parts'][n])} for n in page],
+            'IsTruncated': len(numbers) > MaxParts,
+        }
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = page[-1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.log.count('s3', 'complete_multipart_upload')
+        upload = self.get_upload(UploadId, 'CompleteMultipartUpload')
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+
+        for p in MultipartUpload['Parts']:
+            data = upload['parts'].get(p['PartNumber'])
+            if data is None or f'"{hashlib.md5(data).hexdigest()}"' != p['ETag']:
+                raise client_error('InvalidPart', 'CompleteMultipartUpload')
+
+        data = b"".join([upload['parts'][n] for n in numbers])
+        self.put(Bucket, Key, data)
+        etag = f'"{hashlib.md5(b"".join([hashlib.md5(upload["parts"][n]).digest() for n in numbers])).hexdigest()}-{len(numbers)}"'
+        with self.lock:
+            self.buckets[Bucket][Key]['etag'] = etag
+            del self.uploads[UploadId]
+        return {'ETag': etag, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.log.count('s3', 'abort_multipart_upload')
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_paginator(self, operation_name: str):
+        if operation_name == 'list_parts':
+            return FakePaginator(self.list_parts, 'PartNumberMarker', 'NextPartNumberMarker')
+        return FakePaginator(getattr(self, operation_name), 'ContinuationToken', 'NextContinuationToken')
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        self.log.count('s3', 'generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+class FakePaginator:
+    '''
+    Paginator stand-in that follows the given request/response token names.
+    '''
+
+    def __init__(self, method, input_token: str, output_token: str):
+        self.method = method
+        self.input_token = input_token
+        self.output_token = output_token
+
+    def paginate(self, **kwargs):
+        kwargs.pop('PaginationConfig', None)
+        while True:
+            page = self.method(**kwargs)
+            yield page
+
+            if self.output_token not in page:
+                break
+            kwargs[self.input_token] = page[self.output_token]
+
+
+class FakeTranscribe:
+    '''
+    Transcribe stand-in. Jobs complete immediately: the transcript registered for the media URI
+    (or a small synthetic transcript) is written to the job's output location in the fake S3.
+    '''
+
+    def __init__(self, log: CallLog, s3: FakeS3, transcripts: dict = None):
+        self.log = log
+        self.s3 = s3
+        self.transcripts = transcripts if transcripts is not None else {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start_transcription_job(self, TranscriptionJobName, Media, OutputBucketName, OutputKey, **kwargs):
+        self.log.count('transcribe', 'start_transcription_job')
+
+        media_uri = Media['MediaFileUri']
+        transcript = self.transcripts.get(media_uri) or synthetic.make_transcript('small')
+        transcript = dict(transcript, jobName=TranscriptionJobName)
+        self.s3.put(OutputBucketName, OutputKey, json.dumps(transcript).encode('utf-8'))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        job = {
+            'TranscriptionJobName': TranscriptionJobName,
+            'TranscriptionJobStatus': 'COMPLETED',
+            'LanguageCode': kwargs.get('LanguageCode', 'en-US'),
+            'Media': Media,
+            'Transcript': {'TranscriptFileUri': f"https://s3.local/{OutputBucketName}/{OutputKey}"},
+            'CreationTime': now,
+            'StartTime': now,
+            'CompletionTime': now,
+        }
+
+        with self.lock:
+            self.jobs[TranscriptionJobName] = job
+
+        return {'TranscriptionJob': job}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.log.count('transcribe', 'get_transcription_job')
+
+        with self.lock:
+            job = self.jobs.get(TranscriptionJobName)
+
+        if job is None:
+            raise client_error('BadRequestException', 'GetTranscriptionJob', 'The requested job couldn\'t be found.')
+
+        return {'TranscriptionJob': job}
+
+    def list_transcription_jobs(self, Status=None, JobNameContains=None, NextToken=None, MaxResults=100):
+        self.log.count('transcribe', 'list_transcription_jobs')
+
+        with self.lock:
+            jobs = sorted(self.jobs.values(), key=lambda x: x['CreationTime'], reverse=True)
+
+        jobs = [j for j in jobs if Status is None or j['TranscriptionJobStatus'] == Status]
+        jobs = [j for j in jobs if JobNameContains is None or JobNameContains in j['TranscriptionJobName']]
+        start = int(NextToken or 0)
+        page = jobs[start:start + MaxResults]
+
+        response = {
+            'Status': Status,
+            'TranscriptionJobSummaries': [{
+                'TranscriptionJobName': j['TranscriptionJobName'],
+                'TranscriptionJobStatus': j['TranscriptionJobStatus'],
+                'CreationTime': j['CreationTime'],
+                'StartTime': j['StartTime'],
+                'CompletionTime': j['CompletionTime'],
+                'LanguageCode': j['LanguageCode'],
+                } for j in page],
+        }
+        if start + MaxResults < len(jobs):
+            response['NextToken'] = str(start + MaxResults)
+
+        return response
+
+    def get_paginator(self, operation_name: str):
+        return FakePaginator(getattr(self, operation_name), 'NextToken', 'NextToken')
+
+
+class FakeBedrock:
+    '''
+    Bedrock runtime stand-in. The prompt is matched against the pipeline's prompt templates to pick a
+    canned, tag-formatted response and to attribute the call to a pipeline stage.
+    Latency is sampled from the latency model, and a fraction of calls (throttle_rate) raise ThrottlingException.
+    A fraction of the generated quiz questions (quiz_error_rate) is malformed, to exercise the quiz validation.
+    '''
+
+    def __init__(self, log: CallLog, latency: LatencyModel = None, throttle_rate: float = 0.0, seed: int = 0, quiz_error_rate: float = 0.0):
+        self.log = log
+        self.latency = latency or LatencyModel()
+        self.throttle_rate = throttle_rate
+        self.quiz_error_rate = quiz_error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        # (stage name, marker found in the prompt, responder)
+        self.routes = [
+            ('get_summary_and_topics', 'identify the key topics in the video', self.respond_summary_and_topics),
+            ('merge_summary_and_topics', 'combine them into the key topics and a summary', self.respond_overview_merge),
+            ('get_chapters', 'find the section that is most relevant to the topic', self.respond_section),
+            ('get_chapters', 'grouping consecutive blocks', self.respond_block_groups),
+            ('get_chapter_timestamps', 'contains the following text segment', self.respond_is_in_chapter),
+            ('get_quiz_explanations', 'explain in at most', self.respond_quiz_explanations),
+            ('repair_chapter_mcq', 'for each of the following levels only', self.respond_mcq),
+            ('get_chapter_mcq', "Bloom's Taxonomy", self.respond_mcq),
+            ('get_chapter_summaries', 'Summarize the text given in <chap></chap>', self.respond_chapter_summary),
+            ('summarize_conversation', 'update the summary to include the new messages', self.respond_conversation_summary),
+        ]
+
+    # region responders
+    def respond_summary_and_topics(self, prompt: str) -> str:
+        topics = re.findall(r"Section \d+: ([^.]+)\.", prompt)
+        topics = topics if len(topics) > 0 else ['Overview']
+        topics_text = '\n'.join([f"<topic>\n{t}\n</topic>\n" for t in topics])
+        return f"{topics_text}\n<summary>\nA synthetic lecture covering {', '.join(topics)}.\n</summary>"
+
+    def respond_overview_merge(self, prompt: str) -> str:
+        topics = []
+        for t in re.findall(r"<topic>(.*?)</topic>", prompt, re.S):
+            if len(topics) == 0 or topics[-1] != t.strip():
+                topics.append(t.strip())
+        topics_text = '\n'.join([f"<topic>\n{t}\n</topic>\n" for t in topics])
+        return f"{topics_text}\n<summary>\nA synthetic lecture covering {', '.join(topics)}.\n</summary>"
+
+    def respond_section(self, prompt: str) -> str:
+        topic = re.search(r'relevant to the topic "(.*?)"\.', prompt).group(1)
+        transcript = re.search(r"<transcript>\s*(.*?)\s*</transcript>", prompt, re.S).group(1)
+        start = transcript.find(f": {topic}.")
+        start = transcript.rfind("Section ", 0, start) if start >= 0 else 0
+        end = transcript.find("Section ", start + 1)
+        section = transcript[start:end if end >= 0 else None].strip()
+        return f"<section>\n{section}\n</section>"
+
+    def respond_block_groups(self, prompt: str) -> str:
+        chapters = ""
+        for block_id, text in re.findall(r'<block id="(\d+)">\s*(.*?)\s*</block>', prompt, re.S):
+            topic = re.search(r"Section \d+: ([^.]+)\.", text)
+            if topic is not None or chapters == "":
+                title = topic.group(1) if topic is not None else "Introduction"
+                chapters += f"<chapter>\n<title>\n{title}\n</title>\n<first>\n{block_id}\n</first>\n</chapter>\n"
+        return chapters
+
+    def respond_is_in_chapter(self, prompt: str) -> str:
+        transcript = re.search(r"<transcript>\s*(.*?)\s*</transcript>", prompt, re.S).group(1)
+        segment = re.search(r"contains the following text segment: (.*?)\n", prompt, re.S).group(1).strip()
+        return f"<ans>{'yes' if segment in transcript else 'no'}</ans>"
+
+    def respond_mcq(self, prompt: str) -> str:
+        levels = re.findall(r"^\s*\d\) (.+?): ", prompt, re.M)
+        quizzes = ""
+        for lvl in levels:
+            with self.lock:
+                error = self.rng.choice(['answer', 'choices', 'level']) if self.rng.random() < self.quiz_error_rate else ""
+            choice_count = 3 if error == 'choices' else 4
+            options = ''.join([f"<opt>\nChoice {i} for {lvl}\n</opt>\n" for i in range(1, choice_count + 1)])
+            ans = "None of the above" if error == 'answer' else f"Choice 2 for {lvl}"
+            lvl_tag = "" if error == 'level' else f"<lvl>\n{lvl}\n</lvl>\n"
+            quizzes += f"<quiz>\n{lvl_tag}<qn>\nA {lvl} question?\n</qn>\n<choices>\n{options}</choices>\n<ans>\n{ans}\n</ans>\n</quiz>\n"
+        return quizzes
+
+    def respond_quiz_explanations(self, prompt: str) -> str:
+        numbers = re.findall(r"Quiz question (\d+):", prompt)
+        return ''.join([f"<exp>\n<num>{n}</num>\n<why>\nChoice 2 is what the chapter states for question {n}.\n</why>\n</exp>\n" for n in numbers])
+
+    def respond_chapter_summary(self, prompt: str) -> str:
+        title = re.search(r"Title: (.*?)\n", prompt)
+        title = title.group(1) if title else "this chapter"
+        return f"<summary>\nThis chapter explains {title}.\n</summary>"
+
+    def respond_conversation_summary(self, prompt: str) -> str:
+        conversation = re.search(r"<conversation>\s*(.*?)\s*</conversation>", prompt, re.S).group(1)
+        questions = len(re.findall(r"^Student: ", conversation, re.M))
+        return f"<summary>\nThe student asked {questions} more questions.\n</summary>"
+
+    def respond_default(self, prompt: str) -> str:
+        return "This is a synthetic answer from the fake Bedrock client."
+    # endregion
+
+    def route(self, prompt: str) -> tuple:
+        for stage, marker, responder in self.routes:
+            if marker in prompt:
+                return (stage, responder)
+
+        return ('other', self.respond_default)
+
+    def respond(self, operation: str, messages: list) -> tuple:
+        self.log.count('bedrock', operation)
+        time.sleep(self.latency.sample())
+
+        with self.lock:
+            throttled = self.rng.random() < self.throttle_rate
+
+        if throttled:
+            self.log.count_throttle()
+            raise client_error('ThrottlingException', operation.title().replace('_', ''), 'Rate exceeded')
+
+        prompt = '\n'.join([c.get('text', '') for m in messages for c in m['content']])
+        last_prompt = '\n'.join([c.get('text', '') for c in messages[-1]['content']])
+        stage, responder = self.route(last_prompt)
+        text = responder(last_prompt)
+
+        usage = {
+            'inputTokens': estimate_tokens(prompt),
+            'outputTokens': estimate_tokens(text),
+        }
+        usage['totalTokens'] = usage['inputTokens'] + usage['outputTokens']
+        self.log.count_stage(stage, usage['inputTokens'], usage['outputTokens'])
+
+        return (text, usage)
+
+    def converse(self, modelId, messages, **kwargs):
+        text, usage = self.respond('converse', messages)
+
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+            'stopReason': 'end_turn',
+            'usage': usage,
+            'metrics': {'latencyMs': 0},
+        }
+
+    def converse_stream(self, modelId, messages, **kwargs):
+        text, usage = self.respond('converse_stream', messages)
+        words = text.split(' ')
+
+        def events():
+            yield {'messageStart': {'role': 'assistant'}}
+            for i in range(len(words)):
+                delta = words[i] if i == 0 else f" {words[i]}"
+                yield {'contentBlockDelta': {'delta': {'text': delta}, 'contentBlockIndex': 0}}
+            yield {'contentBlockStop': {'contentBlockIndex': 0}}
+            yield {'messageStop': {'stopReason': 'end_turn'}}
+            yield {'metadata': {'usage': usage, 'metrics': {'latencyMs': 0}}}
+
+        return {'stream': events()}
+
+
+class FakeSQS:
+    '''
+    In-process stand-in for the SQS queues that feed the Lambdas. Sent messages are kept in memory until they are
+    received as Lambda SQS events, see receive_event().
+    '''
+
+    def __init__(self, log: CallLog):
+        self.log = log
+        self.lock = threading.Lock()
+        self.queues = {}    # {queue_url: [message]}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self.log.count('sqs', 'send_message_batch')
+
+        if len(Entries) > 10:
+            raise client_error('TooManyEntriesInBatchRequest', 'SendMessageBatch')
+
+        successful = []
+        with self.lock:
+            queue = self.queues.setdefault(QueueUrl, [])
+            for entry in Entries:
+                message_id = hashlib.md5(f"{QueueUrl}{len(queue)}{entry['MessageBody']}".encode('utf-8')).hexdigest()
+                queue.append({'messageId': message_id, 'body': entry['MessageBody']})
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_event(self, queue_url: str, batch_size: int = 1) -> dict:
+        '''
+        Removes up to batch_size messages from the queue.
+        Returns them as a Lambda SQS event, or None if the queue is empty.
+        '''
+
+        with self.lock:
+            queue = self.queues.get(queue_url, [])
+            records = queue[:batch_size]
+            del queue[:batch_size]
+
+        return {'Records': records} if len(records) > 0 else None
+
+
+class FakeAWS:
+    '''
+    Bundles the fake clients and routes boto3.client(service_name) to them.
+    '''
+
+    def __init__(self, bedrock_latency: LatencyModel = None, throttle_rate: float = 0.0, seed: int = 0, quiz_error_rate: float = 0.0):
+        self.log = CallLog()
+        self.s3 = FakeS3(self.log)
+        self.transcribe = FakeTranscribe(self.log, self.s3)
+        self.bedrock = FakeBedrock(self.log, bedrock_latency, throttle_rate, seed, quiz_error_rate)
+        self.sqs = FakeSQS(self.log)
+        self.clients = {
+            's3': self.s3,
+            'transcribe': self.transcribe,
+            'bedrock-runtime': self.bedrock,
+            'sqs': self.sqs,
+        }
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name not in self.clients:
+            raise ValueError(f"No fake client for service: {service_name}")
+
+        return self.clients[service_name]
+
+
+@contextmanager
+def installed(aws: FakeAWS):
+    '''
+    Routes boto3.client() to the fake clients for the duration of the context.
+    Modules that created a client at import time must be imported inside the context.
+    '''
+
+    original_client = boto3.client
+    boto3.client = aws.client
+
+    try:
+        yield aws
+
+    finally:
+        boto3.client = original_client
@@ -0,0 +1,352 @@
+'''
+Offline end-to-end benchmark of the video processing pipeline.
+
+Runs transcribe_video.lambda_handler and process_transcript.lambda_handler against the fake S3, Transcribe
+and Bedrock clients in benchmarks/fakes.py, using synthetic transcripts of several sizes. With --fanout, the chapters
+are enriched by enrich_chapter.lambda_handler invocations fed from an in-process SQS queue. With --batch, the job is
+processed in batch mode with the local batch executor, and process_transcript.lambda_handler is invoked for each
+output file like the EventBridge rule does.
+Reports wall time, call counts per stage, tokens and peak RSS as JSON.
+
+Example:
+    python -m benchmarks.pipeline --sizes small,medium --latency-dist lognormal --latency-mean 0.05 --throttle-rate 0.02 --output bench.json
+'''
+from . import (
+    fakes,
+    synthetic
+)
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+lambdas_dir = os.path.join(repo_root, 'lambdas')
+bucket = 'benchmark-uploads-bucket'
+enrichment_queue_url = 'https://sqs.local/benchmark-enrich-chapter-queue'
+
+
+def s3_event(bucket_name: str, object_key: str) -> dict:
+    '''
+    Builds the SQS-wrapped EventBridge "Object Created" event that the Lambdas receive.
+    '''
+
+    return {'Records': [{'body': json.dumps({
+        'detail-type': 'Object Created',
+        'source': 'aws.s3',
+        'detail': {
+            'bucket': {'name': bucket_name},
+            'object': {'key': object_key},
+        },
+    })}]}
+
+
+def import_handlers() -> tuple:
+    '''
+    (Re)imports the Lambda handler modules so that any clients they create bind to the installed fakes.
+    Returns a tuple of (transcribe_video, process_transcript, enrich_chapter) modules.
+    '''
+
+    if lambdas_dir not in sys.path:
+        sys.path.insert(0, lambdas_dir)
+
+    for name in list(sys.modules.keys()):
+        if name in ['transcribe_video', 'process_transcript', 'enrich_chapter', 'lib'] or name.startswith('lib.'):
+            del sys.modules[name]
+
+    transcribe_video = importlib.import_module('transcribe_video')
+    process_transcript = importlib.import_module('process_transcript')
+    enrich_chapter = importlib.import_module('enrich_chapter')
+
+    return (transcribe_video, process_transcript, enrich_chapter)
+
+
+def peak_rss_mb() -> float:
+    '''
+    Returns the peak resident set size of this process in MB.
+    '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024, 1)
+
+
+def git_commit() -> str:
+    '''
+    Returns the current git commit hash, or an empty string outside a git checkout.
+    '''
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_root, capture_output=True, text=True).stdout.strip()
+
+    except Exception:
+        return ""
+
+
+def count_replayed_calls(bedrock, aws: fakes.FakeAWS) -> None:
+    '''
+    Wraps bedrock.invoke_model so that calls served from a cassette are still counted per stage.
+    '''
+
+    invoke_model = bedrock.invoke_model
+
+    def counted_invoke_model(messages, model_id="", streaming=False, retries=0):
+        response = invoke_model(messages, model_id, streaming, retries)
+        stage, responder = aws.bedrock.route('\n'.join([c.get('text', '') for c in messages[-1]['content']]))
+        usage = response.get('usage', {})
+        aws.log.count('bedrock', 'replay')
+        aws.log.count_stage(stage, usage.get('inputTokens', 0), usage.get('outputTokens', 0))
+        return response
+
+    bedrock.invoke_model = counted_invoke_model
+
+
+def drain_queue(aws: fakes.FakeAWS, handler, concurrency: int) -> list:
+    '''
+    Invokes the handler with one message of the enrichment queue at a time, with up to concurrency invocations in
+    parallel like the Lambda event source mapping, until the queue is empty. Failed messages are not redelivered.
+    Returns the list of handler responses.
+    '''
+
+    responses = []
+
+    def worker():
+        while True:
+            event = aws.sqs.receive_event(enrichment_queue_url)
+            if event is None:
+                return
+            responses.append(handler(event, None))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(concurrency):
+            pool.submit(worker)
+
+    return responses
+
+
+def resume_batches(aws: fakes.FakeAWS, handler) -> list:
+    '''
+    Invokes the handler with an "Object Created" event for each new batch output file, until no new output is written.
+    Returns the list of handler responses.
+    '''
+
+    responses = []
+    seen = set()
+
+    while True:
+        output_keys = [k for k in aws.s3.keys(bucket) if k[-len('.jsonl.out'):] == '.jsonl.out' and k not in seen]
+
+        if len(output_keys) == 0:
+            return responses
+
+        for k in output_keys:
+            seen.add(k)
+            responses.append(handler(s3_event(bucket, k), None))
+
+
+def load_transcript(size: str, seed: int) -> dict:
+    '''
+    Returns a synthetic transcript for the given size, or reads a Transcribe output JSON if size is a file path.
+    '''
+
+    if size in synthetic.sizes:
+        return synthetic.make_transcript(size, seed)
+
+    with open(size, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_size(size: str, args) -> dict:
+    '''
+    Runs both handlers once for a transcript of the given size (or Transcribe output file).
+    Returns a dictionary of measurements.
+    '''
+
+    latency = fakes.LatencyModel(args.latency_dist, args.latency_mean, args.latency_spread, args.seed)
+    aws = fakes.FakeAWS(latency, args.throttle_rate, args.seed, args.quiz_error_rate)
+    transcript = load_transcript(size, args.seed)
+    size = size if size in synthetic.sizes else 'file'
+
+    job_id = f"bench-{size}-uuid-{args.seed}"
+    video_key = f"{job_id}/vid-lecture.mp4"
+    aws.s3.put(bucket, video_key, b"\x00" * 1024)
+    aws.transcribe.transcripts[f"s3://{bucket}/{video_key}"] = transcript
+
+    logs = io.StringIO()
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(logs)
+
+    with fakes.installed(aws), output:
+        start = time.perf_counter()
+        transcribe_video, process_transcript, enrich_chapter = import_handlers()
+        import_time = time.perf_counter() - start
+
+        from lib import batch, bedrock, enrich_content, fanout, vid_proc
+        bedrock.retry_delay = args.retry_delay
+        enrich_content.quiz_explanations = args.quiz_explanations
+        batch.enabled = args.batch
+        batch.executor = 'local'
+        vid_proc.chapter_mode = args.chapter_mode
+        fanout.queue_url = enrichment_queue_url if args.fanout else ""
+
+        if args.cassette != "":
+            bedrock.set_cassette('replay', args.cassette, args.cassette_timing)
+            count_replayed_calls(bedrock, aws)
+
+        start = time.perf_counter()
+        transcribe_res = transcribe_video.lambda_handler(s3_event(bucket, video_key), None)
+        transcribe_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        process_res = process_transcript.lambda_handler(s3_event(bucket, f"{job_id}/transcript.json"), None)
+        process_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        enrich_res = drain_queue(aws, enrich_chapter.lambda_handler, args.fanout_concurrency) if args.fanout else []
+        enrich_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch_res = resume_batches(aws, process_transcript.lambda_handler) if args.batch else []
+        batch_time = time.perf_counter() - start
+
+    chapters = []
+    if f"{job_id}/chapters.json" in aws.s3.keys(bucket):
+        chapters = json.loads(aws.s3.get(bucket, f"{job_id}/chapters.json", 'GetObject')['data'])
+
+    return {
+        'size': size,
+        'transcript_file': args.transcript_file,
+        'words': len(transcript['results']['transcripts'][0]['transcript'].split()),
+        'audio_segments': len(transcript['results']['audio_segments']),
+        'status': {
+            'transcribe_video': transcribe_res['statusCode'],
+            'process_transcript': process_res['statusCode'],
+            'enrich_chapter': sorted({r['statusCode'] for r in enrich_res}),
+            'batch_resume': [r['statusCode'] for r in batch_res],
+        },
+        'wall_time_s': {
+            'import': round(import_time, 4),
+            'transcribe_video': round(transcribe_time, 4),
+            'process_transcript': round(process_time, 4),
+            'enrich_chapter': round(enrich_time, 4),
+            'batch_resume': round(batch_time, 4),
+            'total': round(import_time + transcribe_time + process_time + enrich_time + batch_time, 4),
+        },
+        'chapters': len(chapters),
+        'quiz_questions': sum([len(c.get('quiz', [])) for c in chapters]),
+        'quiz_explanations': sum([len([q for q in c.get('quiz', []) if 'explanation' in q]) for c in chapters]),
+        **aws.log.to_dict(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_isolated(size: str, argv: list) -> dict:
+    '''
+    Runs a single size in a fresh interpreter so that peak RSS and import times are not shared between sizes.
+    '''
+
+    cmd = [sys.executable, '-m', 'benchmarks.pipeline', '--no-isolate', '--sizes', size] + argv
+    res = subprocess.run(cmd, cwd=repo_root, capture_output=True, text=True)
+
+    if res.returncode != 0:
+        raise RuntimeError(f"Benchmark for size '{size}' failed:\n{res.stderr}")
+
+    return json.loads(res.stdout)['runs'][0]
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the AI Tutor processing pipeline.")
+    parser.add_argument('--sizes', default='small,medium,large', help=f"Comma-separated transcript sizes from {list(synthetic.sizes.keys())}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-dist', default='lognormal', choices=['fixed', 'uniform', 'normal', 'lognormal'])
+    parser.add_argument('--latency-mean', type=float, default=0.02, help="Mean (median for lognormal) Bedrock latency in seconds")
+    parser.add_argument('--latency-spread', type=float, default=0.5, help="Spread of the latency distribution (sigma for lognormal)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of Bedrock calls that raise ThrottlingException")
+    parser.add_argument('--quiz-error-rate', type=float, default=0.0, help="Fraction of generated quiz questions that are malformed")
+    parser.add_argument('--retry-delay', type=float, default=0.01, help="Overrides bedrock.retry_delay (seconds per retry)")
+    parser.add_argument('--transcript-file', default='', help="Runs a Transcribe output JSON (e.g. a production transcript) instead of the synthetic sizes")
+    parser.add_argument('--cassette', default='', help="Replays Bedrock responses from this cassette file instead of the fake Bedrock")
+    parser.add_argument('--cassette-timing', action='store_true', help="Sleeps for the recorded latency of each replayed response")
+    parser.add_argument('--chapter-mode', default='blocks', choices=['blocks', 'topics'], help="Overrides vid_proc.chapter_mode")
+    parser.add_argument('--quiz-explanations', action='store_true', help="Enables enrich_content.quiz_explanations, which is off by default")
+    parser.add_argument('--fanout', action='store_true', help="Enriches the chapters with enrich_chapter invocations fed from an in-process queue")
+    parser.add_argument('--fanout-concurrency', type=int, default=10, help="Concurrent enrich_chapter invocations in fan-out mode")
+    parser.add_argument('--batch', action='store_true', help="Processes the transcript in batch mode with the local batch executor")
+    parser.add_argument('--output', default='', help="Writes the JSON report to this file instead of stdout")
+    parser.add_argument('--no-isolate', action='store_true', help="Runs all sizes in this process")
+    parser.add_argument('--verbose', action='store_true', help="Shows the handlers' log output")
+    args = parser.parse_args(argv)
+
+    if args.batch and args.chapter_mode != 'blocks':
+        parser.error("--batch only supports --chapter-mode blocks")
+
+    return args
+
+
+def main(argv: list = None) -> dict:
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip() != ""]
+    sizes = [args.transcript_file] if args.transcript_file != "" else sizes
+
+    for s in sizes:
+        if s not in synthetic.sizes and s != args.transcript_file:
+            raise ValueError(f"Unknown size: {s}")
+
+    # the isolated runs share every option except the sizes and the output file
+    forward = [
+        '--seed', str(args.seed),
+        '--latency-dist', args.latency_dist,
+        '--latency-mean', str(args.latency_mean),
+        '--latency-spread', str(args.latency_spread),
+        '--throttle-rate', str(args.throttle_rate),
+        '--quiz-error-rate', str(args.quiz_error_rate),
+        '--retry-delay', str(args.retry_delay),
+        '--transcript-file', args.transcript_file,
+        '--cassette', args.cassette,
+        '--fanout-concurrency', str(args.fanout_concurrency),
+        '--chapter-mode', args.chapter_mode,
+    ] + (['--cassette-timing'] if args.cassette_timing else []) + (['--quiz-explanations'] if args.quiz_explanations else []) + (['--fanout'] if args.fanout else []) + (['--batch'] if args.batch else [])
+
+    runs = [run_size(s, args) if args.no_isolate else run_isolated(s, forward) for s in sizes]
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {
+            'seed': args.seed,
+            'latency_dist': args.latency_dist,
+            'latency_mean': args.latency_mean,
+            'latency_spread': args.latency_spread,
+            'throttle_rate': args.throttle_rate,
+            'quiz_error_rate': args.quiz_error_rate,
+            'retry_delay': args.retry_delay,
+            'cassette': args.cassette,
+            'cassette_timing': args.cassette_timing,
+            'chapter_mode': args.chapter_mode,
+            'quiz_explanations': args.quiz_explanations,
+            'fanout': args.fanout,
+            'fanout_concurrency': args.fanout_concurrency,
+            'batch': args.batch,
+        },
+        'runs': runs,
+    }
+
+    if args.output != "":
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+'''
+Cold-start benchmark for the Lambda handlers.
+
+Each handler is packaged into a temporary folder with only the modules listed for it in
+cdk_stacks/lambda_modules.py, then imported in fresh interpreters. The benchmark reports the import time,
+the init time (import plus creating the boto3 clients the handler uses), and the number of modules loaded.
+It exits with status 1 if the median import time of any handler exceeds the budget, so it can gate CI.
+
+Example:
+    python -m benchmarks.startup --repeats 5 --import-budget-ms 50
+'''
+from cdk_stacks.lambda_modules import lambda_modules
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+lambdas_dir = os.path.join(repo_root, 'lambdas')
+import_budget_ms = 50.0     # maximum median import time per handler, enforced by tests/test_startup.py and the exit status
+
+# boto3 clients that each handler creates on its first invocation
+handler_clients = {
+    'transcribe_video': ['transcribe', 's3'],
+    'process_transcript': ['s3', 'bedrock-runtime'],
+    'enrich_chapter': ['s3', 'bedrock-runtime'],
+    'track_transcribe_job': ['s3'],
+    'ingest_kb': ['s3'],
+}
+
+
+def package_handler(handler_module: str, target_dir: str) -> None:
+    '''
+    Copies only the handler's packaged modules into target_dir, mirroring the Lambda asset.
+    '''
+
+    for m in lambda_modules[handler_module]:
+        target = os.path.join(target_dir, m)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(os.path.join(lambdas_dir, m), target)
+
+
+def measure_child(handler_module: str) -> dict:
+    '''
+    Runs inside the fresh interpreter: imports the handler and creates its clients.
+    Returns a dictionary of timings in milliseconds.
+    '''
+
+    modules_before = len(sys.modules)
+
+    start = time.perf_counter()
+    __import__(handler_module)
+    import_ms = (time.perf_counter() - start) * 1000
+    modules_after_import = len(sys.modules)
+
+    from lib import utils
+    for service_name in handler_clients[handler_module]:
+        utils.get_client(service_name)
+    init_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'import_ms': import_ms,
+        'init_ms': init_ms,
+        'modules_imported': modules_after_import - modules_before,
+    }
+
+
+def measure(handler_module: str, repeats: int) -> dict:
+    '''
+    Measures the handler in `repeats` fresh interpreters.
+    Returns a dictionary with the median and max of each timing.
+    '''
+
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    samples = []
+
+    with tempfile.TemporaryDirectory() as package_dir:
+        package_handler(handler_module, package_dir)
+
+        for i in range(repeats):
+            cmd = [
+                sys.executable, '-c',
+                f"import sys, json; sys.path.insert(0, {package_dir!r}); sys.path.insert(1, {repo_root!r}); "
+                f"from benchmarks import startup; print(json.dumps(startup.measure_child({handler_module!r})))",
+            ]
+            res = subprocess.run(cmd, cwd=package_dir, env=env, capture_output=True, text=True)
+
+            if res.returncode != 0:
+                raise RuntimeError(f"Failed to import {handler_module} from its package:\n{res.stderr}")
+
+            samples.append(json.loads(res.stdout.strip().splitlines()[-1]))
+
+    return {
+        'package': lambda_modules[handler_module],
+        'import_ms': {
+            'median': round(statistics.median([s['import_ms'] for s in samples]), 2),
+            'max': round(max([s['import_ms'] for s in samples]), 2),
+        },
+        'init_ms': {
+            'median': round(statistics.median([s['init_ms'] for s in samples]), 2),
+            'max': round(max([s['init_ms'] for s in samples]), 2),
+        },
+        'modules_imported': samples[-1]['modules_imported'],
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the Lambda handlers.")
+    parser.add_argument('--handlers', default=','.join(lambda_modules.keys()))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=import_budget_ms, help="Maximum median import time per handler")
+    parser.add_argument('--output', default='', help="Writes the JSON report to this file instead of stdout")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    handlers = [h.strip() for h in args.handlers.split(',') if h.strip() != ""]
+    report = {
+        'import_budget_ms': args.import_budget_ms,
+        'handlers': {h: measure(h, args.repeats) for h in handlers},
+    }
+
+    over_budget = [h for h, r in report['handlers'].items() if r['import_ms']['median'] > args.import_budget_ms]
+    report['over_budget'] = over_budget
+
+    if args.output != "":
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if len(over_budget) > 0:
+        print(f"\nERROR: import time over budget for {over_budget}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import random
+
+
+# number of topics and approximate word count for each benchmark size
+sizes = {
+    'small': {'topics': 3, 'words': 1500},
+    'medium': {'topics': 6, 'words': 6000},
+    'large': {'topics': 12, 'words': 20000},
+}
+
+topic_words = [
+    ('Photosynthesis', ['chlorophyll', 'light', 'glucose', 'leaf', 'carbon', 'oxygen', 'energy', 'plant']),
+    ('Cell Division', ['mitosis', 'chromosome', 'nucleus', 'spindle', 'daughter', 'cell', 'phase', 'division']),
+    ('Genetics', ['gene', 'allele', 'dominant', 'recessive', 'trait', 'inheritance', 'mendel', 'dna']),
+    ('Evolution', ['selection', 'species', 'fitness', 'mutation', 'adaptation', 'darwin', 'population', 'variation']),
+    ('Ecology', ['ecosystem', 'predator', 'prey', 'habitat', 'niche', 'biome', 'community', 'resource']),
+    ('Respiration', ['mitochondria', 'atp', 'pyruvate', 'krebs', 'electron', 'oxygen', 'glucose', 'enzyme']),
+    ('Proteins', ['amino', 'ribosome', 'folding', 'peptide', 'enzyme', 'structure', 'translation', 'codon']),
+    ('Viruses', ['capsid', 'host', 'replication', 'infection', 'vaccine', 'antigen', 'immune', 'spread']),
+    ('Nervous System', ['neuron', 'synapse', 'axon', 'signal', 'brain', 'reflex', 'potential', 'transmitter']),
+    ('Hormones', ['insulin', 'gland', 'receptor', 'feedback', 'thyroid', 'adrenaline', 'blood', 'signal']),
+    ('Immunity', ['antibody', 'lymphocyte', 'pathogen', 'memory', 'response', 'macrophage', 'antigen', 'barrier']),
+    ('Microbiome', ['bacteria', 'gut', 'diversity', 'digestion', 'probiotic', 'community', 'colony', 'balance']),
+    ('Biotechnology', ['crispr', 'cloning', 'vector', 'plasmid', 'sequencing', 'editing', 'marker', 'culture']),
+    ('Photoreceptors', ['retina', 'rod', 'cone', 'pigment', 'vision', 'light', 'signal', 'colour']),
+]
+
+filler_words = ['the', 'a', 'we', 'now', 'this', 'is', 'how', 'so', 'that', 'and', 'when', 'you', 'see', 'look', 'at', 'what', 'happens', 'next', 'really', 'important']
+
+
+def make_sentence(rng: random.Random, vocab: list) -> str:
+    '''
+    Generates a single sentence mixing topic vocabulary and filler words.
+    Returns a string.
+    '''
+
+    length = rng.randint(8, 16)
+    words = [rng.choice(vocab) if rng.random() < .4 else rng.choice(filler_words) for i in range(length)]
+    return f"{' '.join(words).capitalize()}."
+
+
+def make_transcript(size: str, seed: int = 0) -> dict:
+    '''
+    Generates a synthetic Transcribe output for the given size ("small", "medium", or "large").
+    Each topic block starts with a "Section N: Title." sentence so that the fake Bedrock can locate topics.
+    Returns a dictionary in the same shape as the Transcribe output JSON.
+    '''
+
+    rng = random.Random(f"{size}-{seed}")
+    n_topics = sizes[size]['topics']
+    words_per_topic = sizes[size]['words'] // n_topics
+
+    segments = []
+    clock = 0.0
+
+    for t in range(n_topics):
+        title, vocab = topic_words[t % len(topic_words)]
+        title = title if t < len(topic_words) else f"{title} {t // len(topic_words) + 1}"
+        sentences = [f"Section {t + 1}: {title}."]
+        word_count = 0
+
+        while word_count < words_per_topic:
+            sentence = make_sentence(rng, vocab)
+            sentences.append(sentence)
+            word_count += len(sentence.split())
+
+        # group sentences into audio segments of 2-3 sentences each
+        while len(sentences) > 0:
+            take = rng.randint(2, 3)
+            text = ' '.join(sentences[:take])
+            sentences = sentences[take:]
+            duration = len(text.split()) / 2.5
+
+            segments.append({
+                'id': len(segments),
+                'transcript': text,
+                'start_time': f"{clock:.3f}",
+                'end_time': f"{clock + duration:.3f}",
+            })
+            clock += duration
+
+    return {
+        'jobName': f"synthetic-{size}-{seed}",
+        'status': 'COMPLETED',
+        'results': {
+            'transcripts': [{'transcript': ' '.join([s['transcript'] for s in segments])}],
+            'audio_segments': segments,
+        },
+    }
@@ -0,0 +1,69 @@
+# modules packaged with each Lambda function, relative to the lambdas folder
+lambda_modules = {
+    'transcribe_video': [
+        'transcribe_video.py',
+        'lib/dedup.py',
+        'lib/job_tracker.py',
+        'lib/manifest.py',
+        'lib/retrieval.py',
+        'lib/s3.py',
+        'lib/search_index.py',
+        'lib/tracing.py',
+        'lib/utils.py',
+    ],
+    'process_transcript': [
+        'process_transcript.py',
+        'lib/batch.py',
+        'lib/bedrock.py',
+        'lib/context_pack.py',
+        'lib/dedup.py',
+        'lib/enrich_content.py',
+        'lib/fanout.py',
+        'lib/manifest.py',
+        'lib/outputs.py',
+        'lib/retrieval.py',
+        'lib/s3.py',
+        'lib/scheduler.py',
+        'lib/search_index.py',
+        'lib/segmentation.py',
+        'lib/tokens.py',
+        'lib/transcribe.py',
+        'lib/tracing.py',
+        'lib/utils.py',
+        'lib/vid_proc.py',
+    ],
+    'enrich_chapter': [
+        'enrich_chapter.py',
+        'lib/bedrock.py',
+        'lib/context_pack.py',
+        'lib/dedup.py',
+        'lib/enrich_content.py',
+        'lib/fanout.py',
+        'lib/manifest.py',
+        'lib/outputs.py',
+        'lib/retrieval.py',
+        'lib/s3.py',
+        'lib/scheduler.py',
+        'lib/search_index.py',
+        'lib/tokens.py',
+        'lib/tracing.py',
+        'lib/utils.py',
+    ],
+    'track_transcribe_job': [
+        'track_transcribe_job.py',
+        'lib/dedup.py',
+        'lib/job_tracker.py',
+        'lib/manifest.py',
+        'lib/s3.py',
+        'lib/tracing.py',
+        'lib/utils.py',
+    ],
+    'ingest_kb': [
+        'ingest_kb.py',
+        'lib/kb.py',
+        'lib/retrieval.py',
+        'lib/s3.py',
+        'lib/tracing.py',
+        'lib/utils.py',
+    ],
+}
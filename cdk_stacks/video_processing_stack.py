@@ -11,8 +11,28 @@ from aws_cdk import (
     RemovalPolicy,
 )
 from constructs import Construct
+from cdk_stacks.lambda_modules import lambda_modules
 
 vid_lambda_timeout = Duration.minutes(15)
+enrich_lambda_timeout = Duration.minutes(5)
+enrich_max_receive_count = 3    # receives of a chapter message before it is moved to the dead-letter queue and the job is marked failed
+enrichment_fanout = False   # enrich each chapter in a separate Lambda invocation instead of within the process transcript Lambda
+quiz_explanations = False   # precompute an explanation of each quiz answer, served by the tutor chat without a model call
+tracker_reconcile_interval = Duration.minutes(10)  # how often in-flight jobs of the job-state table are refreshed from Transcribe, e.g. after missed events
+batch_executor = "bedrock"  # executor of the stages of jobs in batch mode, e.g. backlog jobs, see lambdas/lib/batch.py
+batch_flush_interval = Duration.minutes(15)     # how often batch inference jobs are checked for failures and the batch mode record pool is flushed
+
+
+def lambda_code(handler_module: str) -> lambda_.Code:
+    '''
+    Packages the lambdas folder with only the modules listed for the handler in lambda_modules.
+    '''
+
+    return lambda_.Code.from_asset(
+        "lambdas",
+        exclude=['*'] + [f"!{m}" for m in lambda_modules[handler_module]],
+    )
+
 
 class VideoProcessingStack(NestedStack):
 
@@ -65,8 +85,9 @@ class VideoProcessingStack(NestedStack):
             self, f"{app_name}-Transcribe-Lambda",
             function_name=f"{app_name}-Transcribe-Lambda",
             runtime=lambda_.Runtime.PYTHON_3_13,
-            code=lambda_.Code.from_asset("lambdas"),
+            code=lambda_code('transcribe_video'),
             handler="transcribe_video.lambda_handler",
+            timeout=Duration.seconds(60),
         )
         lambda_transcribe_job.add_event_source(
             lambda_event_sources.SqsEventSource(
@@ -99,6 +120,76 @@ class VideoProcessingStack(NestedStack):
 
         # endregion
 
+        # region Track Transcribe Jobs
+        # Create a job state-change SQS queue with a dead-letter queue
+        track_transcribe_dlq = sqs.Queue(
+            self, f"{app_name}-TrackTranscribe-DLQ",
+            queue_name=f"{app_name}-TrackTranscribe-DLQ",
+            removal_policy=RemovalPolicy.DESTROY,
+            enforce_ssl=True,
+        )
+
+        track_transcribe_queue = sqs.Queue(
+            self, f"{app_name}-TrackTranscribe-Queue",
+            queue_name=f"{app_name}-TrackTranscribe-Queue",
+            visibility_timeout=Duration.seconds(100),
+            receive_message_wait_time=Duration.seconds(20),
+            removal_policy=RemovalPolicy.DESTROY,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=2,
+                queue=track_transcribe_dlq
+            ),
+            enforce_ssl=True,
+        )
+
+        # Lambda function to record Transcribe job state changes in the job-state table
+        lambda_track_transcribe_job = lambda_.Function(
+            self, f"{app_name}-TrackTranscribe-Lambda",
+            function_name=f"{app_name}-TrackTranscribe-Lambda",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            code=lambda_code('track_transcribe_job'),
+            handler="track_transcribe_job.lambda_handler",
+            environment={"UPLOADS_BUCKET": uploads_bucket.bucket_name},
+        )
+        lambda_track_transcribe_job.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                queue=track_transcribe_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                max_concurrency=2
+            )
+        )
+
+        # Grant Lambda job-state table permissions
+        uploads_bucket.grant_read_write(lambda_track_transcribe_job)
+        track_transcribe_queue.grant_consume_messages(lambda_track_transcribe_job)
+        lambda_track_transcribe_job.add_to_role_policy(iam.PolicyStatement(
+            actions=['transcribe:ListTranscriptionJobs'], resources=['*']))    # list actions do not support resource-level permissions
+
+        # EventBridge rule to reconcile the job-state table with Transcribe on a schedule
+        track_transcribe_schedule_rule = events.Rule(
+            self, f"{app_name}-TrackTranscribe-ScheduleRule",
+            rule_name=f"{app_name}-track-transcribe-schedule",
+            schedule=events.Schedule.rate(tracker_reconcile_interval),
+        )
+        track_transcribe_schedule_rule.add_target(targets.LambdaFunction(lambda_track_transcribe_job))
+
+        # EventBridge rule to trigger on Transcribe job completion and failure
+        track_transcribe_event_rule = events.Rule(
+            self, f"{app_name}-TrackTranscribe-EventRule",
+            rule_name=f"{app_name}-track-transcribe-rule",
+            event_pattern=events.EventPattern(
+                source=["aws.transcribe"],
+                detail_type=["Transcribe Job State Change"],
+                detail={
+                    "TranscriptionJobStatus": ["COMPLETED", "FAILED"],
+                },
+            ),
+        )
+        track_transcribe_event_rule.add_target(targets.SqsQueue(track_transcribe_queue))
+
+        # endregion
+
         # region Process Transcript
         # Create an transcription job SQS queue with a dead-letter queue
         process_transcript_dlq = sqs.Queue(
@@ -121,14 +212,49 @@ class VideoProcessingStack(NestedStack):
             enforce_ssl=True,
         )
 
+        # Create a per-chapter enrichment SQS queue with a dead-letter queue, fed by the process transcript Lambda in fan-out mode
+        enrich_chapter_dlq = sqs.Queue(
+            self, f"{app_name}-EnrichChapter-DLQ",
+            queue_name=f"{app_name}-EnrichChapter-DLQ",
+            removal_policy=RemovalPolicy.DESTROY,
+            enforce_ssl=True,
+        )
+
+        enrich_chapter_queue = sqs.Queue(
+            self, f"{app_name}-EnrichChapter-Queue",
+            queue_name=f"{app_name}-EnrichChapter-Queue",
+            visibility_timeout=enrich_lambda_timeout,
+            receive_message_wait_time=Duration.seconds(20),
+            removal_policy=RemovalPolicy.DESTROY,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=enrich_max_receive_count,
+                queue=enrich_chapter_dlq
+            ),
+            enforce_ssl=True,
+        )
+
+        # Service role that Bedrock batch inference jobs assume to read the stage inputs and write the outputs in batch mode
+        batch_inference_role = iam.Role(
+            self, f"{app_name}-BatchInference-Role",
+            assumed_by=iam.ServicePrincipal("bedrock.amazonaws.com"),
+        )
+        uploads_bucket.grant_read_write(batch_inference_role)
+
         # Lambda function to process and enrich the transcript
         lambda_process_transcript = lambda_.Function(
             self, f"{app_name}-ProcessTranscript-Lambda",
             function_name=f"{app_name}-ProcessTranscript-Lambda",
             runtime=lambda_.Runtime.PYTHON_3_13,
-            code=lambda_.Code.from_asset("lambdas"),
+            code=lambda_code('process_transcript'),
             handler="process_transcript.lambda_handler",
             timeout=vid_lambda_timeout,
+            environment={
+                **({"ENRICHMENT_QUEUE_URL": enrich_chapter_queue.queue_url} if enrichment_fanout else {}),
+                "QUIZ_EXPLANATIONS": "1" if quiz_explanations else "0",
+                "BATCH_EXECUTOR": batch_executor,
+                "BATCH_ROLE_ARN": batch_inference_role.role_arn,
+                "UPLOADS_BUCKET": uploads_bucket.bucket_name,
+            },
         )
         lambda_process_transcript.add_event_source(
             lambda_event_sources.SqsEventSource(
@@ -141,10 +267,15 @@ class VideoProcessingStack(NestedStack):
         # Grant Lambda Transcribe permissions
         lambda_process_transcript.add_to_role_policy(iam.PolicyStatement(
             actions=['bedrock:InvokeModel'], resources=['*']))    # wildcard permission is enabled to allow access to any model that is available within the account
+        lambda_process_transcript.add_to_role_policy(iam.PolicyStatement(
+            actions=['bedrock:CreateModelInvocationJob', 'bedrock:GetModelInvocationJob'], resources=['*']))
+        batch_inference_role.grant_pass_role(lambda_process_transcript)
         uploads_bucket.grant_read_write(lambda_process_transcript)
+        uploads_bucket.grant_delete(lambda_process_transcript)      # merged search index segments and submitted batch mode records are deleted
         process_transcript_queue.grant_consume_messages(lambda_process_transcript)
 
-        # EventBridge rule to trigger on S3 PutObject events for transcript files
+        # EventBridge rule to trigger on S3 PutObject events for transcript files and the output files of batch inference
+        # jobs (other JSON objects such as outputs and the job-state table do not trigger the Lambda)
         process_transcript_event_rule = events.Rule(
             self, f"{app_name}-ProcessTranscript-EventRule",
             rule_name=f"{app_name}-ProcessTranscript-rule",
@@ -153,12 +284,112 @@ class VideoProcessingStack(NestedStack):
                 detail_type=["Object Created"],
                 detail={
                     "bucket": {"name": [uploads_bucket.bucket_name]},
-                    "object": {"key": [{"suffix": ".json"}]},
+                    "object": {"key": [{"suffix": "transcript.json"}, {"suffix": ".jsonl.out"}]},
                 },
             ),
         )
         process_transcript_event_rule.add_target(targets.SqsQueue(process_transcript_queue))
 
+        # EventBridge rule to check the batch inference jobs for failures and flush the batch mode record pool on a schedule
+        process_transcript_schedule_rule = events.Rule(
+            self, f"{app_name}-ProcessTranscript-ScheduleRule",
+            rule_name=f"{app_name}-process-transcript-schedule",
+            schedule=events.Schedule.rate(batch_flush_interval),
+        )
+        process_transcript_schedule_rule.add_target(targets.LambdaFunction(lambda_process_transcript))
+
+        # Lambda function to enrich one chapter with a quiz and a summary; the invocation that completes the last chapter
+        # of a job assembles chapters.json
+        lambda_enrich_chapter = lambda_.Function(
+            self, f"{app_name}-EnrichChapter-Lambda",
+            function_name=f"{app_name}-EnrichChapter-Lambda",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            code=lambda_code('enrich_chapter'),
+            handler="enrich_chapter.lambda_handler",
+            timeout=enrich_lambda_timeout,
+            environment={
+                "QUIZ_EXPLANATIONS": "1" if quiz_explanations else "0",
+                "MAX_RECEIVE_COUNT": str(enrich_max_receive_count),
+            },
+        )
+        lambda_enrich_chapter.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                queue=enrich_chapter_queue,
+                batch_size=1,
+                max_concurrency=10,     # bounds the concurrent Bedrock requests across all jobs
+                report_batch_item_failures=True,
+            )
+        )
+
+        lambda_enrich_chapter.add_to_role_policy(iam.PolicyStatement(
+            actions=['bedrock:InvokeModel'], resources=['*']))    # wildcard permission is enabled to allow access to any model that is available within the account
+        uploads_bucket.grant_read_write(lambda_enrich_chapter)
+        uploads_bucket.grant_delete(lambda_enrich_chapter)
+        enrich_chapter_queue.grant_consume_messages(lambda_enrich_chapter)
+        enrich_chapter_queue.grant_send_messages(lambda_process_transcript)
+
+        # endregion
+
+        # region Ingest KB
+        # Create a knowledge-base ingestion SQS queue with a dead-letter queue
+        ingest_kb_dlq = sqs.Queue(
+            self, f"{app_name}-IngestKB-DLQ",
+            queue_name=f"{app_name}-IngestKB-DLQ",
+            removal_policy=RemovalPolicy.DESTROY,
+            enforce_ssl=True,
+        )
+
+        ingest_kb_queue = sqs.Queue(
+            self, f"{app_name}-IngestKB-Queue",
+            queue_name=f"{app_name}-IngestKB-Queue",
+            visibility_timeout=Duration.seconds(300),
+            receive_message_wait_time=Duration.seconds(20),
+            removal_policy=RemovalPolicy.DESTROY,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=2,
+                queue=ingest_kb_dlq
+            ),
+            enforce_ssl=True,
+        )
+
+        # Lambda function to add kb/ documents to the job's retrieval index
+        lambda_ingest_kb = lambda_.Function(
+            self, f"{app_name}-IngestKB-Lambda",
+            function_name=f"{app_name}-IngestKB-Lambda",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            code=lambda_code('ingest_kb'),
+            handler="ingest_kb.lambda_handler",
+            timeout=Duration.seconds(300),
+            memory_size=512,
+        )
+        lambda_ingest_kb.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                queue=ingest_kb_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                max_concurrency=2
+            )
+        )
+
+        uploads_bucket.grant_read_write(lambda_ingest_kb)
+        ingest_kb_queue.grant_consume_messages(lambda_ingest_kb)
+
+        # EventBridge rule to trigger on kb/ uploads and deletions, and on writes of the retrieval index
+        # (the Lambda only writes the index if documents changed, so its own writes do not retrigger it indefinitely)
+        ingest_kb_event_rule = events.Rule(
+            self, f"{app_name}-IngestKB-EventRule",
+            rule_name=f"{app_name}-ingest-kb-rule",
+            event_pattern=events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created", "Object Deleted"],
+                detail={
+                    "bucket": {"name": [uploads_bucket.bucket_name]},
+                    "object": {"key": [{"wildcard": "*/kb/*"}, {"suffix": "retrieval_index.json"}]},
+                },
+            ),
+        )
+        ingest_kb_event_rule.add_target(targets.SqsQueue(ingest_kb_queue))
+
         # outputs
         self.bucket_name = uploads_bucket.bucket_name
 
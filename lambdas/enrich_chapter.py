@@ -0,0 +1,59 @@
+from lib import (
+    fanout,
+    manifest,
+    scheduler,
+    tracing
+)
+import json
+import os
+
+
+# receives of a message before SQS moves it to the dead-letter queue; a job is only marked failed on the last receive
+max_receive_count = int(os.environ.get('MAX_RECEIVE_COUNT', '3'))
+
+
+@tracing.handler('enrich_chapter')
+def lambda_handler(event, context):
+    '''
+    Enriches the chapters enqueued by the process transcript Lambda in fan-out mode with a quiz and a summary.
+    The invocation that completes the last chapter of a job writes chapters.json and the other outputs.
+    Failed messages are reported as batch item failures, so that only they are retried, and the job is only marked as
+    failed once its message was received for the last time. Messages without a receive count, e.g. in local runs, are
+    treated as received for the last time.
+    Returns the enriched chapters and the batch item failures.
+    '''
+
+    # cancel model calls that cannot finish before the Lambda times out
+    scheduler.set_deadline(context)
+
+    results = []
+    failures = []
+
+    for record in event['Records']:
+        bucket = ""
+        job_id = ""
+
+        try:
+            message_body = json.loads(record['body'])
+            bucket = message_body['bucket']
+            job_id = message_body['job_id']
+            chapter_id = message_body['chapter_id']
+
+            with tracing.span('chapter', chapter=chapter_id):
+                chapters_s3_key = fanout.enrich_chapter(bucket, job_id, chapter_id)
+
+            results.append({'job_id': job_id, 'chapter_id': chapter_id, 'assembled': chapters_s3_key})
+
+        except Exception as e:
+            print(f"\nERROR in lambda_handler: {e}")
+            failures.append({'itemIdentifier': record.get('messageId', "")})
+
+            receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', max_receive_count))
+            if job_id != "" and receive_count >= max_receive_count:
+                manifest.update_job(bucket, job_id, status='failed', error=str(e))
+
+    return {
+            'statusCode': 200 if len(failures) == 0 else 500,
+            'body': json.dumps(results),
+            'batchItemFailures': failures,
+        }
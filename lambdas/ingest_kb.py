@@ -0,0 +1,49 @@
+from lib import (
+    kb,
+    tracing
+)
+import json
+
+
+@tracing.handler('ingest_kb')
+def lambda_handler(event, context):
+    '''
+    Adds the documents uploaded under a job's kb/ prefix to the job's retrieval index, re-indexing only new or changed
+    documents. Triggered by kb/ uploads and deletions, and by writes of the retrieval index itself, so that an index
+    replaced by the pipeline (e.g. copied from a duplicate video) is brought back in sync with the job's documents.
+    Each job in the batch is synced once.
+    Returns the sync results per job.
+    '''
+
+    try:
+        jobs = {}
+
+        for record in event['Records']:
+            message_body = json.loads(record['body'])
+            bucket = message_body['detail']['bucket']['name']
+            object_key = message_body['detail']['object']['key']
+
+            # skip internal objects, e.g. the job manifest
+            if object_key[:1] == '_':
+                continue
+
+            if '/kb/' in object_key:
+                job_prefix, sep, junk = object_key.partition('/kb/')
+            else:
+                job_prefix, sep, junk = object_key.rpartition('/')
+
+            jobs[job_prefix] = bucket
+
+        results = {job_prefix: kb.sync_index(bucket, job_prefix) for job_prefix, bucket in jobs.items()}
+
+        return {
+                'statusCode': 200,
+                'body': json.dumps(results)
+            }
+
+    except Exception as e:
+        print(f"\nERROR in lambda_handler: {e}")
+        return {
+                'statusCode': 500,
+                'body': json.dumps({'ERROR': str(e)})
+            }
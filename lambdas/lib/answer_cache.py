@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+import time
+
+
+# process-wide cache of tutor answers per job, shared by all sessions of the UI
+shingle_size = 4            # characters per shingle of the normalized question
+num_hashes = 64             # MinHash signature length
+threshold = 0.8             # estimated Jaccard similarity above which a cached answer is reused
+max_entries_per_job = 200   # least recently used answers are evicted above this number
+max_jobs = 50               # least recently used jobs are evicted above this number, with all their answers
+stream_words = 4            # words per event when a cached answer is replayed as a stream
+stream_delay = 0.02         # seconds between replayed events
+
+prime = (1 << 61) - 1
+seeds = [(int.from_bytes(hashlib.sha256(f"a{i}".encode('utf-8')).digest()[:8], 'big') % prime or 1,
+          int.from_bytes(hashlib.sha256(f"b{i}".encode('utf-8')).digest()[:8], 'big') % prime) for i in range(num_hashes)]
+
+jobs = OrderedDict()    # {job_id: {'version': str, 'entries': OrderedDict({normalized question: entry})}}
+stats = {'lookups': 0, 'exact_hits': 0, 'near_hits': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+cache_lock = threading.Lock()
+
+
+def normalize(question: str) -> str:
+    '''
+    Lowercases the question and removes punctuation and repeated whitespace.
+    Returns a string.
+    '''
+
+    return ' '.join(re.findall(r"[a-z0-9]+", question.lower()))
+
+
+def get_signature(text: str) -> list:
+    '''
+    Computes the MinHash signature of the character shingles of the normalized text.
+    Returns a list of num_hashes integers.
+    '''
+
+    shingles = {text[i:i + shingle_size] for i in range(max(len(text) - shingle_size + 1, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+
+    return [min([(a * h + b) % prime for h in hashes]) for a, b in seeds]
+
+
+def get_numbers(text: str) -> list:
+    '''
+    Returns the tokens of the normalized text that contain digits, e.g. ['3rd'].
+    Near-duplicate questions must refer to the same numbers, since "the 2nd quiz question" and "the 3rd quiz question"
+    are otherwise almost identical.
+    '''
+
+    return [t for t in text.split(' ') if re.search(r"[0-9]", t)]
+
+
+def get_similarity(signature_a: list, signature_b: list) -> float:
+    '''
+    Estimates the Jaccard similarity of two MinHash signatures.
+    Returns a float between 0 and 1.
+    '''
+
+    return sum([1 for a, b in zip(signature_a, signature_b) if a == b]) / num_hashes
+
+
+def get_job(job_id: str, version: str) -> dict:
+    '''
+    Returns the cache of the job. The cache is cleared if the version (e.g. the ETag of chapters.json) changed, and the
+    least recently used jobs are evicted above max_jobs.
+    Must be called while holding cache_lock.
+    '''
+
+    job = jobs.setdefault(job_id, {'version': version, 'entries': OrderedDict()})
+    jobs.move_to_end(job_id)
+
+    if job['version'] != version:
+        stats['invalidations'] += 1
+        job['version'] = version
+        job['entries'] = OrderedDict()
+
+    while len(jobs) > max_jobs:
+        evicted_id, evicted = jobs.popitem(last=False)
+        stats['evictions'] += len(evicted['entries'])
+
+    return job
+
+
+def lookup(job_id: str, version: str, question: str) -> str:
+    '''
+    Looks up the answer to the question, or to a near-duplicate question, for the job.
+    Returns the cached answer as a string, or None on a miss.
+    '''
+
+    normalized = normalize(question)
+
+    with cache_lock:
+        stats['lookups'] += 1
+        entries = get_job(job_id, version)['entries']
+        entry = entries.get(normalized)
+
+        if entry is not None:
+            stats['exact_hits'] += 1
+        else:
+            signature = get_signature(normalized)
+            numbers = get_numbers(normalized)
+            candidates = [(get_similarity(signature, e['signature']), k) for k, e in entries.items() if get_numbers(k) == numbers]
+            best = max(candidates, default=(0, None))
+
+            if best[0] < threshold:
+                return None
+
+            stats['near_hits'] += 1
+            normalized = best[1]
+            entry = entries[normalized]
+
+        entries.move_to_end(normalized)
+        entry['hits'] += 1
+        return entry['answer']
+
+
+def store(job_id: str, version: str, question: str, answer: str) -> None:
+    '''
+    Stores the answer to the question for the job, evicting the least recently used answers above max_entries_per_job.
+    '''
+
+    normalized = normalize(question)
+
+    with cache_lock:
+        entries = get_job(job_id, version)['entries']
+        entries[normalized] = {'question': question, 'answer': answer, 'signature': get_signature(normalized), 'hits': 0}
+        entries.move_to_end(normalized)
+        stats['stores'] += 1
+
+        while len(entries) > max_entries_per_job:
+            entries.popitem(last=False)
+            stats['evictions'] += 1
+
+
+def get_stats() -> dict:
+    '''
+    Returns a copy of the cache metrics, including the hit rate and the number of cached answers.
+    '''
+
+    with cache_lock:
+        hits = stats['exact_hits'] + stats['near_hits']
+        return {
+            **stats,
+            'hit_rate': round(hits / stats['lookups'], 3) if stats['lookups'] > 0 else 0,
+            'entries': sum([len(job['entries']) for job in jobs.values()]),
+        }
+
+
+def replay_stream(answer: str):
+    '''
+    Replays a cached answer as converse_stream events, so that it is rendered like a streamed response.
+    Returns a generator of events.
+    '''
+
+    words = answer.split(' ')
+
+    for i in range(0, len(words), stream_words):
+        text = ' '.join(words[i:i + stream_words])
+        yield {'contentBlockDelta': {'delta': {'text': text if i + stream_words >= len(words) else f"{text} "}}}
+        time.sleep(stream_delay)
+
+    yield {'messageStop': {'stopReason': 'end_turn'}}
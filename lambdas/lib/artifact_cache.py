@@ -0,0 +1,186 @@
+from . import (
+    s3,
+    utils
+)
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# process-wide cache of S3 objects on local disk, shared by all sessions of the UI
+cache_dir = "temp/cache/"
+max_cache_bytes = 2 * 1024 ** 3     # least recently used objects are evicted above this size
+revalidate_after = 10               # seconds during which a cached object is served without a conditional GET
+fanout = 8
+
+entries = {}        # {(bucket, key): {'etag': str, 'path': str, 'size': int, 'last_used': float, 'validated': float}}
+parsed_json = {}    # {(bucket, key, etag): parsed object}
+cache_lock = threading.Lock()
+key_locks = {}
+
+
+def get_key_lock(cache_key: tuple) -> threading.Lock:
+    '''
+    Returns the lock for a cached object, so that concurrent sessions download each object only once.
+    '''
+
+    with cache_lock:
+        return key_locks.setdefault(cache_key, threading.Lock())
+
+
+def load_index() -> None:
+    '''
+    Loads the cache index from disk on first use, so that the cache survives restarts of the app.
+    '''
+
+    with cache_lock:
+        if len(entries) > 0 or not os.path.isfile(f"{cache_dir}index.json"):
+            return
+
+        with open(f"{cache_dir}index.json", 'r', encoding='utf-8') as f:
+            for item in json.load(f):
+                if os.path.isfile(item['path']):
+                    entries[(item['bucket'], item['key'])] = {**item, 'validated': 0}
+
+
+def save_index() -> None:
+    '''
+    Writes the cache index to disk. Must be called while holding cache_lock.
+    '''
+
+    index = [{'bucket': b, 'key': k, **{f: e[f] for f in ['etag', 'path', 'size', 'last_used']}} for (b, k), e in entries.items()]
+    with open(f"{cache_dir}index.json.tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(f"{cache_dir}index.json.tmp", f"{cache_dir}index.json")
+
+
+def evict(keep: tuple = None) -> None:
+    '''
+    Deletes the least recently used objects until the cache is within max_cache_bytes. Objects whose key lock is held,
+    i.e. that another session is fetching or reading, and the object given as keep are never deleted, so the cache may
+    stay above the limit until they are released. Must be called while holding cache_lock.
+    '''
+
+    total = sum([e['size'] for e in entries.values()])
+
+    for cache_key, entry in sorted(entries.items(), key=lambda x: x[1]['last_used']):
+        if total <= max_cache_bytes:
+            break
+
+        if cache_key == keep or (cache_key in key_locks and key_locks[cache_key].locked()):
+            continue
+
+        utils.delete_file(entry['path'])
+        total -= entry['size']
+        del entries[cache_key]
+
+        for parsed_key in [p for p in parsed_json.keys() if p[:2] == cache_key]:
+            del parsed_json[parsed_key]
+
+
+def fetch(bucket: str, key: str) -> str:
+    '''
+    Returns the local path of the cached object, downloading it if it is not cached.
+    A cached object is revalidated with a conditional GET on its ETag, so it is only downloaded again if it changed.
+    The file can be evicted once the call returns; use fetch_json to read JSON objects safely.
+    '''
+
+    return fetch_entry(bucket, key)[0]
+
+
+def fetch_entry(bucket: str, key: str) -> tuple:
+    '''
+    Same as fetch(). Returns a tuple containing (local path, etag).
+    '''
+
+    cache_key = (bucket, key)
+    load_index()
+
+    with get_key_lock(cache_key):
+        return fetch_locked(cache_key)
+
+
+def fetch_locked(cache_key: tuple) -> tuple:
+    '''
+    Fetches the object like fetch_entry. Must be called while holding the object's key lock, which also keeps the
+    file from being evicted until the lock is released.
+    Returns a tuple containing (local path, etag).
+    '''
+
+    bucket, key = cache_key
+    entry = entries.get(cache_key)
+    now = time.time()
+
+    if entry is not None and now - entry['validated'] < revalidate_after:
+        entry['last_used'] = now
+        return (entry['path'], entry['etag'])
+
+    kwargs = {'Bucket': bucket, 'Key': key}
+    if entry is not None:
+        kwargs['IfNoneMatch'] = entry['etag']
+
+    try:
+        response = utils.get_client('s3').get_object(**kwargs)
+
+    except Exception as e:
+        if entry is not None and s3.is_error(e, '304', 'NotModified'):
+            entry['last_used'] = entry['validated'] = now
+            return (entry['path'], entry['etag'])
+
+        print(f"\nERROR in artifact_cache.fetch: {e}")
+        raise e
+
+    # stream the new version to a temporary file, then move it into place
+    os.makedirs(cache_dir, exist_ok=True)
+    path = f"{cache_dir}{hashlib.sha256(f'{bucket}/{key}'.encode('utf-8')).hexdigest()}"
+    size = 0
+
+    with open(f"{path}.tmp", 'wb') as f:
+        for chunk in response['Body'].iter_chunks(1024 * 1024):
+            f.write(chunk)
+            size += len(chunk)
+    os.replace(f"{path}.tmp", path)
+
+    with cache_lock:
+        entries[cache_key] = {'etag': response['ETag'], 'path': path, 'size': size, 'last_used': now, 'validated': now}
+        for parsed_key in [p for p in parsed_json.keys() if p[:2] == cache_key]:
+            del parsed_json[parsed_key]
+        evict(keep=cache_key)
+        save_index()
+
+    return (path, response['ETag'])
+
+
+def fetch_json(bucket: str, key: str):
+    '''
+    Returns the parsed JSON object. Parsed objects are shared across sessions and must be treated as read-only.
+    The file is read while holding the object's key lock, so that it cannot be evicted in between.
+    '''
+
+    cache_key = (bucket, key)
+    load_index()
+
+    with get_key_lock(cache_key):
+        path, etag = fetch_locked(cache_key)
+        parsed_key = (bucket, key, etag)
+        data = parsed_json.get(parsed_key)
+
+        if data is None:
+            data = utils.read_json_as_dict(path)
+            with cache_lock:
+                parsed_json[parsed_key] = data
+
+    return data
+
+
+def fetch_json_many(bucket: str, keys: list) -> list:
+    '''
+    Fetches several JSON artifacts concurrently.
+    Returns a list of parsed objects in the same order as keys.
+    '''
+
+    with ThreadPoolExecutor(max_workers=fanout) as pool:
+        return list(pool.map(lambda k: fetch_json(bucket, k), keys))
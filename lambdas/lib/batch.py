@@ -0,0 +1,615 @@
+from . import (
+    bedrock,
+    enrich_content,
+    manifest,
+    s3,
+    scheduler,
+    segmentation,
+    utils,
+    vid_proc
+)
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import uuid
+
+
+# batch mode: instead of on-demand calls, the prompts of each processing stage are pooled with the prompts of the other
+# jobs in batch mode and submitted as Bedrock batch inference jobs. The process transcript Lambda resumes each job with
+# its next stage when the executor writes the output file, so that backlog jobs do not use the on-demand quota that
+# interactive users share
+enabled = os.environ.get('BATCH_MODE', '') == '1'           # process every job in batch mode
+request_filename = "batch.json"     # a job prefix with this object is processed in batch mode, see backlog.py --batch
+batch_folder = "_batch"             # the job's batch state within the job prefix, and the record pool and submitted batches at the top of the bucket
+executor = os.environ.get('BATCH_EXECUTOR', 'bedrock')      # key of executors
+role_arn = os.environ.get('BATCH_ROLE_ARN', '')            # service role that Bedrock assumes to read and write the files
+min_records = 100       # Bedrock's minimum number of records per batch inference job; smaller pools wait for more records
+max_records = 10000     # records per batch inference job; larger pools are submitted as several jobs
+max_wait = int(os.environ.get('BATCH_MAX_WAIT', str(6 * 3600)))    # seconds that pooled records wait for min_records before they are run on demand, 0 to wait indefinitely
+flush_lease = 900       # seconds after which the pool lock of a flush that did not finish is taken over
+failed_statuses = ['Failed', 'Stopped', 'Expired']      # Bedrock batch inference job statuses without an output file, which fail the batch's jobs
+max_tokens = 4096       # response tokens per record
+anthropic_version = "bedrock-2023-05-31"
+
+# stages in order; each stage parses the outputs of its prompts and the next stage with prompts is submitted
+stages = ['start', 'overview', 'merge', 'chapters', 'enrich', 'repair', 'explain', 'complete']
+
+
+def is_requested(bucket: str, folder_key: str) -> bool:
+    '''
+    Returns True if the job is processed in batch mode.
+    '''
+
+    return enabled or s3.object_exists(bucket, f"{folder_key}/{request_filename}")
+
+
+def get_state_key(folder_key: str) -> str:
+    '''
+    Returns the S3 key of the job's batch state, which holds the current stage and the results of the previous stages.
+    '''
+
+    return f"{folder_key}/{batch_folder}/state.json"
+
+
+def get_pending_key(run: str, stage: str) -> str:
+    '''
+    Returns the S3 key of the prompts of a job's stage in the record pool. run identifies the job's batch processing run.
+    '''
+
+    return f"{batch_folder}/pending/{run}-{stage}.json"
+
+
+def get_lock_key() -> str:
+    '''
+    Returns the S3 key of the pool lock, which is held by the invocation that flushes the record pool.
+    '''
+
+    return f"{batch_folder}/lock.json"
+
+
+def get_inflight_key() -> str:
+    '''
+    Returns the S3 key of the submitted Bedrock batch inference jobs whose output was not processed yet, as
+    {batch ID: {'job_arn': ARN, 'submitted': epoch seconds, 'stages': [[job folder key, run, stage], ...]}}.
+    '''
+
+    return f"{batch_folder}/inflight.json"
+
+
+def get_batch_prefix(batch_id: str) -> str:
+    '''
+    Returns the S3 prefix of a submitted batch: its input file, its records and the output prefix of the executor,
+    which writes the output file as "<prefix>output/<executor job ID>/input.jsonl.out".
+    '''
+
+    return f"{batch_folder}/jobs/{batch_id}/"
+
+
+def parse_output_key(object_key: str) -> str:
+    '''
+    Returns the batch ID if the object is the output file of a submitted batch, otherwise an empty string.
+    '''
+
+    junk, sep, batch_key = object_key.partition(f"{batch_folder}/jobs/")
+    batch_id, sep, output_key = batch_key.partition('/output/')
+
+    if junk != "" or sep == "" or batch_id == "" or output_key[-len('.jsonl.out'):] != '.jsonl.out':
+        return ""
+
+    return batch_id
+
+
+def get_record(record_id: str, prompt: str) -> dict:
+    '''
+    Returns the batch inference input record of a text-only prompt, in the request body format of Anthropic models.
+    '''
+
+    return {
+        'recordId': record_id,
+        'modelInput': {
+            'anthropic_version': anthropic_version,
+            'max_tokens': max_tokens,
+            'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}],
+        },
+    }
+
+
+def get_record_text(record: dict) -> str:
+    '''
+    Returns the response text of a batch inference output record, or an empty string if the record failed.
+    '''
+
+    content = (record.get('modelOutput') or {}).get('content') or [{}]
+    return content[0].get('text', "")
+
+
+def run_bedrock_job(bucket: str, input_key: str, output_prefix: str, batch_id: str) -> str:
+    '''
+    Creates a Bedrock batch inference job for the input file, which writes its output file under output_prefix.
+    Returns the job ARN.
+    '''
+
+    response = utils.get_client('bedrock').create_model_invocation_job(
+        jobName=f"batch-{batch_id}",
+        roleArn=role_arn,
+        modelId=bedrock.default_model,
+        inputDataConfig={'s3InputDataConfig': {'s3Uri': f"s3://{bucket}/{input_key}", 's3InputFormat': 'JSONL'}},
+        outputDataConfig={'s3OutputDataConfig': {'s3Uri': f"s3://{bucket}/{output_prefix}"}},
+    )
+
+    return response['jobArn']
+
+
+def run_local_job(bucket: str, input_key: str, output_prefix: str, batch_id: str) -> str:
+    '''
+    Stand-in for a batch inference job: invokes the model on demand for each record of the input file and writes the
+    output file in the format of Bedrock batch inference, which resumes the jobs like the output of a Bedrock job.
+    Used for records that waited longer than max_wait for a full batch, and for local runs such as the benchmark.
+    Returns the S3 key of the output file.
+    '''
+
+    response = utils.get_client('s3').get_object(Bucket=bucket, Key=input_key)
+    records = [json.loads(line) for line in response['Body'].read().decode('utf-8').splitlines() if line.strip() != ""]
+
+    def invoke(record):
+        messages = [{'role': m['role'], 'content': [{'text': c['text']} for c in m['content']]} for m in record['modelInput']['messages']]
+
+        try:
+            text = bedrock.get_response_text(bedrock.invoke_model(messages))
+            return {**record, 'modelOutput': {'content': [{'type': 'text', 'text': text}]}}
+
+        except Exception as e:
+            return {**record, 'error': {'errorMessage': str(e)}}
+
+    results = scheduler.gather([scheduler.submit(invoke, r, priority=scheduler.OPTIONAL) for r in records])
+
+    junk, sep, input_filename = input_key.rpartition('/')
+    output_key = f"{output_prefix}local/{input_filename}.out"
+    utils.get_client('s3').put_object(Bucket=bucket, Key=output_key, Body='\n'.join([json.dumps(r) for r in results]).encode('utf-8'))
+
+    return output_key
+
+
+# batch executors by name; each takes (bucket, input_key, output_prefix, batch_id) and eventually writes the output file
+executors = {
+    'bedrock': run_bedrock_job,
+    'local': run_local_job,
+}
+
+
+def enqueue(bucket: str, folder_key: str, run: str, stage: str, prompts: dict) -> None:
+    '''
+    Adds the prompts of a job's stage, given as {record_id: prompt}, to the record pool that flush submits.
+    Raises a ClientError with the code "PreconditionFailed" if the stage of this run is already pooled.
+    '''
+
+    pending = {'folder_key': folder_key, 'run': run, 'stage': stage, 'created': int(time.time()), 'prompts': prompts}
+    s3.write_json(bucket, get_pending_key(run, stage), pending, create_only=True)
+
+
+def submit(bucket: str, pending: list, name: str) -> str:
+    '''
+    Writes the pooled prompts of several job stages as one batch inference input file and hands it to the named executor.
+    The record IDs of the input file are numbered, and the batch's records.json maps each of them back to
+    [job folder key, run, stage, record ID of the stage].
+    Bedrock jobs are recorded as in flight once they were created.
+    Returns the batch ID.
+    '''
+
+    batch_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    prefix = get_batch_prefix(batch_id)
+    records = {}
+    lines = []
+
+    for p in pending:
+        for stage_record_id, prompt in p['prompts'].items():
+            record_id = f"{len(records):011d}"      # Bedrock record IDs are 11 alphanumeric characters
+            records[record_id] = [p['folder_key'], p['run'], p['stage'], stage_record_id]
+            lines.append(json.dumps(get_record(record_id, prompt)))
+
+    s3.write_json(bucket, f"{prefix}records.json", records)
+    utils.get_client('s3').put_object(Bucket=bucket, Key=f"{prefix}input.jsonl", Body='\n'.join(lines).encode('utf-8'))
+
+    print(f"Submitting {len(records)} records of {len(pending)} job stages as batch '{batch_id}' to the {name} batch executor")
+    job_ref = executors[name](bucket, f"{prefix}input.jsonl", f"{prefix}output/", batch_id)
+
+    # the local executor has already written the output file; Bedrock jobs are checked by check_jobs until their output is processed
+    if name != 'local':
+        stages = [[p['folder_key'], p['run'], p['stage']] for p in pending]
+        s3.update_json(bucket, get_inflight_key(), lambda inflight: {**inflight, batch_id: {'job_arn': job_ref, 'submitted': int(time.time()), 'stages': stages}}, {})
+
+    suffix = "_on_demand" if name == 'local' and executor != 'local' else ""
+    for p in pending:
+        manifest.update_job(bucket, p['folder_key'], stage=f"batch_{p['stage']}{suffix}")
+
+    return batch_id
+
+
+def acquire_lock(bucket: str) -> str:
+    '''
+    Takes the pool lock, or takes it over if its holder did not release it within flush_lease seconds.
+    Returns the etag of the lock, which release_lock needs, or an empty string if another invocation holds it.
+    '''
+
+    lock, etag = s3.read_json(bucket, get_lock_key())
+
+    if lock is not None and time.time() - lock['acquired'] < flush_lease:
+        return ""
+
+    try:
+        # the owner makes each lock's etag unique, even for locks taken in the same second
+        return s3.write_json(bucket, get_lock_key(), {'acquired': int(time.time()), 'owner': uuid.uuid4().hex}, etag, create_only=etag is None)
+
+    except Exception as e:
+        if s3.is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict'):
+            return ""
+
+        print(f"\nERROR in acquire_lock: {e}")
+        raise e
+
+
+def release_lock(bucket: str, etag: str) -> bool:
+    '''
+    Releases the pool lock taken with the etag, unless another invocation took it over after the lease expired.
+    Returns True if the lock was released.
+    '''
+
+    if not s3.delete_json(bucket, get_lock_key(), etag):
+        print(f"The pool lock was taken over by another invocation, leaving it in place")
+        return False
+
+    return True
+
+
+def flush(bucket: str) -> int:
+    '''
+    Submits the pooled records as batch inference jobs of up to max_records records once at least min_records are
+    pooled. Records that waited longer than max_wait seconds without reaching min_records are run on demand by the local
+    executor instead, which is logged and recorded as a "batch_<stage>_on_demand" stage in the manifest. Only one
+    invocation flushes at a time; errors are logged and leave the records pooled for the next flush.
+    Returns the number of submitted records.
+    '''
+
+    try:
+        lock_etag = acquire_lock(bucket)
+        if lock_etag == "":
+            return 0
+
+    except Exception as e:
+        print(f"\nERROR in flush: {e}")
+        return 0
+
+    try:
+        pending_keys = s3.list_bucket(bucket, f"{batch_folder}/pending/")
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            pending = [(k, p) for k, (p, etag) in zip(pending_keys, pool.map(lambda k: s3.read_json(bucket, k), pending_keys)) if p is not None]
+
+        pending.sort(key=lambda kp: kp[1]['created'])
+        count = sum([len(p['prompts']) for k, p in pending])
+        name = executor
+
+        if count == 0:
+            return 0
+
+        if executor != 'local' and count < min_records:
+            age = time.time() - pending[0][1]['created']
+
+            if max_wait <= 0 or age < max_wait:
+                print(f"Pooled {count} records, waiting for {min_records} records to submit a batch")
+                return 0
+
+            print(f"WARNING: only {count} records were pooled in {int(age)} seconds, fewer than the {min_records} records of a batch inference job. Running them on demand")
+            name = 'local'
+
+        # group the oldest job stages into batches of up to max_records records; a remainder below min_records stays pooled
+        batches = [[]]
+        for k, p in pending:
+            if len(batches[-1]) > 0 and sum([len(q['prompts']) for j, q in batches[-1]]) + len(p['prompts']) > max_records:
+                batches.append([])
+            batches[-1].append((k, p))
+
+        submitted = 0
+        s3_client = utils.get_client('s3')
+
+        for b in batches:
+            size = sum([len(p['prompts']) for k, p in b])
+            if name != 'local' and size < min_records:
+                break
+
+            submit(bucket, [p for k, p in b], name)
+            submitted += size
+
+            with ThreadPoolExecutor(max_workers=10) as pool:
+                list(pool.map(lambda k: s3_client.delete_object(Bucket=bucket, Key=k), [k for k, p in b]))
+
+        return submitted
+
+    except Exception as e:
+        print(f"\nERROR in flush, the records stay pooled for the next flush: {e}")
+        return 0
+
+    finally:
+        release_lock(bucket, lock_etag)
+
+
+def read_output(bucket: str, output_key: str) -> dict:
+    '''
+    Reads a batch inference output file.
+    Returns a dictionary of {record_id: response text}.
+    '''
+
+    response = utils.get_client('s3').get_object(Bucket=bucket, Key=output_key)
+    lines = response['Body'].read().decode('utf-8').splitlines()
+    records = [json.loads(line) for line in lines if line.strip() != ""]
+
+    return {r['recordId']: get_record_text(r) for r in records}
+
+
+def get_prompts(stage: str, state: dict, transcribe_response: dict) -> dict:
+    '''
+    Builds the prompts of the stage from the results of the previous stages, with the same prompt builders as on-demand processing.
+    Returns a dictionary of {record_id: prompt}, which is empty if the stage has nothing to do.
+    '''
+
+    chapters = state.get('chapters', [])
+
+    if stage == 'overview':
+        windows = vid_proc.get_overview_windows(transcribe_response)
+        return {f"overview-{i}": vid_proc.get_summary_and_topics_prompt(w) for i, w in enumerate(windows)}
+
+    if stage == 'merge':
+        return {'merge': vid_proc.get_overview_merge_prompt(state['overviews'])} if len(state.get('overviews', [])) > 1 else {}
+
+    if stage == 'chapters':
+        blocks = segmentation.get_blocks(transcribe_response)
+        return {'chapters': vid_proc.get_blocks_prompt(blocks, state['summary_topics']['topics'])} if len(blocks) > 0 else {}
+
+    if stage == 'enrich':
+        prompts = {}
+        for c in chapters:
+            prompts[f"mcq-{c['id']}"] = enrich_content.get_mcq_prompt(c)
+            prompts[f"summary-{c['id']}"] = enrich_content.get_chapter_summary_prompt(c)
+        return prompts
+
+    if stage == 'repair':
+        missing = state.get('missing', {})
+        return {f"repair-{c['id']}": enrich_content.get_mcq_repair_prompt(c, missing[str(c['id'])]) for c in chapters if len(missing.get(str(c['id']), [])) > 0}
+
+    if stage == 'explain' and enrich_content.quiz_explanations:
+        return {f"explain-{c['id']}": enrich_content.get_quiz_explanations_prompt(c) for c in chapters if len(c.get('quiz', [])) > 0}
+
+    return {}
+
+
+def apply_output(stage: str, state: dict, responses: dict, transcribe_response: dict) -> None:
+    '''
+    Parses the responses of the stage, given as {record_id: response text}, into the state in-place.
+    Missing responses are parsed as empty responses, like failed on-demand calls.
+    '''
+
+    chapters = state.get('chapters', [])
+
+    if stage == 'overview':
+        # a transcript longer than the overview budget is summarized in windows, which the merge stage combines
+        record_ids = sorted([r for r in responses.keys() if r[:len('overview-')] == 'overview-'], key=lambda r: int(r[len('overview-'):]))
+        overviews = [vid_proc.parse_summary_and_topics(responses[r]) for r in record_ids]
+        state['summary_topics'] = overviews[0] if len(overviews) == 1 else {'summary': "", 'topics': []}
+        state['overviews'] = overviews if len(overviews) > 1 else []
+
+    elif stage == 'merge':
+        if len(state['overviews']) > 1:
+            state['summary_topics'] = vid_proc.parse_summary_and_topics(responses.get('merge', ""))
+
+    elif stage == 'chapters':
+        topics = state['summary_topics']['topics']
+
+        try:
+            state['chapters'] = vid_proc.parse_block_groups(responses.get('chapters', ""), segmentation.get_blocks(transcribe_response))
+
+        except Exception as e:
+            # like get_chapters, fall back to locating the topics, which runs on demand
+            print(f"\nERROR in batch.apply_output, locating topics instead: {e}")
+            state['chapters'] = vid_proc.get_chapters_from_topics(transcribe_response, topics)
+
+    elif stage == 'enrich':
+        state['missing'] = {}
+        for c in chapters:
+            c['quiz'], state['missing'][str(c['id'])] = enrich_content.validate_quiz(enrich_content.parse_quiz(responses.get(f"mcq-{c['id']}", "")))
+            c['summary'] = bedrock.parse_tags(responses.get(f"summary-{c['id']}", ""), 'summary')[0]
+
+    elif stage == 'repair':
+        for c in chapters:
+            if f"repair-{c['id']}" in responses:
+                c['quiz'], state['missing'][str(c['id'])] = enrich_content.validate_quiz(c['quiz'] + enrich_content.parse_quiz(responses[f"repair-{c['id']}"]))
+
+    elif stage == 'explain':
+        for c in chapters:
+            enrich_content.parse_quiz_explanations(responses.get(f"explain-{c['id']}", ""), c.get('quiz', []))
+
+
+def advance(bucket: str, folder_key: str, state: dict, etag: str, transcribe_response: dict) -> str:
+    '''
+    Moves the job to the next stage with prompts and adds them to the record pool, skipping stages without prompts.
+    Once no stage is left, writes the outputs. The new stage is only written once its prompts are pooled, with the etag
+    the state was read with, so that of two invocations for the same output file only one moves the job on. The
+    prompts of a stage are pooled once per run, e.g. an invocation that retries after pooling does not pool them again.
+    Returns the pooled stage, or 'complete'.
+    '''
+
+    while True:
+        stage = stages[stages.index(state['stage']) + 1]
+        state['stage'] = stage
+
+        if stage == 'complete':
+            # outputs pulls in the retrieval and search indexes, which only the last stage needs
+            from . import outputs
+            outputs.write_outputs(bucket, folder_key, state['summary_topics'], state['chapters'])
+            s3.write_json(bucket, get_state_key(folder_key), state, etag, create_only=etag is None)
+            return stage
+
+        prompts = get_prompts(stage, state, transcribe_response)
+
+        if len(prompts) > 0:
+            try:
+                enqueue(bucket, folder_key, state['run'], stage, prompts)
+
+            except Exception as e:
+                if not s3.is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise e
+
+                print(f"Stage '{stage}' of '{folder_key}' is already pooled")
+
+            s3.write_json(bucket, get_state_key(folder_key), state, etag, create_only=etag is None)
+            manifest.update_job(bucket, folder_key, stage=f"batch_{stage}_pending")
+            return stage
+
+        apply_output(stage, state, {}, transcribe_response)
+
+
+def start(bucket: str, folder_key: str, transcript_s3_key: str, transcribe_response: dict) -> str:
+    '''
+    Starts processing the job's transcript in batch mode by pooling the prompts of the first stage, then flushes the pool.
+    Only the "blocks" chapter mode is supported; in "topics" mode, every audio segment is matched to a chapter in calls
+    that depend on each other's answers, which cannot be run as batch stages. The job fails instead.
+    Returns the pooled stage.
+    '''
+
+    try:
+        if vid_proc.chapter_mode != 'blocks':
+            raise ValueError(f"Batch mode does not support CHAPTER_MODE '{vid_proc.chapter_mode}', only 'blocks'")
+
+        state, etag = s3.read_json(bucket, get_state_key(folder_key))
+        state = {'stage': 'start', 'run': uuid.uuid4().hex, 'transcript_s3_key': transcript_s3_key}
+
+        stage = advance(bucket, folder_key, state, etag, transcribe_response)
+        flush(bucket)
+
+        return stage
+
+    except Exception as e:
+        print(f"\nERROR in batch.start: {e}")
+        raise e
+
+
+def resume_job(bucket: str, folder_key: str, run: str, stage: str, responses: dict) -> str:
+    '''
+    Resumes a job with the responses of its stage, given as {record_id: response text}, and pools its next stage.
+    Responses of a run or stage that is not the job's current one, e.g. from duplicate events, are skipped.
+    Returns the pooled stage, 'complete', or an empty string if the responses were skipped.
+    '''
+
+    try:
+        state, etag = s3.read_json(bucket, get_state_key(folder_key))
+
+        if state is None or state.get('run') != run or state['stage'] != stage:
+            print(f"Skipping the output of stage '{stage}' of '{folder_key}', the job is at stage '{(state or {}).get('stage')}'")
+            return ""
+
+        transcribe_response = s3.read_json(bucket, state['transcript_s3_key'])[0]
+        apply_output(stage, state, responses, transcribe_response)
+
+        return advance(bucket, folder_key, state, etag, transcribe_response)
+
+    except Exception as e:
+        if s3.is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict'):
+            print(f"Skipping the output of stage '{stage}' of '{folder_key}', another invocation already resumed the job")
+            return ""
+
+        print(f"\nERROR in batch.resume_job: {e}")
+        raise e
+
+
+def resume(bucket: str, output_key: str) -> dict:
+    '''
+    Splits the output file of a submitted batch by record ID into the responses of each job stage, resumes the jobs
+    concurrently, then flushes the pool with their next stages. A job that fails to resume is marked failed in the
+    manifest without affecting the other jobs of the batch.
+    Returns a dictionary of {job folder key: pooled stage, 'complete', 'failed', or an empty string if skipped}.
+    '''
+
+    try:
+        batch_id = parse_output_key(output_key)
+        records = s3.read_json(bucket, f"{get_batch_prefix(batch_id)}records.json")[0]
+        responses = read_output(bucket, output_key)
+
+        # records without a response, e.g. failed records, are parsed as empty responses by apply_output
+        groups = {}
+        for record_id, (folder_key, run, stage, stage_record_id) in records.items():
+            group = groups.setdefault((folder_key, run, stage), {})
+            if record_id in responses:
+                group[stage_record_id] = responses[record_id]
+
+        def resume_group(item):
+            (folder_key, run, stage), group = item
+
+            try:
+                return resume_job(bucket, folder_key, run, stage, group)
+
+            except Exception as e:
+                manifest.update_job(bucket, folder_key, status='failed', error=str(e))
+                return 'failed'
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = dict(zip([k[0] for k in groups.keys()], pool.map(resume_group, groups.items())))
+
+        s3.update_json(bucket, get_inflight_key(), lambda inflight: {k: v for k, v in inflight.items() if k != batch_id} if batch_id in inflight else None, {})
+        flush(bucket)
+
+        return results
+
+    except Exception as e:
+        print(f"\nERROR in batch.resume: {e}")
+        raise e
+
+
+def check_jobs(bucket: str) -> list:
+    '''
+    Polls the status of the in-flight Bedrock batch inference jobs. The jobs in a batch whose inference job failed,
+    was stopped or expired, and which therefore writes no output file, are marked failed in the manifest, unless they
+    already moved on to another stage or run.
+    Returns the list of failed batch IDs.
+    '''
+
+    try:
+        inflight = s3.read_json(bucket, get_inflight_key())[0] or {}
+        bedrock_client = utils.get_client('bedrock')
+        failed = []
+
+        for batch_id, entry in inflight.items():
+            response = bedrock_client.get_model_invocation_job(jobIdentifier=entry['job_arn'])
+
+            if response['status'] not in failed_statuses:
+                continue
+
+            error = f"Batch inference job {entry['job_arn']} {response['status'].lower()}: {response.get('message', '')}"
+            print(f"\nERROR in batch '{batch_id}': {error}")
+
+            for folder_key, run, stage in entry['stages']:
+                state = s3.read_json(bucket, get_state_key(folder_key))[0] or {}
+                if state.get('run') == run and state.get('stage') == stage:
+                    manifest.update_job(bucket, folder_key, status='failed', stage=f"batch_{stage}", error=error)
+
+            failed.append(batch_id)
+
+        if len(failed) > 0:
+            s3.update_json(bucket, get_inflight_key(), lambda inflight: {k: v for k, v in inflight.items() if k not in failed}, {})
+
+        return failed
+
+    except Exception as e:
+        print(f"\nERROR in check_jobs: {e}")
+        raise e
+
+
+def tick(bucket: str) -> dict:
+    '''
+    Runs on a schedule: marks the jobs of failed batch inference jobs failed, then flushes the record pool, so that
+    pooled records are submitted after a failed flush and run on demand once they waited longer than max_wait.
+    Returns a dictionary with the number of submitted records and the list of failed batch IDs.
+    '''
+
+    failed = check_jobs(bucket)
+
+    return {'submitted': flush(bucket), 'failed': failed}
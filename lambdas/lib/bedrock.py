@@ -1,33 +1,68 @@
-import boto3
+from . import (
+    tokens,
+    tracing,
+    utils
+)
+import hashlib
+import json
+import os
+import threading
 import time
 
 
-bedrock_client = boto3.client("bedrock-runtime")
 default_model = "anthropic.claude-3-5-sonnet-20241022-v2:0"  # claude 3.5 sonnet v2
+retry_delay = 10    # seconds added to the backoff per throttling retry
+
+# record/replay cassette settings, see set_cassette()
+cassette = {
+    'mode': os.environ.get('BEDROCK_CASSETTE_MODE', ''),
+    'path': os.environ.get('BEDROCK_CASSETTE_PATH', 'bedrock_cassette.jsonl'),
+    'timing': os.environ.get('BEDROCK_CASSETTE_TIMING', '') == '1',
+}
+cassette_lock = threading.Lock()
+cassette_entries = {}
 
 
 def invoke_model(messages: list, model_id = "", streaming = False, retries = 0) -> dict:
     '''
     Invokes the model, optionally with streaming. 
     If a throttling exception is encountered, retries with exponential backoff until the max retries (10) is reached.
+    If a cassette mode is set (see set_cassette), the request/response pair is recorded or replayed.
+    Prompts that would overflow the model's context window are rejected before they are sent (see tokens.check_prompt),
+    and the input token counts of the responses calibrate the token estimates of the model.
     Returns the response object.
     '''
 
     if model_id == "":
         model_id = default_model
 
+    tokens.check_prompt(messages, model_id)
+
+    if cassette['mode'] == 'replay':
+        return replay_response(messages, model_id, streaming)
+
     try:
-        if streaming:
-            response = bedrock_client.converse_stream(
-                modelId = model_id,
-                messages = messages
-            )
-
-        else:
-            response = bedrock_client.converse(
-                modelId = model_id,
-                messages = messages
-            )
+        start = time.perf_counter()
+
+        with tracing.span('bedrock.invoke_model', streaming=streaming, retries=retries) as attrs:
+            if streaming:
+                response = utils.get_client("bedrock-runtime").converse_stream(
+                    modelId = model_id,
+                    messages = messages
+                )
+                response = dict(response, stream=calibrating_stream(response.get('stream') or [], model_id, messages))
+
+            else:
+                response = utils.get_client("bedrock-runtime").converse(
+                    modelId = model_id,
+                    messages = messages
+                )
+                attrs['input_tokens'] = response.get('usage', {}).get('inputTokens', 0)
+                attrs['output_tokens'] = response.get('usage', {}).get('outputTokens', 0)
+                tokens.record_usage(model_id, messages, attrs['input_tokens'])
+
+        if cassette['mode'] == 'record':
+            response = record_response(messages, model_id, streaming, response, start)
 
         return response
 
@@ -36,7 +71,7 @@ def invoke_model(messages: list, model_id = "", streaming = False, retries = 0)
 
         if ("ThrottlingException" in str(e)):
             retries += 1
-            delay = retries * 10
+            delay = retries * retry_delay
             print(f"Retrying in {delay}s... (retry #{retries})\n")
             time.sleep(delay)
             return invoke_model(messages, model_id, streaming, retries)
@@ -44,6 +79,145 @@ def invoke_model(messages: list, model_id = "", streaming = False, retries = 0)
         raise e
     
 
+def calibrating_stream(stream, model_id: str, messages: list):
+    '''
+    Passes the events of a converse_stream response through, and calibrates the token estimates of the model with the
+    input token count of the stream's metadata event (see tokens.record_usage).
+    '''
+
+    for event in stream:
+        if 'metadata' in event:
+            tokens.record_usage(model_id, messages, event['metadata'].get('usage', {}).get('inputTokens', 0))
+        yield event
+
+
+def set_cassette(mode: str, path: str = "", timing: bool = False) -> None:
+    '''
+    Sets the record/replay mode for invoke_model. The same settings can be given with the environment variables
+    BEDROCK_CASSETTE_MODE, BEDROCK_CASSETTE_PATH and BEDROCK_CASSETTE_TIMING ("1" to enable).
+    - "record": every successful request/response pair is appended to the cassette (JSONL) with its observed latency.
+    - "replay": responses are served from the cassette without calling Bedrock, optionally sleeping for the recorded latency.
+    - "": calls Bedrock normally.
+    '''
+
+    if mode not in ['', 'record', 'replay']:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+
+    with cassette_lock:
+        cassette['mode'] = mode
+        cassette['path'] = path if path != "" else cassette['path']
+        cassette['timing'] = timing
+        cassette_entries.clear()
+
+
+def get_cassette_key(messages: list, model_id: str, streaming: bool) -> str:
+    '''
+    Hashes the request into the key used to match cassette entries. Returns a string.
+    '''
+
+    request = json.dumps({'model_id': model_id, 'streaming': streaming, 'messages': messages}, sort_keys=True, default=str)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+def write_cassette_entry(entry: dict) -> None:
+    '''
+    Appends an entry to the cassette file.
+    '''
+
+    with cassette_lock:
+        with open(cassette['path'], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+
+def record_response(messages: list, model_id: str, streaming: bool, response: dict, start: float) -> dict:
+    '''
+    Writes the request/response pair to the cassette. Streamed responses are recorded once the stream is consumed.
+    Returns the response, with the stream wrapped so that the caller still receives every event.
+    '''
+
+    entry = {
+        'key': get_cassette_key(messages, model_id, streaming),
+        'model_id': model_id,
+        'streaming': streaming,
+        'messages': messages,
+    }
+
+    if not streaming:
+        entry['latency'] = time.perf_counter() - start
+        entry['response'] = {k: v for k, v in response.items() if k != 'ResponseMetadata'}
+        write_cassette_entry(entry)
+        return response
+
+    entry['latency'] = time.perf_counter() - start
+
+    def recording_stream(stream):
+        events = []
+        offsets = []
+
+        for event in stream:
+            events.append(event)
+            offsets.append(time.perf_counter() - start)
+            yield event
+
+        entry['events'] = events
+        entry['event_offsets'] = offsets
+        write_cassette_entry(entry)
+
+    return dict(response, stream=recording_stream(response.get('stream') or []))
+
+
+def load_cassette() -> dict:
+    '''
+    Loads the cassette file into memory, grouping entries by request key in recording order.
+    Returns a dictionary of {key: {'entries': list, 'next': int}}.
+    '''
+
+    with cassette_lock:
+        if len(cassette_entries) == 0:
+            with open(cassette['path'], 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip() != "":
+                        entry = json.loads(line)
+                        cassette_entries.setdefault(entry['key'], {'entries': [], 'next': 0})['entries'].append(entry)
+
+    return cassette_entries
+
+
+def replay_response(messages: list, model_id: str, streaming: bool) -> dict:
+    '''
+    Serves the recorded response for the request. Repeated identical requests are served in recording order,
+    and the last recording is reused once they run out. If timing is enabled, sleeps for the recorded latency.
+    Returns the response object.
+    '''
+
+    key = get_cassette_key(messages, model_id, streaming)
+    recordings = load_cassette().get(key)
+
+    if recordings is None:
+        raise KeyError(f"No cassette entry for request {key} in {cassette['path']}")
+
+    with cassette_lock:
+        entry = recordings['entries'][min(recordings['next'], len(recordings['entries']) - 1)]
+        recordings['next'] += 1
+
+    if cassette['timing']:
+        time.sleep(entry['latency'])
+
+    if not streaming:
+        return entry['response']
+
+    def replay_stream():
+        elapsed = entry['latency']
+
+        for event, offset in zip(entry['events'], entry['event_offsets']):
+            if cassette['timing'] and offset > elapsed:
+                time.sleep(offset - elapsed)
+                elapsed = offset
+            yield event
+
+    return {'stream': replay_stream()}
+
+
 def invoke_model_text(prompt: str) -> str:
     '''
     Sends a text-only prompt to the LLM and returns the text-only response as a string.
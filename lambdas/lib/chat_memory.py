@@ -0,0 +1,162 @@
+from . import (
+    bedrock,
+    tokens
+)
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the pinned context and the last keep_turns turns are always sent verbatim; older turns are folded into a running summary
+token_budget = 6000     # estimated tokens for the summary and verbatim turns, excluding the pinned context
+keep_turns = 4          # a turn is a user message and the assistant response
+fold_turns = 2          # older turns are summarized in batches, so that a summary is not requested on every turn
+
+# summaries are written in the background, shared by all chat sessions in the process
+summarizer = ThreadPoolExecutor(max_workers=4)
+
+
+def new_memory(pinned: list) -> dict:
+    '''
+    Creates the chat memory for a session. The pinned messages (a list of {'role': str, 'content': str}) are
+    sent at the start of every request and never summarized.
+    Returns a dictionary.
+    '''
+
+    return {
+        'pinned': pinned,
+        'summary': "",
+        'summarized_turns': 0,
+        'messages': [],     # messages not yet folded into the summary
+        'pending': None,    # (future, number of messages being summarized)
+        'stats': [],        # per-turn prompt token counts
+    }
+
+
+def add_message(memory: dict, role: str, content: str) -> None:
+    '''
+    Appends a message to the chat memory.
+    '''
+
+    memory['messages'].append({'role': role, 'content': content})
+
+
+def apply_summary(memory: dict) -> None:
+    '''
+    Folds the messages covered by a completed background summary out of the memory.
+    A failed summary is logged and dropped, and the messages are summarized again on the next compaction.
+    '''
+
+    if memory['pending'] is None or not memory['pending'][0].done():
+        return
+
+    future, n = memory['pending']
+    memory['pending'] = None
+
+    try:
+        memory['summary'] = future.result()
+        del memory['messages'][:n]
+        memory['summarized_turns'] += n // 2
+
+    except Exception as e:
+        print(f"\nERROR in apply_summary: {e}")
+
+
+def get_messages(memory: dict, latest_text: str = "") -> list:
+    '''
+    Formats the messages payload: the pinned messages, the running summary, and the most recent messages.
+    The latest user message is replaced with latest_text if given, e.g. to add retrieved context.
+    Older messages that do not fit the token budget and are not yet summarized are left out.
+    Records the estimated prompt tokens of the turn in memory['stats'].
+    Returns a list of dictionaries in the Converse messages format.
+    '''
+
+    apply_summary(memory)
+
+    recent = [dict(m) for m in memory['messages']]
+    if latest_text != "" and len(recent) > 0:
+        recent[-1]['content'] = latest_text
+
+    context = list(memory['pinned'])
+    if memory['summary'] != "":
+        context += [
+            {'role': 'user', 'content': f"<conversation_summary>\n{memory['summary']}\n</conversation_summary>\n\nThe above is a summary of our conversation so far."},
+            {'role': 'assistant', 'content': "Understood. I will continue the conversation with this in mind."},
+        ]
+
+    # drop the oldest turns until the recent messages fit the budget, always keeping the latest turn
+    recent_tokens = sum([tokens.estimate_tokens(m['content']) for m in recent + context[len(memory['pinned']):]])
+    while recent_tokens > token_budget and len(recent) > 2:
+        recent_tokens -= tokens.estimate_tokens(recent[0]['content']) + tokens.estimate_tokens(recent[1]['content'])
+        recent = recent[2:]
+
+    messages = [{'role': m['role'], 'content': [{'text': m['content']}]} for m in context + recent]
+
+    memory['stats'].append({
+        'turn': memory['summarized_turns'] + (len(memory['messages']) + 1) // 2,
+        'prompt_tokens': tokens.estimate_message_tokens(messages),
+        'verbatim_messages': len(recent),
+        'summarized_turns': memory['summarized_turns'],
+    })
+
+    return messages
+
+
+def record_usage(memory: dict, usage: dict) -> None:
+    '''
+    Records the token usage reported by Bedrock for the latest turn, i.e. the 'usage' of a converse_stream metadata event.
+    '''
+
+    if len(memory['stats']) > 0:
+        memory['stats'][-1]['input_tokens'] = usage.get('inputTokens', 0)
+        memory['stats'][-1]['output_tokens'] = usage.get('outputTokens', 0)
+
+
+def compact(memory: dict) -> None:
+    '''
+    Starts summarizing the messages older than the last keep_turns turns in the background, once there are at least
+    fold_turns of them. Does nothing while a summary is in progress.
+    '''
+
+    apply_summary(memory)
+
+    if memory['pending'] is not None:
+        return
+
+    n = len(memory['messages']) - 2 * keep_turns
+    n -= n % 2
+
+    if n < 2 * fold_turns:
+        return
+
+    future = summarizer.submit(summarize, memory['summary'], memory['messages'][:n])
+    memory['pending'] = (future, n)
+
+
+def summarize(summary: str, messages: list) -> str:
+    '''
+    Updates the running summary of the conversation with the given messages.
+    Returns the new summary as a string.
+    '''
+
+    conversation = '\n\n'.join([f"{'Student' if m['role'] == 'user' else 'Tutor'}: {m['content']}" for m in messages])
+
+    instructions = f"""
+    <summary>
+    {summary}
+    </summary>
+
+    <conversation>
+    {conversation}
+    </conversation>
+
+    You are given the summary of a tutoring conversation within <summary></summary> tags, which may be empty, and the messages that followed within <conversation></conversation> tags. Your task is to update the summary to include the new messages.
+
+    Keep the questions the student asked, the key points of the explanations given, and anything the student found difficult. The summary should be at most 200 words. Output the summary within <summary></summary> tags.
+    """
+
+    try:
+        response = bedrock.invoke_model_text(instructions)
+        return bedrock.parse_tags(response, 'summary')[0]
+
+    except Exception as e:
+        print(f"\nERROR in summarize: {e}")
+        raise e
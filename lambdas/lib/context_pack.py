@@ -0,0 +1,98 @@
+from . import (
+    tokens
+)
+
+
+# the pinned tutor context is prebuilt at processing time in several variants, from the most to the least detailed
+trimmed_budget = 1000   # estimated tokens of the trimmed variant
+
+instructions = """
+    You are a tutor for the course outlined above within <outline></outline> tags. Each question is accompanied by excerpts from the course transcript, chapter summaries, chapter quizzes, and additional course documents within <excerpts></excerpts> tags.
+
+    You are strictly required to answer questions based on the information available in the outline and excerpts. If the question cannot be answered using this information, you must tell the user that you are unable to answer the question.
+    """
+
+acknowledgement = "Understood. I will answer questions strictly based on the information available in the outline and excerpts. If the question cannot be answered using the given information, I will inform you that I am unable to answer the question."
+
+
+def format_chapter(chapter: dict, summary: bool = True, first_sentence: bool = False) -> str:
+    '''
+    Formats the chapter title and, optionally, its summary or the first sentence of its summary for the outline.
+    Returns a string.
+    '''
+
+    parts = ["\n<chapter>", f"\n<title>\n{chapter['id'] + 1}. {chapter['title']}\n</title>\n"]
+
+    if summary:
+        text = chapter.get('summary', "")
+        if first_sentence:
+            head, sep, junk = text.partition('. ')
+            text = f"{head}{sep.strip()}"
+        parts.append(f"\n<summary>\n{text}\n</summary>\n")
+
+    parts.append("\n</chapter>\n")
+    return ''.join(parts)
+
+
+def format_prompt(chapter_outlines: list) -> str:
+    '''
+    Formats the pinned tutor prompt from the formatted chapters.
+    Returns a string.
+    '''
+
+    return f"""
+    <outline>
+    {''.join(chapter_outlines)}
+    </outline>
+    {instructions}"""
+
+
+def build_pack(chapters: list) -> dict:
+    '''
+    Builds the context pack of the job: the pinned tutor prompt in a full and a trimmed variant with their estimated
+    tokens, and per-chapter token estimates. The trimmed variant keeps the first sentence of each summary, or only the
+    titles if that does not fit trimmed_budget.
+    Returns a JSON-serializable dictionary containing
+    {
+        'variants': [{'name': str, 'prompt': str, 'tokens': int}],     # most detailed first
+        'chapters': [{'id': int, 'title': str, 'outline_tokens': int, 'transcript_tokens': int}],
+        'acknowledgement': str
+    }
+    '''
+
+    full = [format_chapter(c) for c in chapters]
+    trimmed = [format_chapter(c, first_sentence=True) for c in chapters]
+
+    if tokens.estimate_tokens(format_prompt(trimmed)) > trimmed_budget:
+        trimmed = [format_chapter(c, summary=False) for c in chapters]
+
+    variants = []
+    for name, outlines in [('full', full), ('trimmed', trimmed)]:
+        prompt = format_prompt(outlines)
+        variants.append({'name': name, 'prompt': prompt, 'tokens': tokens.estimate_tokens(prompt)})
+
+    return {
+        'variants': variants,
+        'chapters': [{
+            'id': c['id'],
+            'title': c['title'],
+            'outline_tokens': tokens.estimate_tokens(outline),
+            'transcript_tokens': tokens.estimate_tokens(c.get('transcript', "")),
+            }
+            for c, outline in zip(chapters, full)
+        ],
+        'acknowledgement': acknowledgement,
+    }
+
+
+def choose_variant(pack: dict, budget: int) -> dict:
+    '''
+    Chooses the most detailed variant of the pack that fits the token budget, or the smallest variant if none fits.
+    Returns the variant as a dictionary containing {'name': str, 'prompt': str, 'tokens': int}.
+    '''
+
+    for variant in pack['variants']:
+        if variant['tokens'] <= budget:
+            return variant
+
+    return min(pack['variants'], key=lambda v: v['tokens'])
@@ -0,0 +1,161 @@
+from . import (
+    manifest,
+    s3
+)
+import hashlib
+
+
+# index of media content hashes to the job prefix that first processed the media
+index_prefix = "_index/media/"
+followers_filename = "followers.json"   # duplicates uploaded while the job was in flight, which receive its outputs once it completes
+
+
+def get_index_key(content_hash: str) -> str:
+    '''
+    Returns the S3 key of the hash index entry for the content hash.
+    '''
+
+    return f"{index_prefix}{hashlib.sha256(content_hash.encode('utf-8')).hexdigest()}.json"
+
+
+def find_prior_job(bucket: str, content_hash: str) -> dict:
+    '''
+    Looks up the job that previously processed media with the same content hash.
+    Returns a dictionary containing {'job_prefix': str, 'video_key': str}, or None if the media is new.
+    '''
+
+    entry, etag = s3.read_json(bucket, get_index_key(content_hash))
+    return entry
+
+
+def register_job(bucket: str, content_hash: str, job_prefix: str, video_key: str, replace: bool = False) -> None:
+    '''
+    Records the job prefix for the content hash in the hash index.
+    An existing entry is kept unless replace is True, e.g. when the original job failed, so that duplicates keep
+    pointing at the original job.
+    '''
+
+    entry = {'job_prefix': job_prefix, 'video_key': video_key}
+
+    try:
+        if replace:
+            s3.write_json(bucket, get_index_key(content_hash), entry)
+        else:
+            s3.write_json(bucket, get_index_key(content_hash), entry, create_only=True)
+
+    except Exception as e:
+        if not s3.is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict'):
+            raise e
+
+
+def is_job_artifact(key: str, job_prefix: str) -> bool:
+    '''
+    Checks if the object is a generated artifact of the job (transcript or pipeline output) rather than an upload.
+    Uploaded videos ("vid-*") and additional content ("kb/") belong to each job and are not copied, and neither are the
+    job's processing state (folders starting with "_") and its list of followers.
+    '''
+
+    relative_key = key[len(job_prefix) + 1:]
+    junk, sep, filename = relative_key.rpartition('/')
+    return relative_key != "" and filename[:4] != 'vid-' and relative_key[:3] != 'kb/' and relative_key[:1] != '_' and relative_key != followers_filename
+
+
+def copy_job_outputs(bucket: str, source_prefix: str, target_prefix: str) -> list:
+    '''
+    Copies the transcript and outputs of the source job into the target job's prefix.
+    The outputs are copied before transcript.json, so that the process transcript Lambda triggered by the
+    transcript finds the outputs already in place and skips processing. Like write_outputs, chapters.json is copied after
+    the other outputs, since a job prefix with chapters.json is treated as finished.
+    Returns the list of copied keys in the target prefix, which is empty if the source job has no transcript yet.
+    '''
+
+    try:
+        keys = [k for k in s3.list_bucket(bucket, f"{source_prefix}/") if is_job_artifact(k, source_prefix)]
+        transcript_key = f"{source_prefix}/transcript.json"
+
+        if transcript_key not in keys:
+            return []
+
+        chapters_key = f"{source_prefix}/chapters.json"
+        outputs = [k for k in keys if k not in [transcript_key, chapters_key]] + [k for k in keys if k == chapters_key]
+
+        copied = []
+        for k in outputs + [transcript_key]:
+            target_key = f"{target_prefix}/{k[len(source_prefix) + 1:]}"
+            s3.copy_object(bucket, k, target_key)
+            copied.append(target_key)
+
+        print(f"Copied {len(copied)} objects from '{source_prefix}' to '{target_prefix}'")
+        return copied
+
+    except Exception as e:
+        print(f"\nERROR in copy_job_outputs: {e}")
+        raise e
+
+
+def complete_duplicate(bucket: str, source_prefix: str, target_prefix: str, video_key: str) -> list:
+    '''
+    Completes a duplicate job with the outputs of the source job: copies them (see copy_job_outputs), adds the copied
+    chapters to the cross-course search index like write_outputs, and records the job in the manifest.
+    Returns the list of copied keys, which is empty if the source job has no transcript yet.
+    '''
+
+    copied = copy_job_outputs(bucket, source_prefix, target_prefix)
+
+    if len(copied) == 0:
+        return copied
+
+    artifact_keys = manifest.get_artifact_keys(copied)
+
+    if 'chapters_s3_key' in artifact_keys:
+        # the search index is only needed for duplicates, it is imported here to keep the cold start short
+        from . import search_index
+        search_index.index_job(bucket, target_prefix, s3.read_json(bucket, artifact_keys['chapters_s3_key'])[0])
+
+    manifest.update_job(bucket, target_prefix,
+        status='complete' if 'chapters_s3_key' in artifact_keys else 'processing',
+        stage='deduplicated',
+        video_s3_key=video_key,
+        **artifact_keys)
+
+    return copied
+
+
+def add_follower(bucket: str, job_prefix: str, follower_prefix: str, video_key: str) -> None:
+    '''
+    Links a duplicate uploaded while the job is in flight to the job, so that release_followers completes it with the
+    job's outputs instead of transcribing the same media again.
+    '''
+
+    follower = {'job_prefix': follower_prefix, 'video_key': video_key}
+    s3.update_json(bucket, f"{job_prefix}/{followers_filename}", lambda followers: None if follower in followers else followers + [follower], default=[])
+
+
+def release_followers(bucket: str, job_prefix: str, error: str = "") -> list:
+    '''
+    Completes the duplicates linked to the job (see add_follower) with its outputs once the job completed, and unlinks
+    them. If error is given, the job failed: its followers are marked failed too, but stay linked, so that they still
+    complete if a retry of the job succeeds.
+    Returns the list of released follower prefixes.
+    '''
+
+    try:
+        while True:
+            followers, etag = s3.read_json(bucket, f"{job_prefix}/{followers_filename}")
+
+            if followers is None:
+                return []
+
+            for f in followers:
+                if error != "":
+                    manifest.update_job(bucket, f['job_prefix'], status='failed', error=f"The job it duplicates, '{job_prefix}', failed: {error}")
+                else:
+                    complete_duplicate(bucket, job_prefix, f['job_prefix'], f['video_key'])
+
+            # followers linked in the meantime change the etag and are released in the next round
+            if error != "" or s3.delete_json(bucket, f"{job_prefix}/{followers_filename}", etag):
+                return [f['job_prefix'] for f in followers]
+
+    except Exception as e:
+        print(f"\nERROR in release_followers: {e}")
+        raise e
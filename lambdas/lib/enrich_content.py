@@ -1,43 +1,28 @@
 # from lib import (
 from . import (
-    bedrock
+    bedrock,
+    retrieval,
+    scheduler,
+    tracing
 )
-from concurrent.futures import ThreadPoolExecutor
+import os
 
 
-def mult_get_mcq(chapter: dict) -> None:
-    '''
-    Generates multiple choice quiz questions for the given chapter. The chapter dictionary should contain
-    {
-        'id': index, 
-        'title': topic, 
-        'transcript': section,
-        'start_time': int(timestamp),
-        'end_time': int(timestamp),
-        'segments': list(audio_segments)
-    }
-    Updates the chapter dictionary in-place to add a "quiz" key with a list of questions.
-    Each question is a dictionary containing {question_text: str, options: list, correct_ans: int}.
-    '''
-
-    chapter_text = f"Title: {chapter['title']}\n\n{chapter['transcript']}"
-
-    instructions = f"""
-    <chap>
-    {chapter_text}
-    </chap>
-
-    Bloom's Taxonomy is a framework used in education to classify different levels of cognitive skills and learning objectives. The taxonomy is hierarchical and consists of six levels, arranged from the simplest to the most complex cognitive skills:
-    1) Remember (Knowledge): Recalling facts, terms, concepts, principles, or theories.
-    2) Understand (Comprehension): Demonstrating an understanding of the meaning of instructional materials.
-    3) Apply: Using learned materials in new and concrete situations.
-    4) Analyze: Breaking down information into its components to understand its organizational structure.
-    5) Evaluate: Making judgments or decisions based on criteria and standards.
-    6) Create (Synthesis): Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure.
-
-    Your task is to generate one multiple choice quiz question for each level in Bloom's Taxonomy based on the content in <chap></chap>. The goal is to test a student's understanding of the topic.
+# Bloom's Taxonomy levels that each chapter quiz covers with one question, as (level, description)
+bloom_levels = [
+    ("Remember (Knowledge)", "Recalling facts, terms, concepts, principles, or theories."),
+    ("Understand (Comprehension)", "Demonstrating an understanding of the meaning of instructional materials."),
+    ("Apply", "Using learned materials in new and concrete situations."),
+    ("Analyze", "Breaking down information into its components to understand its organizational structure."),
+    ("Evaluate", "Making judgments or decisions based on criteria and standards."),
+    ("Create (Synthesis)", "Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure."),
+]
+quiz_choices = 4            # choices per quiz question
+quiz_repair_rounds = 1      # follow-up calls that request only the levels without a valid question
+quiz_explanations = os.environ.get('QUIZ_EXPLANATIONS', '0') == '1'     # precompute an explanation of each quiz answer for the tutor chat, enabled per deployment
+explanation_words = 60      # target length of each answer explanation
 
-    Output each quiz question within <quiz></quiz> tags. Each question should contain the level description within <lvl></lvl> tags, the question text within <qn></qn> tags, a list of exactly four choices within <choices></choices> tags where each choice is encapsulated within <opt></opt> tags, and the correct answer within <ans></ans> tags.
+quiz_format = """Output each quiz question within <quiz></quiz> tags. Each question should contain the level description within <lvl></lvl> tags, the question text within <qn></qn> tags, a list of exactly four choices within <choices></choices> tags where each choice is encapsulated within <opt></opt> tags, and the correct answer within <ans></ans> tags.
 
     Here is an example of the expected output format:
     <quiz>
@@ -70,13 +55,27 @@ def mult_get_mcq(chapter: dict) -> None:
         <ans>
         Answer choice three
         </ans>
-    </quiz>
-    """
+    </quiz>"""
 
-    # get llm response and parse quiz questions
-    res = bedrock.invoke_model_text(instructions)
+
+def format_levels(levels: list) -> str:
+    '''
+    Formats the Bloom's Taxonomy levels as a numbered list for the quiz prompts.
+    Returns a string.
+    '''
+
+    descriptions = dict(bloom_levels)
+    return '\n    '.join([f"{i + 1}) {lvl}: {descriptions[lvl]}" for i, lvl in enumerate(levels)])
+
+
+def parse_quiz(response_text: str) -> list:
+    '''
+    Parses the quiz questions in <quiz></quiz> tags of the model's response, including incomplete questions.
+    Returns a list of dictionaries containing the 'level', 'question', 'choices', and 'answer' keys.
+    '''
 
     quiz_qns = []
+    res = response_text
 
     while len(res) > 0:
         quiz_content, res = bedrock.parse_tags(res, 'quiz')
@@ -91,17 +90,146 @@ def mult_get_mcq(chapter: dict) -> None:
             if option.strip() != "":
                 options.append(option.strip())
 
-        if lvl.strip() != "" and qn.strip() != "" and len(options) > 0 and ans.strip() != "":
-            quiz_qns.append({
-                'level': lvl.strip(),
-                'question': qn.strip(),
-                'choices': options,
-                'answer': ans.strip()
-            })
+        if lvl.strip() == "" and qn.strip() == "" and len(options) == 0 and ans.strip() == "":
+            continue
+
+        quiz_qns.append({
+            'level': lvl.strip(),
+            'question': qn.strip(),
+            'choices': options,
+            'answer': ans.strip()
+        })
+
+    return quiz_qns
+
+
+def get_bloom_level(level_text: str) -> str:
+    '''
+    Matches the level text of a quiz question to a level in bloom_levels, either by its leading word, e.g. "understand",
+    "2) Understand (Comprehension)", "Knowledge" or "Evaluate (not remember)", or by the level's description, which is
+    what the prompt lists for each level.
+    Returns the level, or an empty string if none matches.
+    '''
+
+    text = ' '.join(level_text.lower().replace(':', ' ').split()).lstrip('0123456789.) ')
+    first_word = text.split(' ')[0]
+
+    for lvl, description in bloom_levels:
+        if first_word in lvl.lower().replace('(', '').replace(')', '').split(' '):
+            return lvl
+
+    for lvl, description in bloom_levels:
+        if text.rstrip('.') == ' '.join(description.lower().split()).rstrip('.'):
+            return lvl
+
+    return ""
+
+
+def validate_quiz(quiz_qns: list) -> tuple:
+    '''
+    Checks each quiz question: a known level, a question text, exactly quiz_choices distinct choices, and an answer that
+    is one of the choices. The first valid question of each level is kept, with its level and answer normalized to the
+    level in bloom_levels and the matching choice.
+    Returns a tuple of (valid questions in the order of bloom_levels, levels without a valid question).
+    '''
+
+    valid = {}
+
+    for qn in quiz_qns:
+        lvl = get_bloom_level(qn['level'])
+        choices = {' '.join(c.lower().split()): c for c in qn['choices']}
+        answer = choices.get(' '.join(qn['answer'].lower().split()), "")
+
+        if lvl == "" or lvl in valid or qn['question'] == "" or answer == "":
+            continue
+        if len(qn['choices']) != quiz_choices or len(choices) != quiz_choices:
+            continue
+
+        valid[lvl] = {**qn, 'level': lvl, 'answer': answer}
+
+    return ([valid[lvl] for lvl, _ in bloom_levels if lvl in valid], [lvl for lvl, _ in bloom_levels if lvl not in valid])
+
+
+def mult_get_mcq(chapter: dict) -> None:
+    '''
+    Generates multiple choice quiz questions for the given chapter. The chapter dictionary should contain
+    {
+        'id': index, 
+        'title': topic, 
+        'transcript': section,
+        'start_time': int(timestamp),
+        'end_time': int(timestamp),
+        'segments': list(audio_segments)
+    }
+    Questions that are missing or invalid (see validate_quiz) are requested again in a follow-up call for only their
+    levels, up to quiz_repair_rounds times, instead of regenerating the whole quiz.
+    Updates the chapter dictionary in-place to add a "quiz" key with a list of questions.
+    Each question is a dictionary containing {level: str, question: str, choices: list, answer: str}.
+    '''
+
+    # get llm response and parse quiz questions
+    res = bedrock.invoke_model_text(get_mcq_prompt(chapter))
+    quiz_qns, missing = validate_quiz(parse_quiz(res))
+
+    for i in range(quiz_repair_rounds):
+        if len(missing) == 0:
+            break
+
+        print(f"Requesting {len(missing)} missing or invalid quiz questions for chapter {chapter.get('id')}: {', '.join(missing)}")
+
+        res = bedrock.invoke_model_text(get_mcq_repair_prompt(chapter, missing))
+        quiz_qns, missing = validate_quiz(quiz_qns + parse_quiz(res))
+
+    if len(missing) > 0:
+        print(f"Quiz for chapter {chapter.get('id')} has no valid question for: {', '.join(missing)}")
 
     chapter['quiz'] = quiz_qns
 
 
+def get_mcq_prompt(chapter: dict) -> str:
+    '''
+    Returns the prompt that asks for one quiz question per level of Bloom's Taxonomy for the chapter.
+    '''
+
+    chapter_text = f"Title: {chapter['title']}\n\n{chapter['transcript']}"
+
+    instructions = f"""
+    <chap>
+    {chapter_text}
+    </chap>
+
+    Bloom's Taxonomy is a framework used in education to classify different levels of cognitive skills and learning objectives. The taxonomy is hierarchical and consists of six levels, arranged from the simplest to the most complex cognitive skills:
+    {format_levels([lvl for lvl, _ in bloom_levels])}
+
+    Your task is to generate one multiple choice quiz question for each level in Bloom's Taxonomy based on the content in <chap></chap>. The goal is to test a student's understanding of the topic.
+
+    {quiz_format}
+    """
+
+    return instructions
+
+
+def get_mcq_repair_prompt(chapter: dict, missing: list) -> str:
+    '''
+    Returns the prompt that asks for quiz questions for the missing levels of Bloom's Taxonomy only.
+    '''
+
+    chapter_text = f"Title: {chapter['title']}\n\n{chapter['transcript']}"
+
+    instructions = f"""
+    <chap>
+    {chapter_text}
+    </chap>
+
+    Bloom's Taxonomy is a framework used in education to classify different levels of cognitive skills. Your task is to generate one multiple choice quiz question based on the content in <chap></chap> for each of the following levels only:
+    {format_levels(missing)}
+
+    {quiz_format}
+    """
+
+    return instructions
+
+
 def get_chapter_mcq(chapters: dict) -> None:
     '''
     Generates multiple choice questions and answers for each chapter using Bloom's Taxonomy.
@@ -110,38 +238,127 @@ def get_chapter_mcq(chapters: dict) -> None:
 
     print(f"\nGenerating chapter multiple choice questions")
 
-    fanout = 10
-
-    with ThreadPoolExecutor(max_workers=fanout) as pool:
-        for c in chapters:
-            pool.submit(mult_get_mcq, c)
+    futures = [scheduler.submit(tracing.wrap(mult_get_mcq, 'chapter', chapter=c['id']), c, priority=scheduler.ENRICHMENT) for c in chapters]
+    scheduler.gather(futures)
 
     print(f"Successfully generated chapter multiple choice questions")
     return chapters
 
 
-def mult_get_chapter_summary(chapter: dict) -> None:
+def mult_get_quiz_explanations(chapter: dict) -> None:
     '''
-    Generates a summary of the chapter and appends add a "summary" key to the chapters dictionary in-place.
+    Generates a short explanation of the correct answer of each quiz question of the chapter in a single call, so that
+    the tutor chat can answer questions about the quiz without invoking the model.
+    Adds an "explanation" key to each quiz question in-place. Questions without an explanation in the response are left unchanged.
     '''
 
+    quiz = chapter.get('quiz', [])
+
+    if len(quiz) == 0:
+        return
+
+    try:
+        res = bedrock.invoke_model_text(get_quiz_explanations_prompt(chapter))
+        parse_quiz_explanations(res, quiz)
+
+    except Exception as e:
+        print(f"\nERROR in mult_get_quiz_explanations: {e}")
+
+
+def get_quiz_explanations_prompt(chapter: dict) -> str:
+    '''
+    Returns the prompt that asks for an explanation of the answer of each quiz question of the chapter.
+    '''
+
+    quiz = chapter.get('quiz', [])
     chapter_text = f"Title: {chapter['title']}\n\n{chapter['transcript']}"
+    questions = '\n\n'.join([retrieval.format_question(qn, i + 1) for i, qn in enumerate(quiz)])
 
     instructions = f"""
     <chap>
     {chapter_text}
     </chap>
-    
-    Summarize the text given in <chap></chap> tags using less than 200 words. Output your summary within <summary></summary> tags.
+
+    <questions>
+    {questions}
+    </questions>
+
+    The quiz questions in <questions></questions> tags test a student's understanding of the content in <chap></chap>. For each question, explain in at most {explanation_words} words why the correct answer is right and the other choices are not, referring to the content in <chap></chap>.
+
+    Output each explanation within <exp></exp> tags, containing the quiz question number within <num></num> tags and the explanation within <why></why> tags.
     """
 
+    return instructions
+
+
+def parse_quiz_explanations(response: str, quiz: list) -> None:
+    '''
+    Parses the explanations of the response and adds them to the quiz questions in-place as an "explanation" key.
+    '''
+
+    res = response
+
+    while len(res) > 0:
+        exp, res = bedrock.parse_tags(res, 'exp')
+        num, exp = bedrock.parse_tags(exp, 'num')
+        why, exp = bedrock.parse_tags(exp, 'why')
+
+        if num.isdigit() and 1 <= int(num) <= len(quiz) and why != "":
+            quiz[int(num) - 1]['explanation'] = why
+
+
+def get_quiz_explanations(chapters: dict) -> None:
+    '''
+    Generates the quiz answer explanations of each chapter as optional work: they run after the chapterization and
+    enrichment tasks, and explanations that cannot finish before the Lambda's deadline are skipped.
+    An "explanation" key is added to each quiz question in-place.
+    '''
+
+    print(f"\nGenerating quiz answer explanations")
+
+    futures = [scheduler.submit(tracing.wrap(mult_get_quiz_explanations, 'chapter', chapter=c['id']), c, priority=scheduler.OPTIONAL) for c in chapters]
+
+    try:
+        scheduler.gather(futures)
+        print(f"Successfully generated quiz answer explanations")
+
+    except Exception as e:
+        print(f"\nERROR in get_quiz_explanations, skipping the remaining explanations: {e}")
+
+    return chapters
+
+
+def mult_get_chapter_summary(chapter: dict) -> None:
+    '''
+    Generates a summary of the chapter and appends add a "summary" key to the chapters dictionary in-place.
+    '''
+
     try:
-        response = bedrock.invoke_model_text(instructions)
+        response = bedrock.invoke_model_text(get_chapter_summary_prompt(chapter))
         summary = bedrock.parse_tags(response, 'summary')[0]
         chapter['summary'] = summary
 
     except Exception as e:
         print(f"\nERROR in mult_get_chapter_summary: {e}")
+        raise e
+
+
+def get_chapter_summary_prompt(chapter: dict) -> str:
+    '''
+    Returns the prompt that asks for a summary of the chapter.
+    '''
+
+    chapter_text = f"Title: {chapter['title']}\n\n{chapter['transcript']}"
+
+    instructions = f"""
+    <chap>
+    {chapter_text}
+    </chap>
+    
+    Summarize the text given in <chap></chap> tags using less than 200 words. Output your summary within <summary></summary> tags.
+    """
+
+    return instructions
 
 
 def get_chapter_summaries(chapters: dict) -> None:
@@ -152,11 +369,8 @@ def get_chapter_summaries(chapters: dict) -> None:
 
     print(f"\nGenerating chapter summaries")
 
-    fanout = 10
-
-    with ThreadPoolExecutor(max_workers=fanout) as pool:
-        for c in chapters:
-            pool.submit(mult_get_chapter_summary, c)
+    futures = [scheduler.submit(tracing.wrap(mult_get_chapter_summary, 'chapter', chapter=c['id']), c, priority=scheduler.ENRICHMENT) for c in chapters]
+    scheduler.gather(futures)
 
     print(f"Successfully generated chapter summaries")
     return chapters
@@ -0,0 +1,183 @@
+from . import (
+    manifest,
+    s3,
+    utils
+)
+import json
+import os
+
+
+# fan-out mode: if an enrichment queue is configured, each chapter is enriched by a separate invocation of the
+# enrich chapter Lambda instead of the thread pools of the process transcript Lambda
+queue_url = os.environ.get('ENRICHMENT_QUEUE_URL', '')
+parts_folder = "_enrichment"    # per-chapter parts within the job prefix, deleted once chapters.json is assembled
+send_batch_size = 10            # SQS SendMessageBatch limit
+fanout = 10
+
+
+def is_enabled() -> bool:
+    '''
+    Returns True if chapters are enriched by the enrichment queue.
+    '''
+
+    return queue_url != ""
+
+
+def get_part_key(folder_key: str, chapter_id: int) -> str:
+    '''
+    Returns the S3 key of the chapter's part.
+    '''
+
+    return f"{folder_key}/{parts_folder}/chapter-{chapter_id}.json"
+
+
+def get_job_key(folder_key: str) -> str:
+    '''
+    Returns the S3 key of the fan-out state of the job, which holds the overview and the IDs of the enriched chapters.
+    '''
+
+    return f"{folder_key}/{parts_folder}/job.json"
+
+
+def start(bucket: str, folder_key: str, summary_topics: dict, chapters: list) -> int:
+    '''
+    Writes each chapter as a part to S3 and enqueues one message per chapter to the enrichment queue.
+    Messages only reference the part, since a chapter with its audio segments can exceed the SQS message size limit.
+    Returns the number of enqueued chapters.
+    '''
+
+    try:
+        s3.write_json(bucket, get_job_key(folder_key), {
+            'summary_topics': summary_topics,
+            'chapter_ids': [c['id'] for c in chapters],
+            'done': [],
+        })
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=fanout) as pool:
+            list(pool.map(lambda c: s3.write_json(bucket, get_part_key(folder_key, c['id']), c), chapters))
+
+        sqs_client = utils.get_client('sqs')
+
+        for i in range(0, len(chapters), send_batch_size):
+            entries = [{
+                'Id': str(c['id']),
+                'MessageBody': json.dumps({'bucket': bucket, 'job_id': folder_key, 'chapter_id': c['id']}),
+                }
+                for c in chapters[i:i + send_batch_size]
+            ]
+            response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+
+            if len(response.get('Failed', [])) > 0:
+                raise RuntimeError(f"Failed to enqueue chapters: {response['Failed']}")
+
+        print(f"Enqueued {len(chapters)} chapters of '{folder_key}' for enrichment")
+        return len(chapters)
+
+    except Exception as e:
+        print(f"\nERROR in fanout.start: {e}")
+        raise e
+
+
+def enrich_chapter(bucket: str, folder_key: str, chapter_id: int) -> str:
+    '''
+    Generates the quiz, summary and quiz answer explanations of one chapter and writes the chapter back to its part. The worker that completes
+    the last chapter assembles the job's outputs. Redelivered messages of a chapter that is already done are skipped
+    without calling the model, unless all chapters are done, in which case the assembly is retried in case the last
+    worker failed before it finished. A job that was already assembled is skipped.
+    Returns the S3 key of chapters.json if this call assembled the outputs, otherwise an empty string.
+    '''
+
+    try:
+        part_key = get_part_key(folder_key, chapter_id)
+        job = s3.read_json(bucket, get_job_key(folder_key))[0]
+        chapter, etag = s3.read_json(bucket, part_key)
+
+        if job is None or chapter is None:
+            print(f"Part for chapter {chapter_id} of '{folder_key}' not found, the job was already assembled")
+            return ""
+
+        if chapter_id in job['done']:
+            print(f"Chapter {chapter_id} of '{folder_key}' was already enriched")
+            return assemble(bucket, folder_key, job) if len(job['done']) == len(job['chapter_ids']) else ""
+
+        # enrich_content pulls in the Bedrock client wrapper, which only the workers need; the calls run on the
+        # scheduler, so that they are cancelled at the invocation's deadline and explanations are skipped near it
+        from . import enrich_content, scheduler
+        scheduler.gather([
+            scheduler.submit(enrich_content.mult_get_mcq, chapter),
+            scheduler.submit(enrich_content.mult_get_chapter_summary, chapter),
+        ])
+        if enrich_content.quiz_explanations:
+            enrich_content.get_quiz_explanations([chapter])
+        s3.write_json(bucket, part_key, chapter)
+
+        written = {'done': False}
+
+        def apply(job):
+            if job is None or chapter_id in job['done']:
+                written['done'] = False
+                return None
+            job['done'].append(chapter_id)
+            written['done'] = True
+            return job
+
+        job = s3.update_json(bucket, get_job_key(folder_key), apply)
+
+        # another delivery of the same message marked the chapter done in the meantime, or the job was assembled
+        if not written['done']:
+            return ""
+
+        print(f"Enriched chapter {chapter_id} of '{folder_key}' ({len(job['done'])}/{len(job['chapter_ids'])})")
+
+        if len(job['done']) < len(job['chapter_ids']):
+            return ""
+
+        return assemble(bucket, folder_key, job)
+
+    except Exception as e:
+        print(f"\nERROR in enrich_chapter: {e}")
+        raise e
+
+
+def assemble(bucket: str, folder_key: str, job: dict) -> str:
+    '''
+    Reads the enriched parts in chapter order, writes the job's outputs, and deletes the parts. If parts are missing
+    because another worker assembled the job concurrently and deleted them, that worker's outputs are kept.
+    Returns the S3 key of chapters.json.
+    '''
+
+    chapters_s3_key = f"{folder_key}/chapters.json"
+
+    try:
+        if s3.object_exists(bucket, chapters_s3_key):
+            return chapters_s3_key
+
+        # concurrent.futures pulls in logging; it is imported where it is used to keep the worker's cold start short
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=fanout) as pool:
+            chapters = list(pool.map(lambda i: s3.read_json(bucket, get_part_key(folder_key, i))[0], job['chapter_ids']))
+
+        if any([c is None for c in chapters]):
+            if s3.object_exists(bucket, chapters_s3_key):
+                return chapters_s3_key
+            raise RuntimeError(f"Parts of '{folder_key}' are missing and chapters.json was not written")
+
+        # outputs pulls in the retrieval and search indexes, which only the worker that assembles the job needs
+        from . import outputs
+        chapters_s3_key = outputs.write_outputs(bucket, folder_key, job['summary_topics'], chapters)
+
+        s3_client = utils.get_client('s3')
+        part_keys = [get_part_key(folder_key, i) for i in job['chapter_ids']] + [get_job_key(folder_key)]
+        with ThreadPoolExecutor(max_workers=fanout) as pool:
+            list(pool.map(lambda k: s3_client.delete_object(Bucket=bucket, Key=k), part_keys))
+
+        print(f"Assembled {len(chapters)} chapters of '{folder_key}'")
+        return chapters_s3_key
+
+    except Exception as e:
+        print(f"\nERROR in fanout.assemble: {e}")
+
+        if not s3.object_exists(bucket, chapters_s3_key):
+            manifest.update_job(bucket, folder_key, status='failed', error=str(e))
+        raise e
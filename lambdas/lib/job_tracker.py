@@ -0,0 +1,262 @@
+from . import (
+    s3,
+    utils
+)
+import time
+
+
+# compact job-state table stored in the uploads bucket. All writers (registrations, batches of state-change events and
+# scheduled reconciles) update this single object with conditional writes: a writer that loses a race re-reads the
+# table and applies its change again (see s3.update_json), so with N concurrent writers a write can take up to N GET
+# and PUT round trips of the whole table, and fails after 10 conflicts in a row. Pruning finished jobs keeps each
+# round trip small, and the track transcribe Lambda applies a whole SQS batch of events in one write
+table_key = "_tracker/transcribe_jobs.json"
+
+# each row is [status code, updated epoch seconds, media object key]
+statuses = ['QUEUED', 'IN_PROGRESS', 'FAILED', 'COMPLETED']
+in_flight_statuses = ['QUEUED', 'IN_PROGRESS']
+STATUS, UPDATED, MEDIA_KEY = 0, 1, 2
+
+# statuses only move forward, since registrations and events can arrive in any order; finished jobs keep their status
+status_ranks = {'QUEUED': 0, 'IN_PROGRESS': 1, 'FAILED': 2, 'COMPLETED': 2}
+
+# finished jobs are dropped from the table after this many seconds
+max_finished_age = 7 * 24 * 3600
+
+# pages of the COMPLETED and FAILED listings read per refresh; jobs that are not found are looked up by name instead
+max_list_pages = 2
+
+
+def new_table() -> dict:
+    '''
+    Returns an empty job-state table as a dictionary of {'jobs': {job_name: row}}.
+    '''
+
+    return {'jobs': {}}
+
+
+def set_status(table: dict, job_name: str, status: str, media_key: str = None) -> dict:
+    '''
+    Sets the status of a job in the table in-place. The media key is kept if not given.
+    Returns the table.
+    '''
+
+    row = table['jobs'].get(job_name, [0, 0, ""])
+    table['jobs'][job_name] = [
+        statuses.index(status),
+        int(time.time()),
+        media_key if media_key is not None else row[MEDIA_KEY],
+    ]
+
+    return table
+
+
+def advance_status(table: dict, job_name: str, status: str, media_key: str = None) -> dict:
+    '''
+    Sets the status of a job like set_status, unless the job is already as far along or finished, e.g. when a
+    state-change event was applied before the job was registered. The media key is still filled in if it was missing.
+    Returns the table.
+    '''
+
+    current = get_status(table, job_name)
+
+    if current != "" and status_ranks[current] >= status_ranks[status]:
+        if media_key is not None and table['jobs'][job_name][MEDIA_KEY] == "":
+            table['jobs'][job_name][MEDIA_KEY] = media_key
+        return table
+
+    return set_status(table, job_name, status, media_key)
+
+
+def get_status(table: dict, job_name: str) -> str:
+    '''
+    Returns the status of the job as a string, or an empty string if the job is not in the table.
+    '''
+
+    row = table['jobs'].get(job_name)
+    return statuses[row[STATUS]] if row is not None else ""
+
+
+def get_jobs(table: dict, status: str = "") -> dict:
+    '''
+    Returns a dictionary of {job_name: {'status': str, 'updated': int, 'media_key': str}}, optionally filtered by status.
+    '''
+
+    return {
+        name: {'status': statuses[row[STATUS]], 'updated': row[UPDATED], 'media_key': row[MEDIA_KEY]}
+        for name, row in table['jobs'].items()
+        if status == "" or statuses[row[STATUS]] == status
+    }
+
+
+def prune(table: dict) -> dict:
+    '''
+    Removes finished jobs that were last updated more than max_finished_age seconds ago. Updates the table in-place.
+    Returns the table.
+    '''
+
+    cutoff = time.time() - max_finished_age
+    table['jobs'] = {
+        name: row for name, row in table['jobs'].items()
+        if statuses[row[STATUS]] in in_flight_statuses or row[UPDATED] >= cutoff
+    }
+
+    return table
+
+
+def load_table(bucket: str) -> dict:
+    '''
+    Reads the job-state table from S3. Returns a dictionary, which is empty if the table does not exist yet.
+    '''
+
+    table, etag = s3.read_json(bucket, table_key)
+    return table if table is not None else new_table()
+
+
+def update_table(bucket: str, update_fn) -> dict:
+    '''
+    Applies update_fn(table) to the job-state table in S3, retrying if another writer updated it concurrently.
+    Returns the updated table.
+    '''
+
+    return s3.update_json(bucket, table_key, lambda table: prune(update_fn(table)), default=new_table())
+
+
+def register_job(bucket: str, job_name: str, media_key: str, status: str = 'QUEUED') -> dict:
+    '''
+    Adds a newly started transcription job to the job-state table. A job whose state change was already recorded keeps
+    its status.
+    Returns the updated table.
+    '''
+
+    return update_table(bucket, lambda table: advance_status(table, job_name, status, media_key))
+
+
+def list_jobs_by_status(status: str, max_results: int = 100, stop_fn=None, max_pages: int = None) -> list:
+    '''
+    Lists transcription jobs with the given status using paginated list_transcription_jobs calls (up to 100 jobs per call).
+    Transcribe returns the newest jobs first. If stop_fn is given, paging stops as soon as stop_fn(summaries_so_far) is True.
+    If max_pages is given, at most that many pages are read.
+    Returns a list of job summary dictionaries.
+    '''
+
+    transcribe_client = utils.get_client('transcribe')
+    summaries = []
+    kwargs = {'Status': status, 'MaxResults': max_results}
+    pages = 0
+
+    while True:
+        response = transcribe_client.list_transcription_jobs(**kwargs)
+        summaries += response.get('TranscriptionJobSummaries', [])
+        pages += 1
+
+        if 'NextToken' not in response or (stop_fn is not None and stop_fn(summaries)) or (max_pages is not None and pages >= max_pages):
+            break
+        kwargs['NextToken'] = response['NextToken']
+
+    return summaries
+
+
+def refresh_statuses(table: dict) -> dict:
+    '''
+    Refreshes the status of every in-flight job in the table with a few bulk list_transcription_jobs calls
+    instead of one get_transcription_job call per job. In-flight jobs are listed first. Jobs that are no longer
+    in flight are then looked up in the newest max_list_pages pages of the COMPLETED and FAILED listings, which hold the
+    jobs that finished recently. The few jobs that are still not found, e.g. jobs that finished long ago, are looked up
+    by name; a job that Transcribe no longer knows is marked FAILED, so that it is not refreshed again.
+    Updates the table in-place and returns it.
+    '''
+
+    try:
+        pending = set([name for name, row in table['jobs'].items() if statuses[row[STATUS]] in in_flight_statuses])
+
+        for status in in_flight_statuses:
+            for summary in list_jobs_by_status(status):
+                name = summary['TranscriptionJobName']
+                if name in table['jobs'] and get_status(table, name) != status:
+                    advance_status(table, name, status)
+                pending.discard(name)
+
+        for status in ['COMPLETED', 'FAILED']:
+            if len(pending) == 0:
+                break
+
+            found = lambda summaries: pending.issubset([s['TranscriptionJobName'] for s in summaries])
+            for summary in list_jobs_by_status(status, stop_fn=found, max_pages=max_list_pages):
+                name = summary['TranscriptionJobName']
+                if name in pending:
+                    advance_status(table, name, status)
+                    pending.discard(name)
+
+        transcribe_client = utils.get_client('transcribe')
+
+        for name in sorted(pending):
+            try:
+                job = transcribe_client.get_transcription_job(TranscriptionJobName=name)['TranscriptionJob']
+                advance_status(table, name, job['TranscriptionJobStatus'])
+
+            except Exception as e:
+                if not s3.is_error(e, 'BadRequestException', 'NotFoundException'):
+                    raise e
+
+                print(f"Transcription job {name} no longer exists, marking it as failed")
+                advance_status(table, name, 'FAILED')
+
+        return table
+
+    except Exception as e:
+        print(f"\nERROR in refresh_statuses: {e}")
+        raise e
+
+
+def reconcile(bucket: str) -> tuple:
+    '''
+    Refreshes the in-flight jobs of the job-state table from Transcribe (see refresh_statuses), e.g. to recover from
+    missed state-change events, and applies the changed statuses with a conditional write. Transcribe is only called
+    once, so that a concurrent writer does not cause the listings to be repeated.
+    Returns a tuple containing (updated table, list of (job_name, status) changes).
+    '''
+
+    table = load_table(bucket)
+    before = {name: get_status(table, name) for name in table['jobs']}
+    refresh_statuses(table)
+    changes = [(name, get_status(table, name)) for name in before if get_status(table, name) != before[name]]
+
+    def apply(table):
+        for name, status in changes:
+            advance_status(table, name, status)
+        return table
+
+    return (update_table(bucket, apply), changes)
+
+
+def parse_state_change_event(event: dict) -> tuple:
+    '''
+    Parses an EventBridge "Transcribe Job State Change" event.
+    Returns a tuple containing (job_name, status), or (None, None) if the event is not a Transcribe state change.
+    '''
+
+    if event.get('source') != 'aws.transcribe' or event.get('detail-type') != 'Transcribe Job State Change':
+        return (None, None)
+
+    detail = event['detail']
+    return (detail['TranscriptionJobName'], detail['TranscriptionJobStatus'])
+
+
+def apply_state_change_events(bucket: str, events: list) -> dict:
+    '''
+    Applies a batch of Transcribe state-change events to the job-state table with a single conditional write.
+    Events for jobs that are not in the table are added without a media key, and events that arrive out of order do not
+    move a job back.
+    Returns the updated table.
+    '''
+
+    changes = [parse_state_change_event(e) for e in events]
+    changes = [(name, status) for name, status in changes if name is not None]
+
+    def apply(table):
+        for name, status in changes:
+            advance_status(table, name, status)
+        return table
+
+    return update_table(bucket, apply)
@@ -0,0 +1,142 @@
+from . import (
+    retrieval,
+    s3,
+    utils
+)
+from html.parser import HTMLParser
+import csv
+import io
+
+
+# document types whose text is extracted; other uploads under kb/ are recorded in the index but not chunked
+supported_types = ['txt', 'md', 'html', 'csv', 'pdf']
+
+
+class HTMLTextParser(HTMLParser):
+    '''
+    Collects the text of an HTML document, skipping scripts and styles.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.text = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ['script', 'style']:
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ['script', 'style'] and self.skip > 0:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if self.skip == 0:
+            self.text.append(data)
+
+
+def extract_text(data: bytes, ext: str) -> str:
+    '''
+    Extracts the text of a document. PDFs are only supported if the pypdf package is available.
+    Returns a string, which is empty if the type is not supported.
+    '''
+
+    ext = ext.lower()
+
+    if ext in ['txt', 'md']:
+        return data.decode('utf-8', errors='replace')
+
+    if ext == 'html':
+        parser = HTMLTextParser()
+        parser.feed(data.decode('utf-8', errors='replace'))
+        return ' '.join(parser.text)
+
+    if ext == 'csv':
+        rows = csv.reader(io.StringIO(data.decode('utf-8', errors='replace')))
+        return '\n'.join([' | '.join(row) for row in rows])
+
+    if ext == 'pdf':
+        try:
+            import pypdf
+        except ImportError:
+            print(f"pypdf is not available, skipping pdf")
+            return ""
+
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return '\n'.join([page.extract_text() or "" for page in reader.pages])
+
+    return ""
+
+
+def get_document_chunks(bucket: str, key: str) -> list:
+    '''
+    Reads the document from S3 and splits its text into retrievable chunks.
+    Returns a list of dictionaries in the format of retrieval.get_chunks(), with 'kind': 'document' and the key as source.
+    '''
+
+    junk, sep, filename = key.rpartition('/')
+    name, sep, ext = filename.rpartition('.')
+
+    if ext.lower() not in supported_types:
+        print(f"Skipping unsupported document '{key}'")
+        return []
+
+    response = utils.get_client('s3').get_object(Bucket=bucket, Key=key)
+    text = extract_text(response['Body'].read(), ext)
+
+    return [{
+        'id': f"{filename}-{i}",
+        'source': key,
+        'chapter_id': None,
+        'title': filename,
+        'kind': 'document',
+        'start_time': None,
+        'text': t,
+        }
+        for i, t in enumerate(retrieval.get_text_chunks(text)) if t != ""
+    ]
+
+
+def sync_index(bucket: str, job_prefix: str) -> dict:
+    '''
+    Brings the documents under the job's kb/ prefix into the job's retrieval index. Documents are compared by ETag,
+    so that only new or changed documents are read and chunked, and deleted documents are removed.
+    The index is not written if nothing changed, and is created if the job has not been processed yet.
+    Returns a dictionary containing {'added': int, 'removed': int, 'unchanged': int}.
+    '''
+
+    try:
+        index_key = f"{job_prefix}/retrieval_index.json"
+        documents = s3.list_etags(bucket, f"{job_prefix}/kb/")
+        extracted = {}
+        stats = {}
+
+        def apply(index):
+            sources = index.setdefault('sources', {})
+            stale = [k for k in sources if documents.get(k) != sources[k]]
+            new = [k for k in documents if sources.get(k) != documents[k]]
+            stats.update({'added': len(new), 'removed': len([k for k in stale if k not in documents]), 'unchanged': len(documents) - len(new)})
+
+            if len(stale) + len(new) == 0:
+                return None
+
+            for k in stale:
+                retrieval.remove_source(index, k)
+                del sources[k]
+
+            for k in new:
+                if (k, documents[k]) not in extracted:
+                    extracted[(k, documents[k])] = get_document_chunks(bucket, k)
+                retrieval.add_chunks(index, extracted[(k, documents[k])])
+                sources[k] = documents[k]
+
+            return index
+
+        s3.update_json(bucket, index_key, apply, default=retrieval.build_index([]))
+
+        print(f"Synced kb documents for '{job_prefix}': {stats}")
+        return stats
+
+    except Exception as e:
+        print(f"\nERROR in sync_index: {e}")
+        raise e
@@ -0,0 +1,192 @@
+from . import (
+    s3
+)
+import time
+import zlib
+
+
+# the job manifest is sharded by job ID so that concurrent pipeline updates rarely write the same object
+manifest_prefix = "_manifest/"
+shard_count = 16
+backfilled_key = f"{manifest_prefix}backfilled.json"    # written once the jobs that predate the manifest were added
+
+# job statuses, in pipeline order
+statuses = ['uploaded', 'transcribing', 'processing', 'complete', 'failed']
+
+# artifact filenames in a job prefix and the manifest fields that hold their keys
+artifact_fields = {
+    'transcript.json': 'transcript_s3_key',
+    'overview.json': 'overview_s3_key',
+    'chapters.json': 'chapters_s3_key',
+    'retrieval_index.json': 'retrieval_index_s3_key',
+    'context_pack.json': 'context_pack_s3_key',
+}
+
+
+def get_artifact_keys(object_keys: list) -> dict:
+    '''
+    Maps the known artifacts among the object keys to their manifest fields, e.g. {'chapters_s3_key': 'job/chapters.json'}.
+    Returns a dictionary.
+    '''
+
+    artifact_keys = {}
+
+    for object_key in object_keys:
+        junk, sep, filename = object_key.rpartition('/')
+
+        if filename in artifact_fields:
+            artifact_keys[artifact_fields[filename]] = object_key
+
+    return artifact_keys
+
+
+def get_shard_key(job_id: str) -> str:
+    '''
+    Returns the S3 key of the manifest shard that holds the job.
+    '''
+
+    return f"{manifest_prefix}shard-{zlib.crc32(job_id.encode('utf-8')) % shard_count:02d}.json"
+
+
+def update_job(bucket: str, job_id: str, status: str = "", stage: str = "", **artifact_keys) -> dict:
+    '''
+    Updates the job's entry in the manifest. Artifact keys are given as keyword arguments, e.g. chapters_s3_key="...".
+    Each entry contains {'status': str, 'stage': str, 'updated': int} and the artifact keys recorded so far.
+    Marking a job failed also marks the duplicates waiting for its outputs failed, see dedup.release_followers.
+    Manifest errors are logged and not raised, so that they never fail the pipeline.
+    Returns the updated entry, or an empty dictionary if the update failed.
+    '''
+
+    if status != "" and status not in statuses:
+        raise ValueError(f"Unknown job status: {status}")
+
+    def apply(shard):
+        entry = shard['jobs'].get(job_id, {'status': 'uploaded', 'stage': ""})
+        entry['status'] = status if status != "" else entry['status']
+        entry['stage'] = stage if stage != "" else entry['stage']
+        entry['updated'] = int(time.time())
+        entry.update(artifact_keys)
+        shard['jobs'][job_id] = entry
+        return shard
+
+    try:
+        shard = s3.update_json(bucket, get_shard_key(job_id), apply, default={'jobs': {}})
+
+    except Exception as e:
+        print(f"\nERROR in update_job: {e}")
+        return {}
+
+    # duplicates waiting for the job's outputs fail with it; dedup imports the manifest, so it is imported here
+    if status == 'failed':
+        try:
+            from . import dedup
+            dedup.release_followers(bucket, job_id, error=str(artifact_keys.get('error', "")) or stage or status)
+        except Exception as e:
+            print(f"\nERROR failing the duplicates of {job_id}: {e}")
+
+    return shard['jobs'][job_id]
+
+
+def get_job(bucket: str, job_id: str) -> dict:
+    '''
+    Reads the job's entry from its manifest shard.
+    Returns a dictionary, which is empty if the job is not in the manifest.
+    '''
+
+    shard = s3.read_json(bucket, get_shard_key(job_id))[0] or {'jobs': {}}
+    return shard['jobs'].get(job_id, {})
+
+
+def read_manifest(bucket: str) -> dict:
+    '''
+    Reads all manifest shards concurrently.
+    Returns a dictionary of {job_id: entry}, or None if the manifest does not exist yet.
+    '''
+
+    # concurrent.futures pulls in logging; it is imported where it is used to keep the Lambdas' cold start short
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=shard_count) as pool:
+        shards = list(pool.map(lambda i: s3.read_json(bucket, f"{manifest_prefix}shard-{i:02d}.json")[0], range(shard_count)))
+
+    if all([shard is None for shard in shards]):
+        return None
+
+    jobs = {}
+    for shard in shards:
+        if shard is not None:
+            jobs.update(shard['jobs'])
+
+    return jobs
+
+
+def scan_jobs(bucket: str) -> dict:
+    '''
+    Rebuilds the job entries from the bucket without reading the manifest. Lists the job prefixes with a delimiter,
+    then lists only the top level of each job prefix concurrently, so that additional content under kb/ is not listed.
+    Returns a dictionary of {job_id: entry}.
+    '''
+
+    job_prefixes = [p for p in s3.list_prefixes(bucket) if p[:1] != '_']
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        listings = list(pool.map(lambda p: s3.list_bucket(bucket, p, delimiter='/'), job_prefixes))
+
+    jobs = {}
+
+    for prefix, keys in zip(job_prefixes, listings):
+        job_id = prefix.rstrip('/')
+        entry = {'status': 'uploaded', 'stage': "", **get_artifact_keys(keys)}
+
+        for object_key in keys:
+            junk, sep, filename = object_key.rpartition('/')
+
+            if filename[:4] == 'vid-':
+                entry['video_s3_key'] = object_key
+
+        if 'chapters_s3_key' in entry:
+            entry['status'] = 'complete'
+        elif 'transcript_s3_key' in entry:
+            entry['status'] = 'processing'
+
+        jobs[job_id] = entry
+
+    return jobs
+
+
+def rebuild_manifest(bucket: str) -> dict:
+    '''
+    Writes a manifest built by scan_jobs, e.g. to backfill jobs that were processed before the manifest existed, and
+    marks the manifest as backfilled. Entries already in the manifest take precedence over the scanned ones.
+    Returns a dictionary of {job_id: entry}.
+    '''
+
+    scanned = scan_jobs(bucket)
+    shards = {}
+
+    for job_id, entry in scanned.items():
+        shards.setdefault(get_shard_key(job_id), {})[job_id] = entry
+
+    def merge(scanned_entries):
+        return lambda shard: {'jobs': {**scanned_entries, **shard['jobs']}}
+
+    jobs = {}
+    for shard_key, scanned_entries in shards.items():
+        jobs.update(s3.update_json(bucket, shard_key, merge(scanned_entries), default={'jobs': {}})['jobs'])
+
+    s3.write_json(bucket, backfilled_key, {'backfilled': int(time.time()), 'jobs': len(scanned)})
+
+    return jobs
+
+
+def read_jobs(bucket: str) -> dict:
+    '''
+    Reads the manifest, backfilling it first with rebuild_manifest if that was not done yet. Otherwise the jobs processed
+    before the manifest existed would disappear as soon as the pipeline writes the first entry of a new job.
+    Returns a dictionary of {job_id: entry}.
+    '''
+
+    if not s3.object_exists(bucket, backfilled_key):
+        rebuild_manifest(bucket)
+
+    return read_manifest(bucket) or {}
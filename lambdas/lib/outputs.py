@@ -0,0 +1,55 @@
+from . import (
+    context_pack,
+    dedup,
+    manifest,
+    retrieval,
+    s3,
+    search_index
+)
+
+
+def write_outputs(bucket: str, folder_key: str, summary_topics: dict, chapters: list) -> str:
+    '''
+    Writes the outputs of a processed transcript to the job prefix: overview.json, the chapter chunks of the retrieval
+    index and context_pack.json. Adds the chapters to the cross-course search index, marks the job as complete in the
+    manifest, and finally writes chapters.json and completes the duplicates linked to the job (see dedup.add_follower).
+    Called by the process transcript Lambda, or by the enrichment worker that assembles the last chapter in fan-out mode.
+    Returns the S3 key of chapters.json.
+    '''
+
+    try:
+        # write summary and topics as overview.json
+        overview_s3_key = f"{folder_key}/overview.json"
+        s3.write_json(bucket, overview_s3_key, summary_topics)
+
+        # index the chapter transcripts, summaries, and quizzes for retrieval by the tutor chat,
+        # keeping any kb/ documents that were already added to the index
+        chapter_chunks = retrieval.get_chunks(chapters)
+        index_s3_key = f"{folder_key}/retrieval_index.json"
+        s3.update_json(bucket, index_s3_key, lambda index: retrieval.add_chunks(retrieval.remove_source(index, 'chapters'), chapter_chunks), default=retrieval.build_index([]))
+
+        # prebuild the pinned tutor prompt variants with their token estimates
+        pack_s3_key = f"{folder_key}/context_pack.json"
+        s3.write_json(bucket, pack_s3_key, context_pack.build_pack(chapters))
+
+        # make the chapters searchable across all jobs
+        search_index.index_job(bucket, folder_key, chapters)
+
+        chapters_s3_key = f"{folder_key}/chapters.json"
+        manifest.update_job(bucket, folder_key, status='complete', stage='complete', overview_s3_key=overview_s3_key, chapters_s3_key=chapters_s3_key, retrieval_index_s3_key=index_s3_key, context_pack_s3_key=pack_s3_key)
+
+        # chapters and enriched content (e.g. quizzes) are written last: a job prefix with chapters.json is treated as
+        # finished, so a retry after any earlier write failed redoes all outputs
+        s3.write_json(bucket, chapters_s3_key, chapters)
+
+        # complete the duplicates uploaded while the job was in flight
+        try:
+            dedup.release_followers(bucket, folder_key)
+        except Exception as e:
+            print(f"\nERROR releasing the duplicates of {folder_key}: {e}")
+
+        return chapters_s3_key
+
+    except Exception as e:
+        print(f"\nERROR in write_outputs: {e}")
+        raise e
@@ -0,0 +1,211 @@
+import math
+import re
+
+
+# BM25 index over chunks of the chapter transcripts, summaries, and quizzes of a job, and its kb/ documents
+chunk_words = 150       # target number of words per chunk
+overlap_words = 30      # words repeated from the end of the previous chunk
+k1 = 1.5
+b = 0.75
+
+stopwords = set("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just let me more most my myself no nor not now of off on once only or
+other our ours ourselves out over own same she should so some such than that the their theirs them themselves then
+there these they this those through to too under until up very was we were what when where which while who whom why
+will with would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text: str) -> list:
+    '''
+    Lowercases the text and splits it into words, dropping stopwords.
+    Returns a list of strings.
+    '''
+
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in stopwords]
+
+
+def get_text_chunks(text: str) -> list:
+    '''
+    Splits the text into overlapping chunks of about chunk_words words.
+    Returns a list of strings.
+    '''
+
+    words = text.split()
+    step = chunk_words - overlap_words
+    return [' '.join(words[i:i + chunk_words]) for i in range(0, max(len(words) - overlap_words, 1), step)]
+
+
+def get_transcript_chunks(chapter: dict) -> list:
+    '''
+    Splits the chapter transcript into overlapping chunks of about chunk_words words.
+    Audio segments are kept whole where the chapter has them, so that each chunk has a start time.
+    Returns a list of dictionaries containing {'text': str, 'start_time': float}.
+    '''
+
+    segments = chapter.get('segments') or []
+
+    if len(segments) == 0:
+        return [{'text': t, 'start_time': chapter.get('start_time', 0)} for t in get_text_chunks(chapter['transcript'])]
+
+    chunks = []
+    window = []
+    window_words = 0
+
+    for segment in segments:
+        window.append(segment)
+        window_words += len(segment['transcript'].split())
+
+        if window_words >= chunk_words:
+            chunks.append({'text': ' '.join([s['transcript'] for s in window]), 'start_time': window[0]['start_time']})
+
+            # carry the trailing segments into the next chunk as overlap
+            carried = []
+            carried_words = 0
+            for s in reversed(window):
+                carried_words += len(s['transcript'].split())
+                if carried_words > overlap_words:
+                    break
+                carried.insert(0, s)
+
+            window = carried
+            window_words = sum([len(s['transcript'].split()) for s in window])
+
+    if len(window) > 0 and (len(chunks) == 0 or window_words > overlap_words):
+        chunks.append({'text': ' '.join([s['transcript'] for s in window]), 'start_time': window[0]['start_time']})
+
+    return chunks
+
+
+def format_question(question: dict, number: int) -> str:
+    '''
+    Formats a quiz question with its choices, answer, and the answer's explanation if there is one as plain text.
+    '''
+
+    choices = '\n'.join([f"({i+1}) {c}" for i, c in enumerate(question['choices'])])
+    explanation = f"\nExplanation: {question['explanation']}" if question.get('explanation', "") != "" else ""
+    return f"Quiz question {number}: {question['question']}\nChoices:\n{choices}\nCorrect answer: {question['answer']}{explanation}"
+
+
+def get_chunks(chapters: list) -> list:
+    '''
+    Splits the chapters into retrievable chunks: transcript sections, the chapter summary, and one chunk per quiz question.
+    Returns a list of dictionaries containing
+    {
+        'id': str,
+        'source': 'chapters',
+        'chapter_id': int,
+        'title': str,
+        'kind': 'transcript' | 'summary' | 'quiz',
+        'start_time': float,
+        'text': str
+    }
+    '''
+
+    chunks = []
+
+    for c in chapters:
+        base = {'source': 'chapters', 'chapter_id': c['id'], 'title': c['title'], 'start_time': c.get('start_time', 0)}
+
+        for i, t in enumerate(get_transcript_chunks(c)):
+            chunks.append({**base, 'id': f"{c['id']}-transcript-{i}", 'kind': 'transcript', **t})
+
+        if c.get('summary', "") != "":
+            chunks.append({**base, 'id': f"{c['id']}-summary", 'kind': 'summary', 'text': c['summary']})
+
+        for i, qn in enumerate(c.get('quiz', [])):
+            chunks.append({**base, 'id': f"{c['id']}-quiz-{i}", 'kind': 'quiz', 'text': format_question(qn, i + 1)})
+
+    return chunks
+
+
+def build_index(chunks: list) -> dict:
+    '''
+    Builds a BM25 index over the chunks. The chapter title is indexed along with the chunk text.
+    Returns a JSON-serializable dictionary containing
+    {
+        'chunks': list(chunks),
+        'terms': list({term: count}),
+        'lengths': list(int),
+        'df': {term: document_frequency},
+        'avg_length': float,
+        'sources': {document_key: etag}
+    }
+    '''
+
+    return add_chunks({'chunks': [], 'terms': [], 'lengths': [], 'df': {}, 'avg_length': 0, 'sources': {}}, chunks)
+
+
+def add_chunks(index: dict, chunks: list) -> dict:
+    '''
+    Adds the chunks to the index in-place, without re-tokenizing the chunks already in it.
+    Returns the index.
+    '''
+
+    for chunk in chunks:
+        tokens = tokenize(f"{chunk['title']} {chunk['text']}")
+        tf = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+
+        for t in tf:
+            index['df'][t] = index['df'].get(t, 0) + 1
+
+        index['chunks'].append(chunk)
+        index['terms'].append(tf)
+        index['lengths'].append(len(tokens))
+
+    index['avg_length'] = sum(index['lengths']) / len(index['lengths']) if len(index['lengths']) > 0 else 0
+    return index
+
+
+def remove_source(index: dict, source: str) -> dict:
+    '''
+    Removes the chunks of the source (e.g. 'chapters' or a document key) from the index in-place.
+    Returns the index.
+    '''
+
+    keep = [i for i, c in enumerate(index['chunks']) if c.get('source', 'chapters') != source]
+    removed = set(range(len(index['chunks']))) - set(keep)
+
+    for i in removed:
+        for t in index['terms'][i]:
+            index['df'][t] -= 1
+            if index['df'][t] <= 0:
+                del index['df'][t]
+
+    index['chunks'] = [index['chunks'][i] for i in keep]
+    index['terms'] = [index['terms'][i] for i in keep]
+    index['lengths'] = [index['lengths'][i] for i in keep]
+    index['avg_length'] = sum(index['lengths']) / len(index['lengths']) if len(index['lengths']) > 0 else 0
+    return index
+
+
+def search(index: dict, query: str, k: int = 5) -> list:
+    '''
+    Scores the chunks against the query with BM25.
+    Returns the top k chunks as a list of dictionaries, each with an added 'score', in descending order of score.
+    '''
+
+    query_terms = set(tokenize(query))
+    n = len(index['chunks'])
+    scores = []
+
+    for i in range(n):
+        tf = index['terms'][i]
+        norm = k1 * (1 - b + b * index['lengths'][i] / max(index['avg_length'], 1))
+        score = 0
+
+        for t in query_terms:
+            f = tf.get(t, 0)
+            if f > 0:
+                idf = math.log(1 + (n - index['df'][t] + .5) / (index['df'][t] + .5))
+                score += idf * f * (k1 + 1) / (f + norm)
+
+        if score > 0:
+            scores.append((score, i))
+
+    scores.sort(key=lambda x: -x[0])
+    return [{**index['chunks'][i], 'score': score} for score, i in scores[:k]]
@@ -1,15 +1,33 @@
-import boto3
 import os
+import json
+import hashlib
+import random
+import threading
+import time
 from . import (
     utils
 )
 
+# streamed uploads use a fixed part size, so that the ETag of identical content is stable across uploads
+stream_part_size = 8 * 1024 * 1024
+stream_concurrency = 4
+
+# settings of the transfer manager shared by file uploads and downloads, see get_transfer_manager()
+transfer_settings = {
+    'multipart_threshold': 8 * 1024 * 1024,
+    'part_size': 8 * 1024 * 1024,
+    'max_concurrency': 10,      # concurrent requests across all files of a bulk transfer
+    'max_bandwidth': None,      # bytes per second, or None for no limit
+}
+transfer_managers = {}
+transfer_lock = threading.Lock()
+
 def upload_file(file_path: str, bucket_name: str, object_prefix: str) -> str:
     """
     Uploads a local file to an Amazon S3 bucket with a specified prefix.
     Returns the object key of the uploaded file in S3 as a string.
     """
-    s3_client = boto3.client('s3')
+    s3_client = utils.get_client('s3')
 
     try:
         # Get the file name from the file path
@@ -20,7 +38,7 @@ def upload_file(file_path: str, bucket_name: str, object_prefix: str) -> str:
         object_key = f"{object_prefix}/{file_name}"
 
         # Upload the file to S3
-        s3_client.upload_file(file_path, bucket_name, object_key)
+        s3_client.upload_file(file_path, bucket_name, object_key, Config=get_transfer_config())
 
         print(f"File '{file_name}' uploaded successfully to '{bucket_name}/{object_key}'")
         return object_key
@@ -38,8 +56,8 @@ def download_file(bucket_name: str, key, local_path: str) -> str:
     """
     
     try:
-        # Create an S3 client
-        s3 = boto3.client('s3')
+        # Get the shared S3 client
+        s3 = utils.get_client('s3')
 
         # Parse the filename and create local directory if not exists
         junk, sep, filename_ext = key.rpartition('/')
@@ -47,7 +65,7 @@ def download_file(bucket_name: str, key, local_path: str) -> str:
         utils.create_directory(local_path)
 
         # Download the file
-        s3.download_file(Bucket=bucket_name, Key=key, Filename=output_filepath)
+        s3.download_file(Bucket=bucket_name, Key=key, Filename=output_filepath, Config=get_transfer_config())
 
         return output_filepath
     
@@ -56,24 +74,481 @@ def download_file(bucket_name: str, key, local_path: str) -> str:
         raise e
     
 
-def list_bucket(bucket_name: str) -> list:
+def get_transfer_config(**settings):
+    '''
+    Builds a boto3 TransferConfig from transfer_settings, with any of the settings overridden by keyword arguments.
+    Returns a TransferConfig.
+    '''
+
+    from boto3.s3.transfer import TransferConfig
+    settings = {**transfer_settings, **settings}
+
+    return TransferConfig(
+        multipart_threshold=settings['multipart_threshold'],
+        multipart_chunksize=settings['part_size'],
+        max_concurrency=settings['max_concurrency'],
+        max_bandwidth=settings['max_bandwidth'],
+    )
+
+
+def get_transfer_manager(**settings):
+    '''
+    Returns the transfer manager for the settings, creating it on first use. All bulk transfers with the same settings
+    share one manager, so that concurrency and bandwidth limits apply across files rather than per file.
+    '''
+
+    key = tuple(sorted({**transfer_settings, **settings}.items()))
+
+    with transfer_lock:
+        if key not in transfer_managers:
+            from boto3.s3.transfer import create_transfer_manager
+            transfer_managers[key] = create_transfer_manager(utils.get_client('s3'), get_transfer_config(**settings))
+
+        return transfer_managers[key]
+
+
+def run_transfers(submit_fns: list, names: list, callback=None) -> list:
+    '''
+    Runs transfers on the shared transfer manager. Each submit function is called with a subscriber list and returns
+    the transfer future. Progress is passed to callback(name, bytes_transferred) as it arrives.
+    Returns a list of reports, see upload_files().
+    '''
+
+    from boto3.s3.transfer import ProgressCallbackInvoker
+
+    reports = []
+    futures = []
+    reports_lock = threading.Lock()     # progress of the parts of a file arrives from several transfer threads
+
+    def on_progress(report):
+        def progress(bytes_transferred):
+            with reports_lock:
+                report['bytes'] += bytes_transferred
+                report['seconds'] = round(time.time() - report['started'], 3)
+            if callback is not None:
+                callback(report['file'], bytes_transferred)
+        return progress
+
+    for submit_fn, name in zip(submit_fns, names):
+        report = {'file': name, 'key': "", 'bytes': 0, 'seconds': 0, 'error': "", 'started': time.time()}
+        reports.append(report)
+
+        try:
+            futures.append(submit_fn([ProgressCallbackInvoker(on_progress(report))]))
+        except Exception as e:
+            report['error'] = str(e)
+            futures.append(None)
+
+    for future, report in zip(futures, reports):
+        try:
+            if future is not None:
+                future.result()
+        except Exception as e:
+            print(f"\nERROR in run_transfers: {report['file']}: {e}")
+            report['error'] = str(e)
+
+        # transfers without progress events, e.g. empty files, are timed when their result is collected
+        if report['seconds'] == 0:
+            report['seconds'] = round(time.time() - report['started'], 3)
+        del report['started']
+
+    return reports
+
+
+def upload_files(files: list, bucket_name: str, object_prefix: str, object_names: list = None, callback=None, **settings) -> list:
+    '''
+    Uploads many files concurrently through the shared transfer manager. Each file is a local path, or a file-like
+    object with a name attribute (e.g. a Streamlit UploadedFile). The objects are named after the files unless
+    object_names is given. Settings in transfer_settings can be overridden
+    by keyword arguments, e.g. max_bandwidth. Progress is passed to callback(filename, bytes_transferred).
+    A failed file does not stop the others.
+    Returns a list of reports containing {'file': str, 'key': str, 'bytes': int, 'seconds': float, 'error': str}.
+    '''
+
+    try:
+        manager = get_transfer_manager(**settings)
+        object_prefix = object_prefix[:-1] if object_prefix[-1] == '/' else object_prefix
+        names = []
+        keys = []
+        submit_fns = []
+
+        for i, f in enumerate(files):
+            source = f if isinstance(f, str) else getattr(f, 'name', "")
+            junk, sep, file_name = source.rpartition('/')
+            file_name = object_names[i] if object_names is not None else file_name
+            object_key = f"{object_prefix}/{file_name}"
+            names.append(file_name)
+            keys.append(object_key)
+            submit_fns.append(lambda subscribers, f=f, k=object_key: manager.upload(f, bucket_name, k, subscribers=subscribers))
+
+        reports = run_transfers(submit_fns, names, callback)
+
+        for report, object_key in zip(reports, keys):
+            report['key'] = object_key
+
+        print(f"Uploaded {len([r for r in reports if r['error'] == ''])}/{len(reports)} files to '{bucket_name}/{object_prefix}'")
+        return reports
+
+    except Exception as e:
+        print(f"\nERROR in upload_files: {e}")
+        raise e
+
+
+def download_files(bucket_name: str, keys: list, local_path: str, callback=None, **settings) -> list:
+    '''
+    Downloads many objects concurrently through the shared transfer manager to a local path.
+    The local path should include a trailing '/'. For example, 'temp/'.
+    Settings and callback are the same as for upload_files().
+    Returns a list of reports containing {'file': local filepath, 'key': str, 'bytes': int, 'seconds': float, 'error': str}.
+    '''
+
+    try:
+        manager = get_transfer_manager(**settings)
+        utils.create_directory(local_path)
+        filepaths = []
+        submit_fns = []
+
+        for key in keys:
+            junk, sep, filename_ext = key.rpartition('/')
+            filepaths.append(f"{local_path}{filename_ext}")
+            submit_fns.append(lambda subscribers, k=key, p=filepaths[-1]: manager.download(bucket_name, k, p, subscribers=subscribers))
+
+        reports = run_transfers(submit_fns, filepaths, callback)
+
+        for report, key in zip(reports, keys):
+            report['key'] = key
+
+        return reports
+
+    except Exception as e:
+        print(f"\nERROR in download_files: {e}")
+        raise e
+
+
+def upload_stream(read_fn, bucket_name: str, object_key: str, resume: dict = None,
+                  part_size: int = stream_part_size, max_concurrency: int = stream_concurrency) -> str:
+    '''
+    Uploads a stream of unknown length to S3 with a multipart upload, sending parts concurrently as the bytes arrive.
+    read_fn is called like file.read(size) and returns b"" at the end of the stream.
+    At most max_concurrency + 1 parts are held in memory, and nothing is written to local disk.
+    If resume is given, the upload ID is recorded in it. When the same resume dictionary is passed again after a failure,
+    the stream is read from the start and parts already uploaded with the same content are skipped.
+    The upload is left open on failure, see abort_upload().
+    Returns the object key of the uploaded file in S3 as a string.
     '''
-    Retrieves a list of object keys from the given bucket.
+
+    s3_client = utils.get_client('s3')
+    resume = resume if resume is not None else {}
+
+    try:
+        uploaded = {}
+
+        if resume.get('upload_id', "") != "":
+            paginator = s3_client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=bucket_name, Key=object_key, UploadId=resume['upload_id']):
+                for p in page.get('Parts', []):
+                    uploaded[p['PartNumber']] = (p['ETag'].strip('"'), p['Size'])
+        else:
+            response = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_key)
+            resume['upload_id'] = response['UploadId']
+
+        upload_id = resume['upload_id']
+        slots = threading.BoundedSemaphore(max_concurrency)
+        futures = []
+        skipped = 0
+
+        def upload_part(part_number, data):
+            try:
+                response = s3_client.upload_part(Bucket=bucket_name, Key=object_key, UploadId=upload_id,
+                                                  PartNumber=part_number, Body=data)
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                slots.release()
+
+        # concurrent.futures pulls in logging; it is imported where it is used to keep the Lambdas' cold start short
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            part_number = 0
+
+            while True:
+                # fill a part, reading until part_size bytes arrive or the stream ends; the chunks are joined once,
+                # since a pipe may deliver a part in many small reads
+                chunks = []
+                size = 0
+                while size < part_size:
+                    chunk = read_fn(part_size - size)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    size += len(chunk)
+                data = b"".join(chunks)
+
+                if data == b"" and part_number > 0:
+                    break
+
+                part_number += 1
+                etag = hashlib.md5(data).hexdigest()
+
+                if uploaded.get(part_number) == (etag, len(data)):
+                    futures.append({'PartNumber': part_number, 'ETag': f'"{etag}"'})
+                    skipped += 1
+                else:
+                    slots.acquire()
+                    futures.append(pool.submit(upload_part, part_number, data))
+
+                if len(data) < part_size:
+                    break
+
+            parts = [f if isinstance(f, dict) else f.result() for f in futures]
+
+        s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id,
+                                            MultipartUpload={'Parts': parts})
+
+        print(f"Stream uploaded successfully to '{bucket_name}/{object_key}' ({len(parts)} parts, {skipped} resumed)")
+        return object_key
+
+    except Exception as e:
+        print(f"\nERROR in upload_stream: {e}")
+        raise e
+
+
+def abort_upload(bucket_name: str, object_key: str, resume: dict) -> None:
+    '''
+    Aborts the multipart upload recorded in the resume dictionary of upload_stream(), deleting the uploaded parts.
+    '''
+
+    if resume.get('upload_id', "") != "":
+        utils.get_client('s3').abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=resume['upload_id'])
+        resume['upload_id'] = ""
+
+
+def list_bucket(bucket_name: str, prefix: str = "", delimiter: str = "") -> list:
+    '''
+    Retrieves a list of object keys from the given bucket, optionally limited to a prefix.
+    If a delimiter is given, keys below the next delimiter (i.e. in "subfolders") are not listed.
     Returns a list of strings.
     '''
 
-    s3 = boto3.client('s3')
+    s3 = utils.get_client('s3')
     objects = []
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+    if delimiter != "":
+        kwargs['Delimiter'] = delimiter
 
-    response = s3.list_objects_v2(Bucket=bucket_name)
+    response = s3.list_objects_v2(**kwargs)
 
     if 'Contents' in response:
         for obj in response['Contents']:            
             objects.append(obj['Key'])
 
-        while response['IsTruncated']:
-            response = s3.list_objects_v2(Bucket=bucket_name, ContinuationToken=response['NextContinuationToken'])
-            for obj in response['Contents']:                
-                objects.append(obj['Key'])
+    while response['IsTruncated']:
+        response = s3.list_objects_v2(**kwargs, ContinuationToken=response['NextContinuationToken'])
+        for obj in response.get('Contents', []):
+            objects.append(obj['Key'])
 
     return objects
+
+
+def list_etags(bucket_name: str, prefix: str = "") -> dict:
+    '''
+    Retrieves the ETags of the objects below the prefix, e.g. to detect new and changed objects without reading them.
+    Returns a dictionary of {key: etag}.
+    '''
+
+    s3 = utils.get_client('s3')
+    etags = {}
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        etags.update({obj['Key']: obj['ETag'] for obj in response.get('Contents', [])})
+
+        if not response['IsTruncated']:
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    return etags
+
+
+def list_prefixes(bucket_name: str, prefix: str = "", delimiter: str = "/") -> list:
+    '''
+    Retrieves the common prefixes ("folders") directly below the given prefix, without listing the objects in them.
+    Returns a list of strings, each ending with the delimiter.
+    '''
+
+    s3 = utils.get_client('s3')
+    prefixes = []
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'Delimiter': delimiter}
+
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        prefixes += [p['Prefix'] for p in response.get('CommonPrefixes', [])]
+
+        if not response['IsTruncated']:
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    return prefixes
+
+
+def object_exists(bucket_name: str, key: str) -> bool:
+    '''
+    Checks if the object exists. Returns a bool.
+    '''
+
+    try:
+        utils.get_client('s3').head_object(Bucket=bucket_name, Key=key)
+        return True
+
+    except Exception as e:
+        if is_error(e, 'NoSuchKey', '404', 'NotFound'):
+            return False
+
+        print(f"\nERROR in object_exists: {e}")
+        raise e
+
+
+def copy_object(bucket_name: str, source_key: str, target_key: str, source_bucket: str = "") -> str:
+    '''
+    Copies an object within the bucket, or from source_bucket if given. Returns the target key.
+    '''
+
+    utils.get_client('s3').copy_object(
+        Bucket=bucket_name,
+        Key=target_key,
+        CopySource={'Bucket': source_bucket if source_bucket != "" else bucket_name, 'Key': source_key}
+    )
+
+    return target_key
+
+
+def get_content_hash(bucket_name: str, key: str) -> str:
+    '''
+    Reads a hash of the object's content without downloading it.
+    Uses the "sha256" user metadata if the uploader set it, otherwise the ETag, which is the MD5 of the content for
+    single-part uploads and is stable for multipart uploads made with the same part size.
+    Returns a string prefixed with the hash type, e.g. "sha256:<hex>" or "etag:<etag>".
+    '''
+
+    response = utils.get_client('s3').head_object(Bucket=bucket_name, Key=key)
+    sha256 = response.get('Metadata', {}).get('sha256', "")
+
+    if sha256 != "":
+        return f"sha256:{sha256}"
+
+    etag = response['ETag'].strip('"')
+    return f"etag:{etag}"
+
+
+def get_presigned_url(bucket_name: str, key: str, expires_in: int = 3600) -> str:
+    '''
+    Generates a presigned GET URL for the object, e.g. to let a browser stream a video directly from S3.
+    S3 serves byte-range requests on the URL, so seeking only fetches the needed parts of the object.
+    Returns the URL as a string.
+    '''
+
+    return utils.get_client('s3').generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket_name, 'Key': key},
+        ExpiresIn=expires_in
+    )
+
+
+def is_error(e: Exception, *codes: str) -> bool:
+    '''
+    Checks if the exception is a botocore ClientError with one of the given error codes.
+    Returns a bool.
+    '''
+
+    response = getattr(e, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in codes
+
+
+def read_json(bucket_name: str, key: str) -> tuple:
+    '''
+    Reads a JSON object from S3.
+    Returns a tuple containing (dictionary, etag), or (None, None) if the object does not exist.
+    '''
+
+    try:
+        response = utils.get_client('s3').get_object(Bucket=bucket_name, Key=key)
+        return (json.loads(response['Body'].read().decode('utf-8')), response['ETag'])
+
+    except Exception as e:
+        if is_error(e, 'NoSuchKey', '404'):
+            return (None, None)
+
+        print(f"\nERROR in read_json: {e}")
+        raise e
+
+
+def write_json(bucket_name: str, key: str, data, etag: str = None, create_only: bool = False) -> str:
+    '''
+    Writes a JSON object to S3. If etag is given, the write only succeeds if the object has not changed since it was read.
+    If create_only is True, the write only succeeds if the object does not exist yet.
+    Raises a ClientError with the code "PreconditionFailed" if the condition is not met.
+    Returns the new etag as a string.
+    '''
+
+    kwargs = {}
+    if etag is not None:
+        kwargs['IfMatch'] = etag
+    elif create_only:
+        kwargs['IfNoneMatch'] = '*'
+
+    response = utils.get_client('s3').put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=json.dumps(data, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        **kwargs
+    )
+
+    return response['ETag']
+
+
+def delete_json(bucket_name: str, key: str, etag: str) -> bool:
+    '''
+    Deletes a JSON object from S3 only if it has not changed since it was read or written with the given etag.
+    Returns True if the object was deleted, False if it changed or no longer exists.
+    '''
+
+    try:
+        utils.get_client('s3').delete_object(Bucket=bucket_name, Key=key, IfMatch=etag)
+        return True
+
+    except Exception as e:
+        if is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey', '404'):
+            return False
+
+        print(f"\nERROR in delete_json: {e}")
+        raise e
+
+
+def update_json(bucket_name: str, key: str, update_fn, default=None, retries: int = 10):
+    '''
+    Applies update_fn to a JSON object in S3 with optimistic concurrency: the object is read, updated, and written back
+    only if no other writer changed it in the meantime, otherwise the update is retried on the latest version.
+    update_fn receives the current data (or a copy of default if the object does not exist) and returns the new data,
+    or None to leave the object unchanged.
+    Returns the data that was written, or the current data if nothing was written.
+    '''
+
+    for attempt in range(retries + 1):
+        current, etag = read_json(bucket_name, key)
+        current = json.loads(json.dumps(default)) if current is None else current
+        data = update_fn(current)
+
+        if data is None:
+            return current
+
+        try:
+            write_json(bucket_name, key, data, etag, create_only=etag is None)
+            return data
+
+        except Exception as e:
+            if not is_error(e, 'PreconditionFailed', 'ConditionalRequestConflict') or attempt >= retries:
+                print(f"\nERROR in update_json: {e}")
+                raise e
+
+            time.sleep(random.uniform(0, 0.1 * (attempt + 1)))
@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+# priority classes, lower values run first: work on the critical path of chapterization beats enrichment, which beats optional extras
+CHAPTERIZATION = 0
+ENRICHMENT = 1
+OPTIONAL = 2
+
+# the scheduler's worker threads live as long as the Lambda container and are shared by all invocations
+max_workers = 10
+deadline_margin = 30    # seconds of the Lambda's remaining time reserved for writing the outputs
+duration_weight = 0.2   # weight of the latest task in the moving average of task durations per priority class
+
+queue = []              # heap of (priority, sequence number, future, fn, args, kwargs)
+sequence = itertools.count()
+queue_lock = threading.Condition()
+workers = []
+deadline = {'time': None}   # epoch seconds after which pending tasks are cancelled, or None
+durations = {}          # {priority: moving average of task seconds}
+stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'expired': 0}
+
+
+def set_deadline(context=None, margin: float = None) -> None:
+    '''
+    Sets the deadline of the current invocation to the Lambda's remaining time minus margin (deadline_margin by default).
+    Clears the deadline if context is None, e.g. when the handler runs locally.
+    '''
+
+    margin = deadline_margin if margin is None else margin
+
+    with queue_lock:
+        if context is None:
+            deadline['time'] = None
+        else:
+            deadline['time'] = time.time() + context.get_remaining_time_in_millis() / 1000 - margin
+
+
+def start() -> None:
+    '''
+    Starts the worker threads on first use.
+    '''
+
+    with queue_lock:
+        while len(workers) < max_workers:
+            worker = threading.Thread(target=run_worker, name=f"scheduler-{len(workers)}", daemon=True)
+            worker.start()
+            workers.append(worker)
+
+
+def submit(fn, *args, priority: int = ENRICHMENT, **kwargs) -> 'Future':
+    '''
+    Queues fn(*args, **kwargs) in its priority class. Tasks run in order of priority, then submission.
+    Tasks must not wait for other tasks, since all tasks share the same worker threads.
+    Returns a Future with the result or exception of the task.
+    '''
+
+    # concurrent.futures pulls in logging; it is imported on first use to keep the Lambdas' cold start short
+    from concurrent.futures import Future
+
+    start()
+    future = Future()
+
+    with queue_lock:
+        heapq.heappush(queue, (priority, next(sequence), future, fn, args, kwargs))
+        stats['submitted'] += 1
+        queue_lock.notify()
+
+    return future
+
+
+def run_worker() -> None:
+    '''
+    Runs queued tasks. A task that can no longer finish before the deadline, based on the average duration of its
+    priority class, fails with a TimeoutError instead of running.
+    '''
+
+    while True:
+        with queue_lock:
+            while len(queue) == 0:
+                queue_lock.wait()
+            priority, seq, future, fn, args, kwargs = heapq.heappop(queue)
+            expires = deadline['time']
+            expected = durations.get(priority, 0)
+
+        if not future.set_running_or_notify_cancel():
+            continue
+
+        if expires is not None and time.time() + expected > expires:
+            with queue_lock:
+                stats['expired'] += 1
+            future.set_exception(TimeoutError(f"Task {getattr(fn, '__name__', 'task')} cancelled, it cannot finish before the deadline"))
+            continue
+
+        start_time = time.time()
+
+        try:
+            result = fn(*args, **kwargs)
+
+        except BaseException as e:
+            with queue_lock:
+                stats['failed'] += 1
+            future.set_exception(e)
+            continue
+
+        with queue_lock:
+            stats['completed'] += 1
+            elapsed = time.time() - start_time
+            durations[priority] = elapsed if priority not in durations else (1 - duration_weight) * durations[priority] + duration_weight * elapsed
+
+        future.set_result(result)
+
+
+def cancel(futures: list) -> int:
+    '''
+    Cancels the futures that have not started yet.
+    Returns the number of cancelled futures.
+    '''
+
+    cancelled = len([f for f in futures if f.cancel()])
+
+    with queue_lock:
+        stats['cancelled'] += cancelled
+
+    return cancelled
+
+
+def gather(futures: list) -> list:
+    '''
+    Waits for the futures in order. If a task fails, or the deadline passes while waiting, the remaining tasks
+    that have not started are cancelled and the exception is raised.
+    Returns the list of results in the order of the futures.
+    '''
+
+    results = []
+
+    try:
+        for future in futures:
+            expires = deadline['time']
+            timeout = max(expires - time.time(), 0) if expires is not None else None
+            results.append(future.result(timeout=timeout))
+
+    except Exception as e:
+        cancel(futures)
+
+        if isinstance(e, TimeoutError) and len(results) < len(futures) and not futures[len(results)].done():
+            raise TimeoutError(f"Deadline reached with {len(futures) - len(results)} of {len(futures)} tasks unfinished")
+        raise e
+
+    return results
+
+
+def get_stats() -> dict:
+    '''
+    Returns a copy of the task counts, the queue length, and the average task seconds per priority class.
+    '''
+
+    with queue_lock:
+        return {**stats, 'queued': len(queue), 'durations': {p: round(d, 3) for p, d in durations.items()}}
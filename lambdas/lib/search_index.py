@@ -0,0 +1,458 @@
+from . import (
+    manifest,
+    retrieval,
+    s3,
+    utils
+)
+from concurrent.futures import ThreadPoolExecutor
+import math
+import time
+import uuid
+import zlib
+
+
+# cross-course inverted index over the chapter titles, summaries, and transcripts of all jobs. Each indexed job is
+# written as a new immutable segment, and segments of the same tier are merged into a larger segment once there are
+# merge_factor of them, so that a job completion only writes its own postings, and the postings of each job are
+# rewritten about log(jobs) times over the life of the index. The catalog lists the segments and the segment that
+# holds the live postings of each job; postings of jobs that were reindexed since are ignored and dropped when merged
+search_prefix = "_search/"
+catalog_key = f"{search_prefix}catalog.json"
+segment_prefix = f"{search_prefix}segments/"
+term_shard_count = 32       # postings shards per segment, so that a search only reads the shards of its query terms
+merge_factor = 8            # segments of the same tier that are merged into one segment of the next tier
+merge_lease = 900           # seconds after which the claim of an unfinished merge expires
+indexed_kinds = ['transcript', 'summary']   # quiz chunks are left to the per-job retrieval index
+fanout = 16
+
+# each posting is a flat run of [chunk_id, chapter_id, start_time, chunk length, kind index, tf] per chunk of the job,
+# where chunk_id numbers the job's indexed chunks. Segments written before the chunk ID was added have no 'width' in
+# the catalog and postings of legacy_posting_width without it; they are still searched, and the next index_job reindexes
+# their jobs (see migrate)
+posting_width = 6
+legacy_posting_width = 5
+
+
+def new_catalog() -> dict:
+    '''
+    Returns an empty catalog as a dictionary of
+    {
+        'segments': {segment_id: {'tier': int, 'jobs': list(job_id), 'shards': list(shard index), 'created': int, 'width': int}},
+        'jobs': {job_id: [segment_id, chunks, total chunk length]},
+        'merging': {segment_id: claimed epoch seconds}
+    }
+    '''
+
+    return {'segments': {}, 'jobs': {}, 'merging': {}}
+
+
+def get_term_shard(term: str) -> int:
+    '''
+    Returns the index of the postings shard that holds the term within a segment.
+    '''
+
+    return zlib.crc32(term.encode('utf-8')) % term_shard_count
+
+
+def get_shard_key(segment_id: str, shard: int) -> str:
+    '''
+    Returns the S3 key of a postings shard of the segment.
+    '''
+
+    return f"{segment_prefix}{segment_id}/terms-{shard:02d}.json"
+
+
+def get_titles_key(segment_id: str) -> str:
+    '''
+    Returns the S3 key of the chapter titles of the segment's jobs.
+    '''
+
+    return f"{segment_prefix}{segment_id}/titles.json"
+
+
+def get_job_postings(chapters: list) -> tuple:
+    '''
+    Splits the chapters into chunks (see retrieval.get_chunks) and counts the terms of each chunk, with the chapter
+    title indexed along with the chunk text.
+    Returns a tuple of (titles, postings, chunks, length), where titles is a dictionary of {str(chapter_id): title},
+    postings is a dictionary of {term: [chunk_id, chapter_id, start_time, length, kind, tf, ...]}, and chunks and length are the
+    number of chunks and their total length in tokens.
+    '''
+
+    titles = {str(c['id']): c['title'] for c in chapters}
+    postings = {}
+    chunks = 0
+    length = 0
+
+    for chunk in retrieval.get_chunks(chapters):
+        if chunk['kind'] not in indexed_kinds:
+            continue
+
+        tokens = retrieval.tokenize(f"{chunk['title']} {chunk['text']}")
+        tf = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+
+        for t, f in tf.items():
+            postings.setdefault(t, []).extend([chunks, chunk['chapter_id'], round(chunk['start_time'], 1), len(tokens), indexed_kinds.index(chunk['kind']), f])
+
+        chunks += 1
+        length += len(tokens)
+
+    return (titles, postings, chunks, length)
+
+
+def write_segment(bucket: str, segment_id: str, postings: dict, titles: dict) -> list:
+    '''
+    Writes the postings, given as {term: {job_id: posting}}, and the titles, given as {job_id: {chapter_id: title}},
+    as the files of a segment.
+    Returns the sorted list of the shard indexes that were written.
+    '''
+
+    shards = {}
+    for t, p in postings.items():
+        shards.setdefault(get_term_shard(t), {})[t] = p
+
+    writes = [(get_shard_key(segment_id, i), {'postings': p}) for i, p in shards.items()] + [(get_titles_key(segment_id), titles)]
+
+    with ThreadPoolExecutor(max_workers=fanout) as pool:
+        list(pool.map(lambda w: s3.write_json(bucket, w[0], w[1]), writes))
+
+    return sorted(shards.keys())
+
+
+def delete_segment(bucket: str, segment_id: str, segment: dict) -> None:
+    '''
+    Deletes the files of a segment that was merged. Searches that still read the previous catalog skip the missing files.
+    '''
+
+    keys = [get_shard_key(segment_id, i) for i in segment['shards']] + [get_titles_key(segment_id)]
+    s3_client = utils.get_client('s3')
+
+    with ThreadPoolExecutor(max_workers=fanout) as pool:
+        list(pool.map(lambda k: s3_client.delete_object(Bucket=bucket, Key=k), keys))
+
+
+def new_segment_id() -> str:
+    '''
+    Returns a unique segment ID that sorts by creation time.
+    '''
+
+    return f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+
+
+def add_segment(bucket: str, job_id: str, chapters: list) -> int:
+    '''
+    Writes the job's postings as a new segment and makes it the job's live segment in the catalog. An empty chapter list
+    removes the job.
+    Returns the number of indexed chunks.
+    '''
+
+    titles, postings, chunks, length = get_job_postings(chapters)
+    segment_id = new_segment_id()
+    shards = write_segment(bucket, segment_id, {t: {job_id: p} for t, p in postings.items()}, {job_id: titles}) if chunks > 0 else []
+
+    def add(catalog):
+        if chunks > 0:
+            catalog['segments'][segment_id] = {'tier': 0, 'jobs': [job_id], 'shards': shards, 'created': int(time.time()), 'width': posting_width}
+            catalog['jobs'][job_id] = [segment_id, chunks, length]
+        else:
+            catalog['jobs'].pop(job_id, None)
+        return catalog
+
+    s3.update_json(bucket, catalog_key, add, default=new_catalog())
+    print(f"Indexed {chunks} chunks of '{job_id}' for search in segment {segment_id}")
+
+    return chunks
+
+
+def index_job(bucket: str, job_id: str, chapters: list) -> int:
+    '''
+    Writes the job's postings as a new segment and makes it the job's live segment in the catalog, so that reprocessed
+    jobs leave no stale results. An empty chapter list removes the job. Then migrates the segments of the legacy
+    posting layout, if any are left, and merges the segments if a tier is full.
+    Index errors are logged and recorded in the job's manifest entry as search_error rather than raised, so that they
+    never fail the pipeline; rebuild_index backfills the jobs that are missing from the catalog.
+    Returns the number of indexed chunks, or -1 if the update failed.
+    '''
+
+    try:
+        chunks = add_segment(bucket, job_id, chapters)
+
+    except Exception as e:
+        print(f"\nERROR in search_index.index_job: {e}")
+        manifest.update_job(bucket, job_id, search_error=str(e))
+        return -1
+
+    # the job is searchable at this point, a failed migration or merge is retried by the next index_job
+    try:
+        migrate(bucket)
+        merge(bucket)
+
+    except Exception as e:
+        print(f"\nERROR migrating or merging the search segments: {e}")
+
+    return chunks
+
+
+def migrate(bucket: str) -> int:
+    '''
+    Reindexes the jobs whose live segment has the legacy posting layout without chunk IDs from their chapters.json, and
+    drops the legacy segments. The segments are claimed in the catalog like a merge, so that concurrent callers
+    migrate different segments. Jobs without chapters.json are removed from the index.
+    Returns the number of migrated segments.
+    '''
+
+    claimed = {'segment_ids': []}
+
+    def claim(catalog):
+        now = int(time.time())
+        catalog['merging'] = {s: t for s, t in catalog['merging'].items() if s in catalog['segments'] and now - t < merge_lease}
+        claimed['segment_ids'] = [
+            s for s, segment in sorted(catalog['segments'].items())
+            if segment.get('width', legacy_posting_width) != posting_width and s not in catalog['merging']
+        ]
+
+        if len(claimed['segment_ids']) == 0:
+            return None
+
+        catalog['merging'].update({s: now for s in claimed['segment_ids']})
+        return catalog
+
+    catalog = s3.update_json(bucket, catalog_key, claim, default=new_catalog())
+    segment_ids = claimed['segment_ids']
+
+    if len(segment_ids) == 0:
+        return 0
+
+    sources = {s: catalog['segments'][s] for s in segment_ids}
+    live = sorted(set([j for s in segment_ids for j in sources[s]['jobs'] if catalog['jobs'].get(j, [""])[0] == s]))
+
+    def reindex(job_id):
+        chapters = s3.read_json(bucket, f"{job_id}/chapters.json")[0]
+        return add_segment(bucket, job_id, chapters or [])
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(reindex, live))
+
+    def commit(catalog):
+        for s in segment_ids:
+            catalog['segments'].pop(s, None)
+            catalog['merging'].pop(s, None)
+        return catalog
+
+    s3.update_json(bucket, catalog_key, commit, default=new_catalog())
+
+    for s in segment_ids:
+        delete_segment(bucket, s, sources[s])
+
+    print(f"Migrated {len(segment_ids)} legacy search segments with {len(live)} jobs")
+    return len(segment_ids)
+
+
+def claim_merge(bucket: str) -> tuple:
+    '''
+    Claims merge_factor unclaimed segments of the lowest full tier in the catalog, leaving segments of the legacy posting
+    layout to migrate. Expired claims are released first.
+    Returns a tuple of (catalog, segment IDs, tier), with an empty list of segment IDs if no tier is full.
+    '''
+
+    claimed = {'segment_ids': [], 'tier': 0}
+
+    def claim(catalog):
+        now = int(time.time())
+        catalog['merging'] = {s: t for s, t in catalog['merging'].items() if s in catalog['segments'] and now - t < merge_lease}
+
+        # legacy segments are left to migrate
+        tiers = {}
+        for segment_id in sorted(catalog['segments'].keys()):
+            if segment_id not in catalog['merging'] and catalog['segments'][segment_id].get('width', legacy_posting_width) == posting_width:
+                tiers.setdefault(catalog['segments'][segment_id]['tier'], []).append(segment_id)
+
+        for tier, segment_ids in sorted(tiers.items()):
+            if len(segment_ids) >= merge_factor:
+                claimed['segment_ids'] = segment_ids[:merge_factor]
+                claimed['tier'] = tier
+                catalog['merging'].update({s: now for s in claimed['segment_ids']})
+                return catalog
+
+        claimed['segment_ids'] = []
+        return None
+
+    catalog = s3.update_json(bucket, catalog_key, claim, default=new_catalog())
+    return (catalog, claimed['segment_ids'], claimed['tier'])
+
+
+def merge(bucket: str) -> int:
+    '''
+    Merges merge_factor segments of the same tier into one segment of the next tier, dropping the postings of jobs that
+    were reindexed or removed since, until no tier is full. Segments are claimed in the catalog first, so that
+    concurrent callers merge different segments.
+    Returns the number of merges.
+    '''
+
+    merges = 0
+
+    while True:
+        catalog, segment_ids, tier = claim_merge(bucket)
+
+        if len(segment_ids) == 0:
+            return merges
+
+        sources = {s: catalog['segments'][s] for s in segment_ids}
+        live = set([j for s in segment_ids for j in sources[s]['jobs'] if catalog['jobs'].get(j, [""])[0] == s])
+        shard_keys = [get_shard_key(s, i) for s in segment_ids for i in sources[s]['shards']]
+
+        with ThreadPoolExecutor(max_workers=fanout) as pool:
+            shards = list(pool.map(lambda k: s3.read_json(bucket, k)[0], shard_keys))
+            source_titles = list(pool.map(lambda s: s3.read_json(bucket, get_titles_key(s))[0], segment_ids))
+
+        postings = {}
+        for shard in shards:
+            for t, p in (shard or {'postings': {}})['postings'].items():
+                for j, posting in p.items():
+                    if j in live:
+                        postings.setdefault(t, {})[j] = posting
+
+        titles = {}
+        for source in source_titles:
+            titles.update({j: chapter_titles for j, chapter_titles in (source or {}).items() if j in live})
+
+        merged_id = new_segment_id()
+        merged_shards = write_segment(bucket, merged_id, postings, titles)
+
+        def commit(catalog):
+            jobs = [j for j in sorted(live) if catalog['jobs'].get(j, [""])[0] in sources]
+
+            for j in jobs:
+                catalog['jobs'][j][0] = merged_id
+            for s in segment_ids:
+                catalog['segments'].pop(s, None)
+                catalog['merging'].pop(s, None)
+
+            catalog['segments'][merged_id] = {'tier': tier + 1, 'jobs': jobs, 'shards': merged_shards, 'created': int(time.time()), 'width': posting_width}
+            return catalog
+
+        s3.update_json(bucket, catalog_key, commit, default=new_catalog())
+
+        for s in segment_ids:
+            delete_segment(bucket, s, sources[s])
+
+        print(f"Merged {len(segment_ids)} search segments of tier {tier} with {len(live)} jobs into segment {merged_id}")
+        merges += 1
+
+
+def rebuild_index(bucket: str, jobs: dict, missing_only: bool = True) -> int:
+    '''
+    Indexes the complete jobs of the manifest (see manifest.read_jobs) that are missing from the catalog, e.g. to
+    backfill jobs that were processed before the search index existed or whose indexing failed, or all complete jobs
+    if missing_only is False.
+    Returns the number of indexed jobs.
+    '''
+
+    catalog = s3.read_json(bucket, catalog_key)[0] or new_catalog()
+    complete = [
+        job_id for job_id, entry in jobs.items()
+        if entry['status'] == 'complete' and 'chapters_s3_key' in entry and (not missing_only or job_id not in catalog['jobs'])
+    ]
+
+    def index(job_id):
+        chapters = s3.read_json(bucket, jobs[job_id]['chapters_s3_key'])[0]
+        return index_job(bucket, job_id, chapters or [])
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        counts = list(pool.map(index, complete))
+
+    return len([c for c in counts if c >= 0])
+
+
+def search(bucket: str, query: str, k: int = 10, fetch_json=None) -> list:
+    '''
+    Scores the indexed chunks of all jobs against the query with BM25. Only the catalog, the postings shards of the
+    query terms in each segment, and the titles of the segments that hold the top k results are read. fetch_json(bucket,
+    key) returns a parsed object or None if it does not exist, and defaults to reading from S3, e.g. the UI passes a
+    cached reader; segment files never change once written, so only the catalog needs revalidating.
+    Returns the top k chapters as a list of dictionaries containing
+    {
+        'job_id': str,
+        'chapter_id': int,
+        'title': str,
+        'start_time': float,    # start of the best matching chunk of the chapter
+        'kind': 'transcript' | 'summary',
+        'score': float
+    }
+    in descending order of score.
+    '''
+
+    if fetch_json is None:
+        fetch_json = lambda b, key: s3.read_json(b, key)[0]
+
+    terms = sorted(set(retrieval.tokenize(query)))
+
+    if len(terms) == 0:
+        return []
+
+    catalog = fetch_json(bucket, catalog_key) or new_catalog()
+    jobs = catalog['jobs']
+    widths = {segment_id: segment.get('width', legacy_posting_width) for segment_id, segment in catalog['segments'].items()}
+    term_shards = set([get_term_shard(t) for t in terms])
+    shard_keys = [
+        (segment_id, get_shard_key(segment_id, i))
+        for segment_id, segment in sorted(catalog['segments'].items())
+        for i in segment['shards'] if i in term_shards
+    ]
+
+    with ThreadPoolExecutor(max_workers=fanout) as pool:
+        shards = list(pool.map(lambda sk: fetch_json(bucket, sk[1]), shard_keys))
+
+    n = sum([j[1] for j in jobs.values()])
+    avg_length = sum([j[2] for j in jobs.values()]) / n if n > 0 else 0
+    scores = {}
+
+    for t in terms:
+        # live postings of the term across the segments, as (segment_id, job_id, posting)
+        postings = [
+            (segment_id, job_id, p)
+            for (segment_id, key), shard in zip(shard_keys, shards) if shard is not None
+            for job_id, p in shard['postings'].get(t, {}).items() if jobs.get(job_id, [""])[0] == segment_id
+        ]
+        df = sum([len(p) // widths[segment_id] for segment_id, job_id, p in postings])
+        idf = math.log(1 + (n - df + .5) / (df + .5))
+
+        for segment_id, job_id, p in postings:
+            width = widths[segment_id]
+            for i in range(0, len(p), width):
+                # legacy postings have no chunk ID, their chunks are told apart by chapter, start time and kind
+                chunk_id = p[i] if width == posting_width else tuple(p[i:i + 2] + p[i + 3:i + 4])
+                chapter_id, start_time, length, kind, f = p[i + width - legacy_posting_width:i + width]
+                norm = retrieval.k1 * (1 - retrieval.b + retrieval.b * length / max(avg_length, 1))
+                chunk = (job_id, chunk_id)
+
+                if chunk not in scores:
+                    scores[chunk] = {'segment_id': segment_id, 'chapter_id': chapter_id, 'start_time': start_time, 'kind': kind, 'score': 0}
+                scores[chunk]['score'] += idf * f * (retrieval.k1 + 1) / (f + norm)
+
+    # keep the best matching chunk of each chapter
+    best = {}
+    for (job_id, chunk_id), chunk in scores.items():
+        if chunk['score'] > best.get((job_id, chunk['chapter_id']), {'score': 0})['score']:
+            best[(job_id, chunk['chapter_id'])] = {
+                'segment_id': chunk['segment_id'],
+                'job_id': job_id,
+                'chapter_id': chunk['chapter_id'],
+                'title': "",
+                'start_time': chunk['start_time'],
+                'kind': indexed_kinds[chunk['kind']],
+                'score': chunk['score'],
+            }
+
+    results = sorted(best.values(), key=lambda r: -r['score'])[:k]
+    segment_ids = sorted(set([r['segment_id'] for r in results]))
+
+    with ThreadPoolExecutor(max_workers=fanout) as pool:
+        titles = dict(zip(segment_ids, pool.map(lambda s: fetch_json(bucket, get_titles_key(s)) or {}, segment_ids)))
+
+    for r in results:
+        r['title'] = titles[r.pop('segment_id')].get(r['job_id'], {}).get(str(r['chapter_id']), "")
+
+    return results
@@ -0,0 +1,167 @@
+from . import (
+    retrieval,
+    transcribe
+)
+from collections import Counter
+import math
+
+
+# TextTiling-style lexical segmentation of the audio segments into candidate chapter blocks
+window_segments = 6         # segments compared on each side of a gap
+smoothing = 1               # gap scores are averaged with this many neighbours on each side
+min_block_seconds = 60      # boundaries that would create a shorter block are dropped
+max_blocks = 40             # at most this many candidate blocks, keeping the deepest boundaries
+
+
+def get_gap_scores(token_counts: list) -> list:
+    '''
+    Computes the lexical cohesion at each gap between consecutive segments as the cosine similarity of the term
+    counts of the window_segments segments before and after the gap. The windows slide incrementally, so each
+    segment's terms are added and removed once from each window.
+    Returns a list of len(token_counts) - 1 floats, where item i is the gap between segments i and i + 1.
+    '''
+
+    n = len(token_counts)
+    left, right = Counter(), Counter()
+    state = {'dot': 0, 'left_norm': 0, 'right_norm': 0}
+
+    def update(window, other, norm_key, counts, sign):
+        for t, c in counts.items():
+            before = window[t]
+            after = before + sign * c
+            window[t] = after
+            state['dot'] += (after - before) * other[t]
+            state[norm_key] += after * after - before * before
+
+    if n > 0:
+        update(left, right, 'left_norm', token_counts[0], 1)
+    for i in range(1, min(window_segments + 1, n)):
+        update(right, left, 'right_norm', token_counts[i], 1)
+
+    scores = []
+    for gap in range(n - 1):
+        norm = math.sqrt(state['left_norm'] * state['right_norm'])
+        scores.append(state['dot'] / norm if norm > 0 else 0.0)
+
+        # slide both windows one segment to the right
+        update(right, left, 'right_norm', token_counts[gap + 1], -1)
+        update(left, right, 'left_norm', token_counts[gap + 1], 1)
+        if gap + 1 - window_segments >= 0:
+            update(left, right, 'left_norm', token_counts[gap + 1 - window_segments], -1)
+        if gap + 1 + window_segments < n:
+            update(right, left, 'right_norm', token_counts[gap + 1 + window_segments], 1)
+
+    return scores
+
+
+def smooth(scores: list) -> list:
+    '''
+    Averages each score with its neighbours within smoothing gaps.
+    Returns a list of floats.
+    '''
+
+    smoothed = []
+    for i in range(len(scores)):
+        window = scores[max(i - smoothing, 0):i + smoothing + 1]
+        smoothed.append(sum(window) / len(window))
+
+    return smoothed
+
+
+def get_depth_scores(scores: list) -> list:
+    '''
+    Computes the depth of each gap: how far its cohesion lies below the highest scores reached by climbing
+    uphill on each side. Deep gaps are likely topic changes.
+    Returns a list of floats.
+    '''
+
+    depths = []
+    for i, s in enumerate(scores):
+        left = i
+        while left > 0 and scores[left - 1] >= scores[left]:
+            left -= 1
+        right = i
+        while right < len(scores) - 1 and scores[right + 1] >= scores[right]:
+            right += 1
+        depths.append((scores[left] - s) + (scores[right] - s))
+
+    return depths
+
+
+def get_boundaries(segments: list, depths: list) -> list:
+    '''
+    Selects the gaps whose depth exceeds the mean minus half the standard deviation and is a local maximum, deepest
+    first, skipping gaps that would create a block shorter than min_block_seconds, up to max_blocks - 1 boundaries.
+    Returns the sorted list of gap indices.
+    '''
+
+    if len(depths) == 0:
+        return []
+
+    mean = sum(depths) / len(depths)
+    std = math.sqrt(sum([(d - mean) ** 2 for d in depths]) / len(depths))
+    cutoff = mean - std / 2
+
+    candidates = [
+        i for i, d in enumerate(depths)
+        if d > 0 and d > cutoff and d >= depths[max(i - 1, 0)] and d >= depths[min(i + 1, len(depths) - 1)]
+    ]
+    candidates.sort(key=lambda i: depths[i], reverse=True)
+
+    # a boundary at gap i starts a block at segment i + 1
+    starts = [segments[0]['start_time'], segments[-1]['end_time']]
+    boundaries = []
+
+    for i in candidates:
+        if len(boundaries) >= max_blocks - 1:
+            break
+
+        start = segments[i + 1]['start_time']
+        if min([abs(start - s) for s in starts]) < min_block_seconds:
+            continue
+
+        starts.append(start)
+        boundaries.append(i)
+
+    return sorted(boundaries)
+
+
+def get_blocks(transcribe_response: dict) -> list:
+    '''
+    Splits the transcript's audio segments into candidate blocks at likely topic changes, without calling a model.
+    Returns an ordered list of dictionaries containing
+    {
+        'id': index,
+        'start_time': int(timestamp),
+        'end_time': int(timestamp),
+        'transcript': str,
+        'depth': float,                 # strength of the boundary at the start of the block, 0 for the first block
+        'segments': list(audio_segments)
+    }
+    '''
+
+    segments = transcribe.get_audio_segments(transcribe_response)
+
+    if len(segments) == 0:
+        return []
+
+    token_counts = [Counter(retrieval.tokenize(s['transcript'])) for s in segments]
+    depths = get_depth_scores(smooth(get_gap_scores(token_counts)))
+    boundaries = get_boundaries(segments, depths)
+
+    blocks = []
+    starts = [0] + [i + 1 for i in boundaries]
+    ends = starts[1:] + [len(segments)]
+
+    for start, end in zip(starts, ends):
+        block_segments = segments[start:end]
+        blocks.append({
+            'id': len(blocks),
+            'start_time': block_segments[0]['start_time'],
+            'end_time': max([s['end_time'] for s in block_segments]),
+            'transcript': ' '.join([s['transcript'] for s in block_segments]),
+            'depth': round(depths[start - 1], 4) if start > 0 else 0,
+            'segments': block_segments,
+        })
+
+    return blocks
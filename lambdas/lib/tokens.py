@@ -0,0 +1,127 @@
+import math
+import threading
+
+
+# rough ratio for English text with the Claude tokenizer, used where an estimate is good enough for budgeting
+chars_per_token = 4
+
+# the ratio is calibrated per model against the input token counts that Bedrock reports (see record_usage)
+calibration_weight = 0.1        # weight of the latest call in the moving average of characters per token
+calibration_min_chars = 400     # shorter prompts are dominated by the message overhead and are not used for calibration
+chars_per_token_range = (1.5, 8.0)
+calibrated = {}                 # {model_id: characters per token}
+calibration_lock = threading.Lock()
+
+# context windows by model ID prefix; inference profile IDs such as "us.anthropic..." match their model's prefix
+context_windows = {
+    'anthropic.claude': 200000,
+    'amazon.nova': 300000,
+    'meta.llama3': 128000,
+    'mistral.': 32000,
+}
+default_context_window = 32000
+response_tokens = 4096          # reserved within the context window for the response
+safety_margin = 1.1             # estimates are inflated by this factor when checking a prompt against its budget
+
+
+def get_chars_per_token(model_id: str = "") -> float:
+    '''
+    Returns the calibrated characters per token of the model, or chars_per_token if it was not calibrated yet.
+    '''
+
+    return calibrated.get(model_id, chars_per_token)
+
+
+def estimate_tokens(text: str, model_id: str = "") -> int:
+    '''
+    Estimates the number of tokens in the text, with the model's calibrated ratio if a model ID is given.
+    Returns an integer.
+    '''
+
+    return math.ceil(len(text) / get_chars_per_token(model_id))
+
+
+def estimate_message_tokens(messages: list, model_id: str = "") -> int:
+    '''
+    Estimates the number of tokens in a Converse messages payload, i.e. a list of {'role': str, 'content': [{'text': str}]}.
+    Returns an integer.
+    '''
+
+    return sum([estimate_tokens(c.get('text', ""), model_id) for m in messages for c in m['content']])
+
+
+def record_usage(model_id: str, messages: list, input_tokens: int) -> None:
+    '''
+    Calibrates the model's characters per token with the input token count that Bedrock reported for the messages.
+    '''
+
+    chars = sum([len(c.get('text', "")) for m in messages for c in m['content']])
+
+    if input_tokens <= 0 or chars < calibration_min_chars:
+        return
+
+    ratio = min(max(chars / input_tokens, chars_per_token_range[0]), chars_per_token_range[1])
+
+    with calibration_lock:
+        previous = calibrated.get(model_id)
+        calibrated[model_id] = ratio if previous is None else (1 - calibration_weight) * previous + calibration_weight * ratio
+
+
+def get_prompt_budget(model_id: str) -> int:
+    '''
+    Returns the number of tokens available to the prompt of the model: its context window less response_tokens.
+    '''
+
+    window = default_context_window
+
+    for prefix, tokens in context_windows.items():
+        if prefix in model_id:
+            window = tokens
+            break
+
+    return window - response_tokens
+
+
+def check_prompt(messages: list, model_id: str) -> int:
+    '''
+    Rejects a prompt that would overflow the model's prompt budget before it is sent, with the estimate inflated by safety_margin.
+    Returns the estimated number of tokens, or raises a ValueError.
+    '''
+
+    estimate = estimate_message_tokens(messages, model_id)
+    budget = get_prompt_budget(model_id)
+
+    if estimate * safety_margin > budget:
+        raise ValueError(f"Prompt of about {estimate} tokens exceeds the {budget} token budget of {model_id}")
+
+    return estimate
+
+
+def pack(items: list, budget: int, get_text=None, overhead: int = 0, model_id: str = "") -> list:
+    '''
+    Fills the items in order into batches whose estimated tokens, plus the overhead of the prompt around each batch,
+    stay within the budget. get_text returns the text of an item (the item itself by default). An item that exceeds
+    the budget on its own is put in a batch of its own, so that the caller decides whether to shorten or reject it.
+    Returns a list of batches, each a list of items.
+    '''
+
+    get_text = get_text or (lambda item: item)
+    batches = []
+    batch = []
+    batch_tokens = overhead
+
+    for item in items:
+        item_tokens = estimate_tokens(get_text(item), model_id)
+
+        if len(batch) > 0 and batch_tokens + item_tokens > budget:
+            batches.append(batch)
+            batch = []
+            batch_tokens = overhead
+
+        batch.append(item)
+        batch_tokens += item_tokens
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
@@ -0,0 +1,264 @@
+from contextlib import contextmanager
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+
+# spans are only recorded inside a trace started by handler(); elsewhere (e.g. in the UI) span() does nothing
+export_dir = os.environ.get('TRACE_EXPORT_DIR', '')         # a JSON file per trace is written here if set
+print_summary = os.environ.get('TRACE_SUMMARY', '1') == '1'  # print the waterfall at the end of each trace
+max_spans = 20000           # spans recorded per trace, so that a very long video cannot exhaust memory
+min_fraction = 0.01         # spans shorter than this fraction of the trace are left out of the waterfall
+max_lines = 80
+bar_width = 40
+
+current_span = contextvars.ContextVar('current_span', default=None)
+traces = {}     # {trace_id: [span]}
+traces_lock = threading.Lock()
+
+
+def start_span(name: str, **attrs) -> dict:
+    '''
+    Starts a span as a child of the current span. The span does not become the current span, see span().
+    Returns the span as a dictionary, or None if there is no trace in progress.
+    '''
+
+    parent = current_span.get()
+
+    if parent is None:
+        return None
+
+    return {
+        'id': os.urandom(8).hex(),
+        'trace_id': parent['trace_id'],
+        'parent_id': parent['id'],
+        'name': name,
+        'attrs': attrs,
+        'start': time.time(),
+        'duration_ms': 0,
+        'thread': threading.current_thread().name,
+        'error': "",
+    }
+
+
+def end_span(span: dict, error: str = "") -> None:
+    '''
+    Ends the span and records it in its trace.
+    '''
+
+    if span is None:
+        return
+
+    span['duration_ms'] = round((time.time() - span['start']) * 1000, 2)
+    span['error'] = error
+
+    with traces_lock:
+        spans = traces.get(span['trace_id'])
+        if spans is not None and len(spans) < max_spans:
+            spans.append(span)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    '''
+    Context manager that records a span around the block as a child of the current span, and makes it the current span
+    within the block. Attributes can be added to the yielded dictionary, e.g. token counts.
+    '''
+
+    s = start_span(name, **attrs)
+    token = current_span.set(s) if s is not None else None
+    error = ""
+
+    try:
+        yield s['attrs'] if s is not None else {}
+
+    except Exception as e:
+        error = str(e)
+        raise e
+
+    finally:
+        if token is not None:
+            current_span.reset(token)
+        end_span(s, error)
+
+
+def wrap(fn, span_name: str = "", **attrs):
+    '''
+    Binds the function to the current span, so that spans started in it, e.g. in a thread pool, keep their parent.
+    If span_name is given, each call is also recorded as a span with the attributes.
+    Returns the wrapped function.
+    '''
+
+    parent = current_span.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = current_span.set(parent)
+        try:
+            if span_name == "":
+                return fn(*args, **kwargs)
+            with span(span_name, **attrs):
+                return fn(*args, **kwargs)
+        finally:
+            current_span.reset(token)
+
+    return run
+
+
+def handler(name: str):
+    '''
+    Decorator for Lambda handlers that records a trace of each invocation. When the handler returns, the waterfall
+    summary is printed and the trace is exported as JSON if export_dir is set.
+    '''
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            trace_id = os.urandom(16).hex()
+            root = {'id': trace_id[:16], 'trace_id': trace_id, 'parent_id': None}
+
+            with traces_lock:
+                traces[trace_id] = []
+
+            token = current_span.set(root)
+            try:
+                with span(name):
+                    return fn(*args, **kwargs)
+
+            finally:
+                current_span.reset(token)
+                with traces_lock:
+                    spans = traces.pop(trace_id, [])
+                report(trace_id, spans)
+
+        return run
+
+    return decorator
+
+
+def get_children(spans: list) -> dict:
+    '''
+    Returns a dictionary of {parent_id: [child spans]} with the children in order of start time.
+    '''
+
+    children = {}
+    for s in sorted(spans, key=lambda x: x['start']):
+        children.setdefault(s['parent_id'], []).append(s)
+
+    return children
+
+
+def get_critical_path(spans: list) -> list:
+    '''
+    Follows the child that ends last from the root span down to a leaf, i.e. the chain of spans that determined
+    the duration of the trace.
+    Returns a list of spans.
+    '''
+
+    ids = {s['id'] for s in spans}
+    children = get_children(spans)
+    roots = [s for s in spans if s['parent_id'] not in ids]
+    path = []
+
+    node = max(roots, key=lambda s: s['duration_ms'], default=None)
+    while node is not None:
+        path.append(node)
+        node = max(children.get(node['id'], []), key=lambda s: s['start'] + s['duration_ms'] / 1000, default=None)
+
+    return path
+
+
+def format_waterfall(spans: list) -> str:
+    '''
+    Formats the spans as a waterfall of start offsets and durations, indented by depth.
+    Spans shorter than min_fraction of the trace are counted but not listed.
+    Returns a string.
+    '''
+
+    if len(spans) == 0:
+        return ""
+
+    ids = {s['id'] for s in spans}
+    children = get_children(spans)
+    roots = [s for s in spans if s['parent_id'] not in ids]
+    start = min([s['start'] for s in spans])
+    total_ms = max([(s['start'] - start) * 1000 + s['duration_ms'] for s in spans]) or 1
+
+    lines = []
+    omitted = 0
+    stack = [(r, 0) for r in reversed(roots)]
+
+    while len(stack) > 0:
+        s, depth = stack.pop()
+
+        if s['duration_ms'] < total_ms * min_fraction or len(lines) >= max_lines:
+            omitted += 1
+        else:
+            offset_ms = (s['start'] - start) * 1000
+            bar_start = int(offset_ms / total_ms * bar_width)
+            bar_len = max(int(s['duration_ms'] / total_ms * bar_width), 1)
+            bar = f"{' ' * bar_start}{'#' * bar_len}".ljust(bar_width)
+            attrs = ' '.join([f"{k}={v}" for k, v in s['attrs'].items()])
+            error = " ERROR" if s['error'] != "" else ""
+            lines.append(f"{offset_ms:9.0f}ms {s['duration_ms']:9.0f}ms |{bar}| {'  ' * depth}{s['name']} {attrs}{error}".rstrip())
+
+        stack += [(c, depth + 1) for c in reversed(children.get(s['id'], []))]
+
+    if omitted > 0:
+        lines.append(f"... {omitted} shorter spans omitted")
+
+    return '\n'.join(lines)
+
+
+def report(trace_id: str, spans: list) -> None:
+    '''
+    Prints the waterfall and critical path of the trace, and exports the trace as JSON if export_dir is set.
+    '''
+
+    try:
+        critical_path = get_critical_path(spans)
+
+        if print_summary and len(spans) > 0:
+            print(f"\nTrace {trace_id} ({len(spans)} spans)\n{format_waterfall(spans)}")
+            path = ' > '.join([f"{s['name']} ({s['duration_ms']:.0f}ms)" for s in critical_path])
+            print(f"Critical path: {path}")
+
+        if export_dir != "":
+            os.makedirs(export_dir, exist_ok=True)
+            name = critical_path[0]['name'] if len(critical_path) > 0 else "trace"
+            with open(f"{export_dir}/{name}-{trace_id}.json", 'w', encoding='utf-8') as f:
+                json.dump({'trace_id': trace_id, 'spans': spans, 'critical_path': [s['id'] for s in critical_path]}, f)
+
+    except Exception as e:
+        print(f"\nERROR in tracing.report: {e}")
+
+
+def instrument_client(client):
+    '''
+    Records a span for each API call of the boto3 client, e.g. "s3.GetObject".
+    Clients without botocore events, such as test stand-ins, are returned unchanged.
+    Returns the client.
+    '''
+
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+
+    if events is None:
+        return client
+
+    def before_call(model, context, **kwargs):
+        context['trace_span'] = start_span(f"{model.service_model.service_name}.{model.name}")
+
+    def after_call(context, **kwargs):
+        end_span(context.pop('trace_span', None))
+
+    def after_call_error(context, exception, **kwargs):
+        end_span(context.pop('trace_span', None), str(exception))
+
+    events.register('before-call.*.*', before_call)
+    events.register('after-call.*.*', after_call)
+    events.register('after-call-error.*.*', after_call_error)
+
+    return client
@@ -1,8 +1,8 @@
-import boto3
+from . import (
+    utils
+)
 
 
-transcribe_client = boto3.client('transcribe')
-
 def start_transcription_job(bucket: str, object_key: str) -> str:
     '''
     Starts a transcription on on the input_s3_uri, which writes the Transcribe output to output_s3_uri.
@@ -17,7 +17,7 @@ def start_transcription_job(bucket: str, object_key: str) -> str:
     filename, sep, ext = filename_ext.rpartition('.')
 
     # submit job to transcribe
-    response = transcribe_client.start_transcription_job(
+    response = utils.get_client('transcribe').start_transcription_job(
         TranscriptionJobName=f"{job_id}",
         Media={'MediaFileUri': f"s3://{bucket}/{object_key}"},
         MediaFormat='mp4',
@@ -37,7 +37,7 @@ def get_transcript_s3_uri(job_name: str) -> dict:
     '''
 
     try:
-        response = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
+        response = utils.get_client('transcribe').get_transcription_job(TranscriptionJobName=job_name)
         return response['TranscriptionJob']['Transcript']['TranscriptFileUri']
     
     except Exception as e:
@@ -52,7 +52,7 @@ def get_job_status(job_name: str) -> str:
     '''
 
     try:
-        response = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
+        response = utils.get_client('transcribe').get_transcription_job(TranscriptionJobName=job_name)
         status = response['TranscriptionJob']['TranscriptionJobStatus']
         return status
     
@@ -66,7 +66,7 @@ def retrieve_transcript_json(output_s3_uri, job_name):
     Retrieves the JSON transcript from the output_s3_uri and job_name.
     '''
 
-    s3_client = boto3.client('s3')
+    s3_client = utils.get_client('s3')
     bucket_name = output_s3_uri.split('/')[2]
     key = f"{'/'.join(output_s3_uri.split('/')[3:])}/{job_name}.json"
     response = s3_client.get_object(Bucket=bucket_name, Key=key)
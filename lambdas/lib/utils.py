@@ -1,5 +1,34 @@
 import os
 import json
+import threading
+from . import (
+    tracing
+)
+
+
+# boto3 clients shared by all lib modules, created on first use by get_client()
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(service_name: str):
+    '''
+    Returns a boto3 client for the service, creating it on first use.
+    boto3 is imported here rather than at module level to keep the Lambdas' cold start short.
+    Clients are thread-safe and are reused across calls and warm invocations. Each API call is recorded as a tracing span.
+    '''
+
+    client = clients.get(service_name)
+
+    if client is None:
+        with clients_lock:
+            if service_name not in clients:
+                import boto3
+                clients[service_name] = tracing.instrument_client(boto3.client(service_name))
+            client = clients[service_name]
+
+    return client
+
 
 def delete_file(file_path) -> bool:
     """
@@ -1,16 +1,71 @@
 from . import (
+    scheduler,
+    segmentation,
+    tokens,
     transcribe,
+    tracing,
     bedrock
 )
-from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+# "blocks": the model groups and titles the candidate blocks found by lexical segmentation (see segmentation.py),
+# "topics": the model locates the section of each topic in the transcript, then each audio segment is matched to a chapter
+chapter_mode = os.environ.get('CHAPTER_MODE', 'blocks')
+max_block_words = 150   # longer blocks are shown to the model by their beginning and end only
+min_block_words = 40    # blocks are shortened down to this many words to fit the blocks into blocks_budget
+blocks_budget = 20000   # tokens of the blocks in the grouping prompt
+overview_budget = 60000 # tokens of transcript per summary and topics prompt; longer transcripts are summarized in windows
+timestamp_batch_tokens = 400    # tokens of audio segments matched to a chapter concurrently before checking whether it continues
 
 
 def get_summary_and_topics(response: dict) -> str:
     '''
-    Writes a summary of the transcript. Returns a string.
+    Writes a summary of the transcript and lists its key topics. A transcript longer than overview_budget is summarized
+    in windows (see get_overview_windows), and the overviews of the windows are then combined.
+    Returns a dictionary containing {'summary': str, 'topics': list}.
+    '''
+
+    try:
+        windows = get_overview_windows(response)
+
+        if len(windows) == 1:
+            return parse_summary_and_topics(bedrock.invoke_model_text(get_summary_and_topics_prompt(windows[0])))
+
+        print(f"Transcript exceeds the overview budget, summarizing it in {len(windows)} windows")
+        futures = [
+            scheduler.submit(tracing.wrap(bedrock.invoke_model_text, 'overview_window', window=i), get_summary_and_topics_prompt(w), priority=scheduler.CHAPTERIZATION)
+            for i, w in enumerate(windows)
+        ]
+        overviews = [parse_summary_and_topics(r) for r in scheduler.gather(futures)]
+
+        return parse_summary_and_topics(bedrock.invoke_model_text(get_overview_merge_prompt(overviews)))
+    
+    except Exception as e:
+        print(f"ERROR in get_summary_and_topics: {e}")
+        raise e
+
+
+def get_overview_windows(response: dict) -> list:
+    '''
+    Splits the transcript into windows of consecutive audio segments that fit overview_budget (see tokens.pack).
+    Returns a list of transcript texts, which is the whole transcript if it fits.
     '''
 
     transcript_text = transcribe.get_transcript_text(response)
+    segments = transcribe.get_audio_segments(response)
+
+    if tokens.estimate_tokens(transcript_text, bedrock.default_model) <= overview_budget or len(segments) == 0:
+        return [transcript_text]
+
+    windows = tokens.pack(segments, overview_budget, get_text=lambda s: s['transcript'], model_id=bedrock.default_model)
+    return [' '.join([s['transcript'] for s in w]) for w in windows]
+
+
+def get_summary_and_topics_prompt(transcript_text: str) -> str:
+    '''
+    Returns the prompt that asks for the key topics and a summary of the transcript text, or of a window of it.
+    '''
 
     instructions = f"""
     <transcript>
@@ -36,20 +91,44 @@ def get_summary_and_topics(response: dict) -> str:
     </summary>
     """
 
-    try:
-        response = bedrock.invoke_model_text(instructions)
-        summary = bedrock.parse_tags(response, 'summary')[0]
-        topics = parse_topics(response)
+    return instructions
+
+
+def get_overview_merge_prompt(overviews: list) -> str:
+    '''
+    Returns the prompt that combines the key topics and summaries of consecutive transcript windows, given as a list of
+    {'summary': str, 'topics': list}, into those of the whole transcript.
+    '''
+
+    parts = '\n'.join([
+        f"<part>\n" + ''.join([f"<topic>{t}</topic>\n" for t in o['topics']]) + f"<summary>{o['summary']}</summary>\n</part>"
+        for o in overviews
+    ])
+
+    instructions = f"""
+    <parts>
+    {parts}
+    </parts>
+
+    You are given the key topics and summaries of consecutive parts of a long video transcript above in <parts></parts> tags, in the order of the video. Your task is to combine them into the key topics and a summary of the whole video.
+
+    For each topic in the key topics, output the topics as within <topic></topic> tags. You must list the topics in the order in which they appear, merge topics that continue from one part into the next, and include the intro and outro sections. Then, output the summary within <summary></summary> tags. The summary should be at most 250 words.
+    """
+
+    return instructions
+
+
+def parse_summary_and_topics(response: str) -> dict:
+    '''
+    Parses the response to the summary and topics prompt.
+    Returns a dictionary containing {'summary': str, 'topics': list}.
+    '''
+
+    return {
+        'summary': bedrock.parse_tags(response, 'summary')[0],
+        'topics': parse_topics(response),
+    }
 
-        return {
-            'summary': summary,
-            'topics': topics,
-        }
-    
-    except Exception as e:
-        print(f"ERROR in get_summary_and_topics: {e}")
-        raise e
-    
 
 def parse_topics(response: str) -> list:
     '''
@@ -69,7 +148,8 @@ def parse_topics(response: str) -> list:
 
 def get_chapters(transcribe_response: dict, topics: list) -> list:
     '''
-    Extracts the relevant section of the transcript that relates to each topic.
+    Divides the transcript into chapters, one per topic where possible, see chapter_mode.
+    In "blocks" mode, falls back to "topics" mode if the model's grouping of the blocks cannot be used.
     Returns an ordered list of dictionaries containing
     {
         'id': index, 
@@ -81,26 +161,161 @@ def get_chapters(transcribe_response: dict, topics: list) -> list:
     }
     '''
 
-    transcript_text = transcribe.get_transcript_text(transcribe_response)
-    
+    if chapter_mode == 'blocks':
+        try:
+            chapters = get_chapters_from_blocks(transcribe_response, topics)
+            if len(chapters) > 0:
+                return chapters
+
+        except Exception as e:
+            print(f"\nERROR in get_chapters_from_blocks, locating topics instead: {e}")
+
+    return get_chapters_from_topics(transcribe_response, topics)
+
+
+def format_block(block: dict, block_words: int = max_block_words) -> str:
+    '''
+    Formats the candidate block for the grouping prompt, keeping only the beginning and end of blocks longer than block_words.
+    Returns a string.
+    '''
+
+    words = block['transcript'].split()
+
+    if len(words) > block_words:
+        head = block_words * 2 // 3
+        words = words[:head] + ['...'] + words[-(block_words - head):]
+
+    return f"<block id=\"{block['id'] + 1}\">\n{' '.join(words)}\n</block>\n"
+
+
+def get_chapters_from_blocks(transcribe_response: dict, topics: list) -> list:
+    '''
+    Splits the transcript into candidate blocks by lexical segmentation, then asks the model to group consecutive blocks
+    into chapters and title them, in a single call over the (shortened) blocks.
+    Returns a list of chapters in the format of get_chapters(), or an empty list if the transcript has no segments.
+    '''
+
+    with tracing.span('get_candidate_blocks') as attrs:
+        blocks = segmentation.get_blocks(transcribe_response)
+        attrs['blocks'] = len(blocks)
+
+    if len(blocks) == 0:
+        return []
+
+    response = bedrock.invoke_model_text(get_blocks_prompt(blocks, topics))
+    return parse_block_groups(response, blocks)
+
+
+def get_blocks_prompt(blocks: list, topics: list) -> str:
+    '''
+    Returns the prompt that asks the model to group the consecutive candidate blocks into chapters.
+    '''
+
+    # shorten the blocks further while they do not fit the budget
+    block_words = max_block_words
+    blocks_text = ''.join([format_block(b, block_words) for b in blocks])
+
+    while tokens.estimate_tokens(blocks_text, bedrock.default_model) > blocks_budget and block_words > min_block_words:
+        block_words = max(block_words * 3 // 4, min_block_words)
+        blocks_text = ''.join([format_block(b, block_words) for b in blocks])
+
+    topics_text = '\n'.join([f"- {t}" for t in topics])
+
+    instructions = f"""
+    <blocks>
+    {blocks_text}
+    </blocks>
+
+    <topics>
+    {topics_text}
+    </topics>
+
+    You are given a video transcript that was split into numbered, consecutive blocks at likely topic changes within <blocks></blocks> tags, and the key topics of the video within <topics></topics> tags. Your task is to divide the video into chapters by grouping consecutive blocks, so that each chapter covers one topic. Merge blocks that continue the same topic, and use the topic names as chapter titles where they match.
+
+    Every block must belong to exactly one chapter and the chapters must be in the order of the video. Output each chapter within <chapter></chapter> tags, with the chapter title within <title></title> tags and the number of the first block of the chapter within <first></first> tags.
+
+    Below is an example of the expected output format.
+
+    <chapter>
+    <title>
+    First Topic
+    </title>
+    <first>
+    1
+    </first>
+    </chapter>
+    """
+
+    return instructions
+
+
+def parse_block_groups(response: str, blocks: list) -> list:
+    '''
+    Parses the model's grouping of the candidate blocks into chapters.
+    Returns a list of chapters in the format of get_chapters(), or raises a ValueError if the response has no usable chapters.
+    '''
+
+    # each chapter runs from its first block to the block before the next chapter's first block
+    firsts = {}
+    res = response
+
+    while res != "":
+        chapter, res = bedrock.parse_tags(res, 'chapter')
+        title = bedrock.parse_tags(chapter, 'title')[0].strip()
+        first = bedrock.parse_tags(chapter, 'first')[0].strip()
+
+        if title != "" and first.isdigit() and 1 <= int(first) <= len(blocks):
+            firsts.setdefault(int(first) - 1, title)
+
+    if len(firsts) == 0:
+        raise ValueError(f"No chapters in the response: {response[:200]}")
+
+    # the first chapter always starts with the first block
+    starts = sorted(firsts.keys())
+    firsts[0] = firsts.pop(starts[0])
+    starts[0] = 0
+    ends = starts[1:] + [len(blocks)]
+
     chapters = []
-    fanout = 10
+    for start, end in zip(starts, ends):
+        segments = [s for b in blocks[start:end] for s in b['segments']]
+        chapters.append({
+            'id': len(chapters),
+            'title': firsts[start],
+            'transcript': ' '.join([s['transcript'] for s in segments]),
+            'start_time': min([s['start_time'] for s in segments]),
+            'end_time': max([s['end_time'] for s in segments]),
+            'segments': segments,
+        })
 
-    with ThreadPoolExecutor(max_workers=fanout) as pool:
-        for i in range(len(topics)):
-            t = topics[i]
-            pool.submit(mult_split_transcript_by_topic, transcript_text, t, i, chapters)
+    return chapters
 
-    chapters = sorted(chapters, key=lambda x: x["id"])
-    chapters = get_chapter_timestamps(transcribe_response, chapters)
+
+def get_chapters_from_topics(transcribe_response: dict, topics: list) -> list:
+    '''
+    Extracts the relevant section of the transcript that relates to each topic, then finds each chapter's timestamps
+    by matching the audio segments to the chapter.
+    Returns a list of chapters in the format of get_chapters().
+    '''
+
+    transcript_text = transcribe.get_transcript_text(transcribe_response)
+
+    futures = [
+        scheduler.submit(tracing.wrap(mult_split_transcript_by_topic, 'split_transcript_by_topic', chapter=i), transcript_text, t, i, priority=scheduler.CHAPTERIZATION)
+        for i, t in enumerate(topics)
+    ]
+    chapters = scheduler.gather(futures)
+
+    with tracing.span('get_chapter_timestamps'):
+        chapters = get_chapter_timestamps(transcribe_response, chapters)
 
     return chapters
 
 
-def mult_split_transcript_by_topic(transcript_text: str, topic: str, index: int, buffer: list) -> None:
+def mult_split_transcript_by_topic(transcript_text: str, topic: str, index: int) -> dict:
     '''
     Extracts a continous section of the transcript that is related to the topic.
-    Appends the results to the buffer as a dictionary containing
+    Returns a dictionary containing
     {
         'id': index, 
         'title': topic, 
@@ -121,11 +336,11 @@ def mult_split_transcript_by_topic(transcript_text: str, topic: str, index: int,
     response = bedrock.invoke_model_text(instructions)
     section = bedrock.parse_tags(response, 'section')[0]
 
-    buffer.append({
+    return {
         'id': index, 
         'title': topic, 
         'transcript': section
-        })
+        }
 
 
 def get_chapter_timestamps(transcribe_response: dict, chapters: list) -> list:
@@ -134,70 +349,73 @@ def get_chapter_timestamps(transcribe_response: dict, chapters: list) -> list:
     '''
 
     audio_segments = transcribe.get_audio_segments(transcribe_response)
-    fanout = 10
     threshold = .8
 
     for c in chapters:
-        transcript = c['transcript']
-        chapter_segments = []
-
-        while len(audio_segments) > 0:
-            batch_segments = []
-
-            # pop a batch of segments to process
-            with ThreadPoolExecutor(max_workers=fanout) as pool:
-                for i in range(fanout):
-                    if len(audio_segments) <= 0:
+        with tracing.span('chapter', chapter=c['id']):
+            transcript = c['transcript']
+            chapter_segments = []
+
+            while len(audio_segments) > 0:
+                # pop a batch of segments of about timestamp_batch_tokens to process
+                batch = tokens.pack(audio_segments, timestamp_batch_tokens, get_text=lambda s: s['transcript'], model_id=bedrock.default_model)[0]
+                audio_segments = audio_segments[len(batch):]
+                futures = [
+                    scheduler.submit(tracing.wrap(mult_is_in_chapter), transcript, segment, i, priority=scheduler.CHAPTERIZATION)
+                    for i, segment in enumerate(batch)
+                ]
+                batch_segments = scheduler.gather(futures)
+
+                # isolate consecutive False segments at the end of the batch
+                batch_segments.sort(reverse=True)
+                last_true = -1
+
+                for i, s, b in batch_segments:
+                    if b is True:
+                        last_true = i
                         break
 
-                    segment = audio_segments.pop(0)
-                    pool.submit(mult_is_in_chapter, transcript, segment, i, batch_segments)
-
-            # isolate consecutive False segments at the end of the batch
-            batch_segments.sort(reverse=True)
-            last_true = 0
+                # a chapter keeps at least its first segment; otherwise a batch without matches ends the chapter, also
+                # when the batch is a single segment over timestamp_batch_tokens
+                if len(chapter_segments) == 0:
+                    last_true = max(last_true, 0)
 
-            for i, s, b in batch_segments:
-                if b is True:
-                    last_true = i
-                    break
-
-            # get ordered list of segments in and not in chapter
-            batch_segments.sort()
-            in_chapter = batch_segments[:last_true + 1]
-            not_in_chapter = batch_segments[last_true + 1:]
+                # get ordered list of segments in and not in chapter
+                batch_segments.sort()
+                in_chapter = batch_segments[:last_true + 1]
+                not_in_chapter = batch_segments[last_true + 1:]
 
-            # print(f"\nDEBUG in_chapter segments:")
-            # debug = '\n\n- '.join([s['transcript'] for i, s, b in in_chapter])
-            # print(f"- {debug}")
+                # print(f"\nDEBUG in_chapter segments:")
+                # debug = '\n\n- '.join([s['transcript'] for i, s, b in in_chapter])
+                # print(f"- {debug}")
 
-            # save in-chapter segments and put back not-in-chapter segments
-            chapter_segments += [s for i, s, b in in_chapter]
-            audio_segments = [s for i, s, b in not_in_chapter] + audio_segments
+                # save in-chapter segments and put back not-in-chapter segments
+                chapter_segments += [s for i, s, b in in_chapter]
+                audio_segments = [s for i, s, b in not_in_chapter] + audio_segments
 
-            # break if percentage True is below threshold
-            if len(in_chapter) / len(batch_segments) < threshold:
-                break
+                # break if percentage True is below threshold
+                if len(in_chapter) / len(batch_segments) < threshold:
+                    break
 
-        # if last chapter AND audio_segments is not empty, append to last chapter
-        if c['id'] == chapters[-1]['id'] and len(audio_segments) > 0:
-            chapter_segments += audio_segments
+            # if last chapter AND audio_segments is not empty, append to last chapter
+            if c['id'] == chapters[-1]['id'] and len(audio_segments) > 0:
+                chapter_segments += audio_segments
                             
-        # find chapter start and stop timestamps
-        timestamps = [s['start_time'] for s in chapter_segments] + [s['end_time'] for s in chapter_segments]
-        min_timestamp = min(timestamps)
-        max_timestamp = max(timestamps)
-        c['start_time'] = min_timestamp
-        c['end_time'] = max_timestamp
-        c['segments'] = chapter_segments.copy()
+            # find chapter start and stop timestamps
+            timestamps = [s['start_time'] for s in chapter_segments] + [s['end_time'] for s in chapter_segments]
+            min_timestamp = min(timestamps)
+            max_timestamp = max(timestamps)
+            c['start_time'] = min_timestamp
+            c['end_time'] = max_timestamp
+            c['segments'] = chapter_segments.copy()
 
     return chapters
 
 
-def mult_is_in_chapter(chapter_transcript: str, segment: dict, index: int, buffer: list) -> None:
+def mult_is_in_chapter(chapter_transcript: str, segment: dict, index: int) -> tuple:
     '''
     Checks if the segment is present in the chapter transcript.
-    Writes a tuple to the buffer containing (index, segment, is_present_bool).
+    Returns a tuple containing (index, segment, is_present_bool).
     '''
 
     segment_text = segment['transcript']
@@ -218,4 +436,4 @@ def mult_is_in_chapter(chapter_transcript: str, segment: dict, index: int, buffe
     ans = bedrock.parse_tags(response, 'ans')[0]
     is_present = True if "yes" in ans.lower() else False
 
-    buffer.append((index, segment, is_present))
+    return (index, segment, is_present)
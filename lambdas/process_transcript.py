@@ -1,7 +1,9 @@
 from lib import (
+    dedup,
+    manifest,
     s3,
-    vid_proc,
-    enrich_content,
+    scheduler,
+    tracing,
     utils
 )
 import json
@@ -9,20 +11,58 @@ import os
 import uuid
 
 
+@tracing.handler('process_transcript')
 def lambda_handler(event, context):
     '''
     Processes the video transcript to extract chapters and enrich with generated content such as quizzes.
-    Writes the results as chapters.json back to the same S3 prefix.
-    Returns the S3 URI to the chapters.json file.
+    Writes the results as chapters.json back to the same S3 prefix. In fan-out mode, the chapters are enqueued for
+    enrichment instead and chapters.json is written by the enrich chapter Lambda.
+    In batch mode, the prompts of each stage are pooled with those of other jobs and submitted as batch inference jobs
+    instead, and the jobs are resumed with their next stage when a batch's output file is written (see batch.py).
+    Scheduled invocations mark the jobs of failed batch inference jobs failed and flush the batch mode record pool.
+    Returns the S3 URI to the chapters.json file, the number of enqueued chapters in fan-out mode, the pooled stage in
+    batch mode, or the stages of the resumed jobs for a batch output file.
     '''
 
+    bucket = ""
+    folder_key = ""
+
+    # tasks that cannot finish before the Lambda times out are cancelled, leaving time to record the failure
+    scheduler.set_deadline(context)
+
     try:
+        # scheduled invocations check the submitted batch inference jobs for failures and flush the pool of batch mode
+        # records, e.g. records that wait for a full batch
+        if 'Records' not in event:
+            from lib import batch
+            with tracing.span('batch_tick'):
+                result = batch.tick(os.environ['UPLOADS_BUCKET'])
+
+            return {
+                    'statusCode': 200,
+                    'body': json.dumps(result)
+                }
+
         # parse s3 bucket and object key for video file
         record = event['Records'][0]
         message_body = json.loads(record['body'])
         bucket = message_body['detail']['bucket']['name']
         object_key = message_body['detail']['object']['key']
 
+        # the output file of a batch inference job resumes its jobs with their next stage. The processing modules are
+        # imported where they are used to keep the cold start short
+        if object_key[-len('.jsonl.out'):] == '.jsonl.out':
+            from lib import batch
+
+            if batch.parse_output_key(object_key) != "":
+                with tracing.span('batch_resume'):
+                    jobs = batch.resume(bucket, object_key)
+
+                return {
+                        'statusCode': 200,
+                        'body': json.dumps({'jobs': jobs})
+                    }
+
         # check the filename
         if object_key.lower()[-len('transcript.json'):] != 'transcript.json':
             print(f"File is not transcript.json")
@@ -30,7 +70,22 @@ def lambda_handler(event, context):
                 'statusCode': 404,
                 'body': 'File is not transcript.json'
             }
+
+        # skip if the outputs already exist, e.g. when they were copied from a duplicate video
+        folder_key, sep, filename_ext = object_key.rpartition('/')
+        if s3.object_exists(bucket, f"{folder_key}/chapters.json"):
+            print(f"Outputs already exist for {folder_key}")
+
+            # a redelivery retries completing the duplicates, in case that failed after the outputs were written
+            dedup.release_followers(bucket, folder_key)
+
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'s3_uri': f"s3://{bucket}/{folder_key}/chapters.json"})
+            }
         
+        manifest.update_job(bucket, folder_key, status='processing', stage='start', transcript_s3_key=object_key)
+
         # create a temporary subfolder with a unique ID within Lambda's tmp folder
         temp_folder = f"/tmp/{uuid.uuid4()}/"
 
@@ -45,34 +100,59 @@ def lambda_handler(event, context):
         else:
             raise ValueError()
 
+        # in batch mode, the stages are processed by batch inference jobs instead of on-demand calls
+        from lib import batch
+        if batch.is_requested(bucket, folder_key):
+            with tracing.span('batch_start'):
+                stage = batch.start(bucket, folder_key, object_key, transcript)
+
+            print(f"\nTranscript pooled for batch processing, stage '{stage}'")
+            return {
+                    'statusCode': 202,
+                    'body': json.dumps({'stage': stage})
+                }
+
         # get summary, topics, and chapters
+        from lib import enrich_content, vid_proc
         print(f"\nGetting summary and key topics")
-        summary_topics = vid_proc.get_summary_and_topics(transcript)
+        with tracing.span('get_summary_and_topics'):
+            summary_topics = vid_proc.get_summary_and_topics(transcript)
         topics = summary_topics['topics']
-        chapters = vid_proc.get_chapters(transcript, topics)
+        manifest.update_job(bucket, folder_key, stage='get_summary_and_topics')
+        with tracing.span('get_chapters', topics=len(topics)):
+            chapters = vid_proc.get_chapters(transcript, topics)
+        manifest.update_job(bucket, folder_key, stage='get_chapters')
+
+        # in fan-out mode, each chapter is enriched by a separate invocation of the enrich chapter Lambda,
+        # and the worker that completes the last chapter writes the outputs
+        from lib import fanout
+        if fanout.is_enabled():
+            with tracing.span('fanout', chapters=len(chapters)):
+                fanout.start(bucket, folder_key, summary_topics, chapters)
+            manifest.update_job(bucket, folder_key, stage='enrich_chapters')
+
+            print(f"\nTranscript chapterized, enriching {len(chapters)} chapters in fan-out mode")
+            return {
+                    'statusCode': 202,
+                    'body': json.dumps({'chapters': len(chapters), 'queue_url': fanout.queue_url})
+                }
 
         # enrich chapters with generated content
         print(f"\nEnriching chapters with generated content, e.g. quizzes, summaries, etc")
-        chapters = enrich_content.get_chapter_mcq(chapters)
-        chapters = enrich_content.get_chapter_summaries(chapters)
-
-        # write summary and topics to s3 as overview.json
-        overview_filepath = f"{temp_folder}overview.json"
-        with open(overview_filepath, "w", encoding="utf-8") as f:
-            json.dump(summary_topics, f)
-        folder_key, sep, filename_ext = object_key.rpartition('/')
-        s3_key = s3.upload_file(overview_filepath, bucket, f"{folder_key}")
+        with tracing.span('get_chapter_mcq', chapters=len(chapters)):
+            chapters = enrich_content.get_chapter_mcq(chapters)
+        manifest.update_job(bucket, folder_key, stage='get_chapter_mcq')
+        with tracing.span('get_chapter_summaries', chapters=len(chapters)):
+            chapters = enrich_content.get_chapter_summaries(chapters)
+        manifest.update_job(bucket, folder_key, stage='get_chapter_summaries')
 
-        # write chapters and enriched content (e.g. quizzes) to s3 as chapters.json
-        chapters_filepath = f"{temp_folder}chapters.json"
-        with open(chapters_filepath, "w", encoding="utf-8") as f:
-            json.dump(chapters, f)
-        folder_key, sep, filename_ext = object_key.rpartition('/')
-        s3_key = s3.upload_file(chapters_filepath, bucket, f"{folder_key}")
+        if enrich_content.quiz_explanations:
+            with tracing.span('get_quiz_explanations', chapters=len(chapters)):
+                chapters = enrich_content.get_quiz_explanations(chapters)
 
-        # delete temp files
-        utils.delete_file(overview_filepath)
-        utils.delete_file(chapters_filepath)
+        # write overview.json, chapters.json, the retrieval index and the context pack
+        from lib import outputs
+        s3_key = outputs.write_outputs(bucket, folder_key, summary_topics, chapters)
 
         print(f"\nTranscript processing complete. Results written to s3://{bucket}/{s3_key}")
         return {
@@ -82,6 +162,10 @@ def lambda_handler(event, context):
 
     except Exception as e:
         print(f"\nERROR in lambda_handler: {e}")
+
+        if folder_key != "":
+            manifest.update_job(bucket, folder_key, status='failed', error=str(e))
+
         return {
                 'statusCode': 500,
                 'body': json.dumps({'ERROR': str(e)})
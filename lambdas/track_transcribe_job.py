@@ -0,0 +1,49 @@
+from lib import (
+    job_tracker,
+    manifest,
+    tracing
+)
+import json
+import os
+
+
+@tracing.handler('track_transcribe_job')
+def lambda_handler(event, context):
+    '''
+    Consumes Transcribe job state-change events (delivered by EventBridge through SQS) and records the new job
+    statuses in the job-state table in the uploads bucket. All records in the batch are applied with a single write.
+    Scheduled invocations (without SQS records) reconcile the in-flight jobs of the table with Transcribe instead.
+    Failed transcriptions are also marked as failed in the job manifest.
+    Returns the number of jobs updated.
+    '''
+
+    try:
+        bucket = os.environ['UPLOADS_BUCKET']
+
+        if 'Records' in event:
+            state_changes = [json.loads(record['body']) for record in event['Records']]
+            table = job_tracker.apply_state_change_events(bucket, state_changes)
+            changes = [job_tracker.parse_state_change_event(e) for e in state_changes]
+        else:
+            table, changes = job_tracker.reconcile(bucket)
+
+        job_names = [name for name, status in changes if name is not None]
+        print(f"Updated job statuses for {job_names}")
+
+        for name, status in changes:
+            media_key = table['jobs'].get(name, [0, 0, ""])[job_tracker.MEDIA_KEY]
+            if status == 'FAILED' and media_key != "":
+                folder_key, sep, filename_ext = media_key.rpartition('/')
+                manifest.update_job(bucket, folder_key, status='failed', stage='transcribe')
+
+        return {
+                'statusCode': 200,
+                'body': json.dumps({'updated': len(job_names)})
+            }
+
+    except Exception as e:
+        print(f"\nERROR in lambda_handler: {e}")
+        return {
+                'statusCode': 500,
+                'body': json.dumps({'ERROR': str(e)})
+            }
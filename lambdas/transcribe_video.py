@@ -1,4 +1,11 @@
-import boto3
+from lib import (
+    dedup,
+    job_tracker,
+    manifest,
+    s3,
+    tracing,
+    utils
+)
 import uuid
 import json
 
@@ -11,7 +18,7 @@ def start_transcription_job(bucket: str, object_key: str) -> str:
     '''
 
     # submit job to transcribe --> write the transcript to the source location
-    transcribe_client = boto3.client('transcribe')
+    transcribe_client = utils.get_client('transcribe')
     folder_key, sep, filename_ext = object_key.rpartition('/')
 
     response = transcribe_client.start_transcription_job(
@@ -27,11 +34,14 @@ def start_transcription_job(bucket: str, object_key: str) -> str:
     return response['TranscriptionJob']['TranscriptionJobName']
 
 
+@tracing.handler('transcribe_video')
 def lambda_handler(event, context):
     '''
     Starts a Transcribe job. The input video must be .mp4.
     The results will be written as a JSON file in the same S3 location as the input file.
-    Returns the job name.
+    If the same video content was processed before, the existing transcript and outputs are copied instead. If that job
+    is still in flight, the video is linked to it and receives its outputs once it completes (see dedup.add_follower).
+    Returns the job name, or the prefix of the job the outputs were copied from or linked to.
     '''
 
     try:
@@ -49,9 +59,56 @@ def lambda_handler(event, context):
                 'body': 'File is not in mp4 format.'
             }
 
+        # skip if the transcript already exists, e.g. for a redelivered event
+        folder_key, sep, filename_ext = object_key.rpartition('/')
+        if s3.object_exists(bucket, f"{folder_key}/transcript.json"):
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'job_prefix': folder_key})
+            }
+
+        # reuse the transcript and outputs of a prior job with the same video content
+        content_hash = s3.get_content_hash(bucket, object_key)
+        prior_job = dedup.find_prior_job(bucket, content_hash)
+
+        if prior_job is not None and prior_job['job_prefix'] != folder_key:
+            prior_prefix = prior_job['job_prefix']
+            prior_status = manifest.get_job(bucket, prior_prefix).get('status')
+
+            # the prior job is still in flight: link to it instead of processing the same media again
+            if prior_status not in [None, 'failed'] and not s3.object_exists(bucket, f"{prior_prefix}/chapters.json"):
+                dedup.add_follower(bucket, prior_prefix, folder_key, object_key)
+                manifest.update_job(bucket, folder_key, status='processing', stage='deduplicated', video_s3_key=object_key, deduplicated_from=prior_prefix)
+
+                # the prior job may have completed before the link was written, in which case nothing releases it
+                if s3.object_exists(bucket, f"{prior_prefix}/chapters.json"):
+                    dedup.release_followers(bucket, prior_prefix)
+
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({'deduplicated_from': prior_prefix})
+                }
+
+            # otherwise reuse what the prior job produced, e.g. only its transcript if its processing failed
+            if len(dedup.complete_duplicate(bucket, prior_prefix, folder_key, object_key)) > 0:
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({'deduplicated_from': prior_prefix})
+                }
+
         # start transcribe job with uuid as job_id
         job_name = start_transcription_job(bucket, object_key)
 
+        # record the content hash, replacing the entry of a prior job, which is only reached if it failed without a transcript
+        dedup.register_job(bucket, content_hash, folder_key, object_key, replace=prior_job is not None)
+        manifest.update_job(bucket, folder_key, status='transcribing', stage='transcribe', video_s3_key=object_key, transcription_job=job_name)
+
+        # record the job in the job-state table so its status can be tracked without polling
+        try:
+            job_tracker.register_job(bucket, job_name, object_key)
+        except Exception as e:
+            print(f"\nERROR registering job {job_name} in the job-state table: {e}")
+
         # return job name
         return {
                 'statusCode': 200,
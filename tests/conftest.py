@@ -0,0 +1,27 @@
+import os
+import pytest
+import sys
+
+
+# the Lambda handlers import their modules as "lib", relative to the lambdas folder; the fakes are in benchmarks
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'lambdas'))
+sys.path.insert(0, root)
+
+
+@pytest.fixture
+def aws():
+    '''
+    Routes the boto3 clients of the lib modules to the fake clients of the benchmarks for the duration of a test.
+    '''
+
+    from benchmarks import fakes
+    from lib import utils
+
+    fake_aws = fakes.FakeAWS()
+    utils.clients.clear()
+
+    with fakes.installed(fake_aws):
+        yield fake_aws
+
+    utils.clients.clear()
@@ -0,0 +1,70 @@
+from lib import answer_cache
+from collections import OrderedDict
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(answer_cache, 'jobs', OrderedDict())
+    monkeypatch.setattr(answer_cache, 'stats', {k: 0 for k in answer_cache.stats})
+
+
+def test_exact_and_near_duplicate_questions_hit():
+    answer_cache.store("job", "v1", "What is gradient descent?", "An optimization method.")
+
+    assert answer_cache.lookup("job", "v1", "what is gradient descent") == "An optimization method."
+    assert answer_cache.lookup("job", "v1", "What is gradient descent, exactly?") == "An optimization method."
+    assert answer_cache.lookup("job", "v1", "How are convolution kernels trained?") is None
+
+    stats = answer_cache.get_stats()
+    assert (stats['exact_hits'], stats['near_hits'], stats['lookups']) == (1, 1, 3)
+
+
+def test_similarity_estimates_jaccard():
+    a = answer_cache.get_signature(answer_cache.normalize("Explain the chain rule"))
+
+    assert answer_cache.get_similarity(a, a) == 1.0
+    assert answer_cache.get_similarity(a, answer_cache.get_signature("unrelated words here")) < answer_cache.threshold
+
+
+def test_questions_with_different_numbers_do_not_share_answers():
+    answer_cache.store("job", "v1", "Can you explain the answer to the 2nd quiz question?", "Because of B.")
+
+    assert answer_cache.get_numbers(answer_cache.normalize("the 3rd quiz question")) == ['3rd']
+    assert answer_cache.lookup("job", "v1", "Can you explain the answer to the 3rd quiz question?") is None
+    assert answer_cache.lookup("job", "v1", "Can you explain the answer to the 2nd quiz question") == "Because of B."
+
+
+def test_new_version_clears_the_job():
+    answer_cache.store("job", "v1", "What is a tensor?", "An array.")
+
+    assert answer_cache.lookup("job", "v2", "What is a tensor?") is None
+    assert answer_cache.get_stats()['invalidations'] == 1
+
+
+def test_least_recently_used_answers_and_jobs_are_evicted(monkeypatch):
+    monkeypatch.setattr(answer_cache, 'max_entries_per_job', 2)
+    monkeypatch.setattr(answer_cache, 'max_jobs', 2)
+
+    answer_cache.store("job-a", "v1", "first question about pooling", "1")
+    answer_cache.store("job-a", "v1", "second question about dropout", "2")
+    answer_cache.lookup("job-a", "v1", "first question about pooling")
+    answer_cache.store("job-a", "v1", "third question about attention", "3")
+
+    assert list(answer_cache.jobs["job-a"]['entries'].keys()) == ["first question about pooling", "third question about attention"]
+
+    answer_cache.store("job-b", "v1", "a question", "b")
+    answer_cache.lookup("job-a", "v1", "a question")
+    answer_cache.store("job-c", "v1", "a question", "c")
+
+    assert list(answer_cache.jobs.keys()) == ["job-a", "job-c"]
+    assert answer_cache.get_stats()['entries'] == 3
+    assert answer_cache.get_stats()['evictions'] == 2
+
+
+def test_replay_stream_rebuilds_the_answer(monkeypatch):
+    monkeypatch.setattr(answer_cache, 'stream_delay', 0)
+    events = list(answer_cache.replay_stream("one two three four five six"))
+
+    assert ''.join([e['contentBlockDelta']['delta']['text'] for e in events[:-1]]) == "one two three four five six"
+    assert events[-1] == {'messageStop': {'stopReason': 'end_turn'}}
@@ -0,0 +1,93 @@
+from lib import artifact_cache
+import json
+import os
+import pytest
+
+
+bucket = "test-bucket"
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(artifact_cache, 'cache_dir', f"{tmp_path}/cache/")
+    monkeypatch.setattr(artifact_cache, 'entries', {})
+    monkeypatch.setattr(artifact_cache, 'parsed_json', {})
+    monkeypatch.setattr(artifact_cache, 'key_locks', {})
+    return artifact_cache
+
+
+def put_json(aws, key: str, data) -> None:
+    aws.s3.put(bucket, key, json.dumps(data).encode('utf-8'))
+
+
+def count_gets(aws) -> int:
+    return aws.log.to_dict()['operations'].get('s3.get_object', 0)
+
+
+def test_fetch_revalidates_with_a_conditional_get(aws, cache, monkeypatch):
+    put_json(aws, "job/chapters.json", [1])
+
+    path = cache.fetch(bucket, "job/chapters.json")
+    assert cache.fetch(bucket, "job/chapters.json") == path
+    assert count_gets(aws) == 1
+
+    # once the revalidation window passed, an unchanged object is answered with 304 and not downloaded again
+    monkeypatch.setattr(artifact_cache, 'revalidate_after', 0)
+    mtime = os.stat(path).st_mtime_ns
+    assert cache.fetch_json(bucket, "job/chapters.json") == [1]
+    assert count_gets(aws) == 2 and os.stat(path).st_mtime_ns == mtime
+
+    put_json(aws, "job/chapters.json", [1, 2])
+    assert cache.fetch_json(bucket, "job/chapters.json") == [1, 2]
+    assert len([k for k in cache.parsed_json if k[:2] == (bucket, "job/chapters.json")]) == 1
+
+
+def test_parsed_json_is_shared(aws, cache):
+    put_json(aws, "job/overview.json", {'summary': "s"})
+
+    assert cache.fetch_json(bucket, "job/overview.json") is cache.fetch_json(bucket, "job/overview.json")
+    assert cache.fetch_json_many(bucket, ["job/overview.json", "job/overview.json"]) == [{'summary': "s"}] * 2
+
+
+def test_least_recently_used_objects_are_evicted(aws, cache, monkeypatch):
+    monkeypatch.setattr(artifact_cache, 'max_cache_bytes', 250)
+    for i in range(3):
+        aws.s3.put(bucket, f"job/file-{i}", b"x" * 100)
+
+    paths = [cache.fetch(bucket, f"job/file-{i}") for i in range(3)]
+
+    assert sorted([k for b, k in cache.entries]) == ["job/file-1", "job/file-2"]
+    assert not os.path.isfile(paths[0]) and os.path.isfile(paths[2])
+
+
+def test_objects_in_use_are_not_evicted(aws, cache, monkeypatch):
+    monkeypatch.setattr(artifact_cache, 'max_cache_bytes', 150)
+    aws.s3.put(bucket, "job/in-use", b"x" * 100)
+    aws.s3.put(bucket, "job/new", b"y" * 100)
+    path = cache.fetch(bucket, "job/in-use")
+
+    # another session holds the object's key lock while it reads the file
+    with cache.get_key_lock((bucket, "job/in-use")):
+        cache.fetch(bucket, "job/new")
+        assert os.path.isfile(path)
+
+    assert len(cache.entries) == 2
+
+
+def test_index_survives_a_restart(aws, cache, monkeypatch):
+    put_json(aws, "job/chapters.json", [1])
+    path = cache.fetch(bucket, "job/chapters.json")
+
+    monkeypatch.setattr(artifact_cache, 'entries', {})
+    cache.load_index()
+
+    assert cache.entries[(bucket, "job/chapters.json")]['path'] == path
+    assert cache.fetch_json(bucket, "job/chapters.json") == [1]
+    assert count_gets(aws) == 2
+
+
+def test_missing_object_raises(aws, cache):
+    with pytest.raises(Exception):
+        cache.fetch(bucket, "job/missing.json")
+
+    assert cache.entries == {}
@@ -0,0 +1,103 @@
+import backlog
+import time
+
+
+def write_manifest(tmp_path, rows: list) -> str:
+    path = f"{tmp_path}/recordings.csv"
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(["source,module"] + rows) + '\n')
+    return path
+
+
+def make_args(max_transcribe_jobs: int = 2, max_tokens_per_minute: int = 0):
+    return backlog.parse_args(['--bucket', "b", '--manifest', "m.csv", '--max-transcribe-jobs', str(max_transcribe_jobs),
+                               '--max-tokens-per-minute', str(max_tokens_per_minute)])
+
+
+def make_video(status: str, job_prefix: str = "", **times) -> dict:
+    return {'source': f"/videos/{job_prefix or status}.mp4", 'module': "m", 'status': status, 'job_prefix': job_prefix,
+            'video_key': "", 'times': dict(times), 'error': ""}
+
+
+def test_load_backlog_skips_repeated_sources(tmp_path):
+    path = write_manifest(tmp_path, ["/videos/intro.mp4,", "s3://archive/week 1/lecture.mp4,Week 1", "", "/videos/intro.mp4,Other module"])
+
+    assert backlog.load_backlog(path) == [
+        {'source': "/videos/intro.mp4", 'module': "intro"},
+        {'source': "s3://archive/week 1/lecture.mp4", 'module': "Week 1"},
+    ]
+
+
+def test_load_state_resumes_a_previous_run(tmp_path):
+    path = write_manifest(tmp_path, ["/videos/a.mp4,", "/videos/b.mp4,", "/videos/c.mp4,"])
+    state_path = f"{tmp_path}/state.json"
+    state = backlog.load_state(state_path, backlog.load_backlog(path))
+
+    assert [v['status'] for v in state['videos']] == ['pending'] * 3
+
+    state['videos'][0].update({'status': 'complete', 'job_prefix': "a-uuid-1"})
+    state['videos'][1].update({'status': 'failed', 'job_prefix': "b-uuid-1", 'error': "Not complete"})
+    backlog.save_state(state_path, state)
+
+    resumed = backlog.load_state(state_path, backlog.load_backlog(path))
+    assert [(v['status'], v['job_prefix']) for v in resumed['videos']] == [('complete', "a-uuid-1"), ('failed', "b-uuid-1"), ('pending', "")]
+
+    retried = backlog.load_state(state_path, backlog.load_backlog(path), retry_failed=True)
+    assert [(v['status'], v['job_prefix'], v['error']) for v in retried['videos']][1] == ('pending', "", "")
+
+
+def test_refresh_videos_records_status_times():
+    now = time.time()
+    videos = [make_video('uploaded', "a", uploaded=now - 100), make_video('pending'), make_video('uploaded', "old", uploaded=now - backlog.job_timeout - 1)]
+    entries = {'a': {'status': 'processing', 'updated': now - 50}}
+
+    backlog.refresh_videos(videos, entries)
+
+    assert videos[0]['status'] == 'processing' and videos[0]['times']['processing'] == now - 50
+    assert videos[1]['status'] == 'pending'
+    assert videos[2]['status'] == 'failed' and videos[2]['error'] != ""
+
+    # a status already seen keeps its first time
+    entries['a']['updated'] = now
+    backlog.refresh_videos(videos, entries)
+    assert videos[0]['times']['processing'] == now - 50
+
+
+def test_admission_under_the_transcribe_limit():
+    videos = [make_video('uploading'), make_video('pending')]
+
+    assert backlog.get_admission(videos, 0, 0, make_args(max_transcribe_jobs=2)) == ""
+    assert backlog.get_admission(videos, 1, 0, make_args(max_transcribe_jobs=2)) == 'transcribe'
+
+
+def test_admission_under_the_token_limit():
+    videos = [make_video('processing'), make_video('processing'), make_video('transcribing'), make_video('pending')]
+    args = make_args(max_transcribe_jobs=10, max_tokens_per_minute=1000)
+
+    # two processing videos use 600 tokens/min, and the transcribing one is expected to add another 300
+    assert backlog.get_admission(videos, 1, 600, args) == ""
+    assert backlog.get_admission(videos, 1, 700, args) == 'tokens'
+    assert backlog.get_admission(videos, 1, 700, make_args(max_transcribe_jobs=10)) == ""
+
+
+def test_timings_of_missing_stages_are_none():
+    complete = make_video('complete', uploading=0, uploaded=10, processing=70, complete=100)
+    deduplicated = make_video('complete', uploading=0, uploaded=10, complete=12)
+
+    assert backlog.get_timings(complete) == {'upload_s': 10, 'transcribe_s': 60, 'process_s': 30, 'total_s': 100}
+    assert backlog.get_timings(deduplicated) == {'upload_s': 10, 'transcribe_s': None, 'process_s': None, 'total_s': 12}
+    assert backlog.get_timings(make_video('pending')) == {'upload_s': None, 'transcribe_s': None, 'process_s': None, 'total_s': None}
+
+
+def test_report_skips_missing_timings(tmp_path, capsys):
+    videos = [make_video('complete', "a", uploading=0, uploaded=10, complete=70), make_video('failed', "b")]
+    videos[1]['error'] = "Upload failed"
+    report_path = f"{tmp_path}/timings.csv"
+
+    backlog.write_report(report_path, videos)
+
+    assert "Completed 1 videos" in capsys.readouterr().out
+    with open(report_path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "source,job_prefix,status,upload_s,transcribe_s,process_s,total_s,error"
+    assert len(lines) == 3
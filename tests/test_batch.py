@@ -0,0 +1,186 @@
+from benchmarks import synthetic
+from lib import batch, manifest, s3, vid_proc
+import json
+import pytest
+import time
+
+
+bucket = "test-bucket"
+
+
+class FakeBatchJobs:
+    '''
+    Stand-in for the Bedrock control-plane client: records the created batch inference jobs and reports their status.
+    '''
+
+    def __init__(self):
+        self.jobs = {}
+        self.status = {}
+
+    def create_model_invocation_job(self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig, **kwargs):
+        job_arn = f"arn:aws:bedrock:us-east-1:123456789012:model-invocation-job/{jobName}"
+        self.jobs[job_arn] = (inputDataConfig['s3InputDataConfig']['s3Uri'], outputDataConfig['s3OutputDataConfig']['s3Uri'])
+        self.status[job_arn] = 'InProgress'
+        return {'jobArn': job_arn}
+
+    def get_model_invocation_job(self, jobIdentifier):
+        return {'status': self.status[jobIdentifier], 'message': "Job timed out"}
+
+
+@pytest.fixture
+def jobs(aws, monkeypatch):
+    fake_jobs = FakeBatchJobs()
+    aws.clients['bedrock'] = fake_jobs
+    monkeypatch.setattr(batch, 'executor', 'bedrock')
+    monkeypatch.setattr(batch, 'min_records', 3)
+    monkeypatch.setattr(batch, 'max_wait', 0)
+    return fake_jobs
+
+
+def start_job(aws, folder_key: str, seed: int) -> str:
+    transcript = synthetic.make_transcript('small', seed)
+    aws.s3.put(bucket, f"{folder_key}/transcript.json", json.dumps(transcript).encode('utf-8'))
+    return batch.start(bucket, folder_key, f"{folder_key}/transcript.json", transcript)
+
+
+def run_job(job_arn: str, jobs: FakeBatchJobs) -> str:
+    '''
+    Completes a created batch inference job by running its records on the fake model.
+    Returns the S3 key of its output file.
+    '''
+
+    input_uri, output_uri = jobs.jobs[job_arn]
+    jobs.status[job_arn] = 'Completed'
+    input_key = input_uri.split(f"{bucket}/", 1)[1]
+    return batch.run_local_job(bucket, input_key, output_uri.split(f"{bucket}/", 1)[1], "test")
+
+
+def pending_keys() -> list:
+    return s3.list_bucket(bucket, f"{batch.batch_folder}/pending/")
+
+
+def test_records_are_pooled_until_min_records(aws, jobs):
+    assert start_job(aws, "job-0", 0) == 'overview'
+    assert start_job(aws, "job-1", 1) == 'overview'
+
+    assert len(pending_keys()) == 2
+    assert jobs.jobs == {}
+
+    start_job(aws, "job-2", 2)
+
+    # the third job fills the pool: one batch with the first stage of all three jobs
+    assert pending_keys() == []
+    assert len(jobs.jobs) == 1
+    records_key = [k for k in s3.list_bucket(bucket, f"{batch.batch_folder}/jobs/") if k.endswith('records.json')][0]
+    records = s3.read_json(bucket, records_key)[0]
+    assert sorted([r[0] for r in records.values()]) == ["job-0", "job-1", "job-2"]
+    assert all([len(record_id) == 11 for record_id in records.keys()])
+
+
+def test_output_is_split_back_to_jobs_and_completes_them(aws, jobs):
+    folder_keys = [f"job-{i}" for i in range(3)]
+    for i, folder_key in enumerate(folder_keys):
+        start_job(aws, folder_key, i)
+
+    processed = set()
+    for round in range(len(batch.stages)):
+        for job_arn in [j for j in jobs.jobs.keys() if j not in processed]:
+            processed.add(job_arn)
+            results = batch.resume(bucket, run_job(job_arn, jobs))
+            assert sorted(results.keys()) == folder_keys
+
+    assert all([s3.object_exists(bucket, f"{k}/chapters.json") for k in folder_keys])
+    assert all([manifest.read_manifest(bucket)[k]['status'] == 'complete' for k in folder_keys])
+    assert s3.read_json(bucket, batch.get_inflight_key())[0] == {}
+
+
+def test_redelivered_output_is_skipped(aws, jobs):
+    for i in range(3):
+        start_job(aws, f"job-{i}", i)
+
+    output_key = run_job(list(jobs.jobs.keys())[0], jobs)
+    first = batch.resume(bucket, output_key)
+    second = batch.resume(bucket, output_key)
+
+    assert set(first.values()) == {'chapters'}
+    assert set(second.values()) == {""}
+    assert len(jobs.jobs) == 2
+
+
+def test_advance_retried_after_pooling_records_the_stage(aws, jobs, monkeypatch):
+    monkeypatch.setattr(batch, 'min_records', 1000)
+    start_job(aws, "job-0", 0)
+    state, etag = s3.read_json(bucket, batch.get_state_key("job-0"))
+    responses = {'overview-0': "<summary>Summary</summary><topics>\nGradient descent\n</topics>"}
+
+    # the first attempt pools the next stage, then fails before it records the stage
+    write_json = s3.write_json
+    def fail_state_write(bucket_name, key, data, etag=None, create_only=False):
+        if key == batch.get_state_key("job-0"):
+            raise RuntimeError("Injected failure writing the state")
+        return write_json(bucket_name, key, data, etag, create_only)
+
+    monkeypatch.setattr(s3, 'write_json', fail_state_write)
+    with pytest.raises(RuntimeError):
+        batch.resume_job(bucket, "job-0", state['run'], 'overview', responses)
+    monkeypatch.setattr(s3, 'write_json', write_json)
+
+    # the retry does not pool the stage a second time, and records it
+    assert batch.resume_job(bucket, "job-0", state['run'], 'overview', responses) == 'chapters'
+    assert s3.read_json(bucket, batch.get_state_key("job-0"))[0]['stage'] == 'chapters'
+    assert len([k for k in pending_keys() if k.endswith('-chapters.json')]) == 1
+
+
+def test_failed_batch_marks_waiting_jobs_failed(aws, jobs):
+    for i in range(3):
+        start_job(aws, f"job-{i}", i)
+
+    job_arn = list(jobs.jobs.keys())[0]
+    assert batch.tick(bucket) == {'submitted': 0, 'failed': []}
+
+    jobs.status[job_arn] = 'Expired'
+    result = batch.tick(bucket)
+
+    assert len(result['failed']) == 1
+    entries = manifest.read_manifest(bucket)
+    assert all([entries[f"job-{i}"]['status'] == 'failed' for i in range(3)])
+    assert "expired" in entries["job-0"]['error']
+    assert s3.read_json(bucket, batch.get_inflight_key())[0] == {}
+
+
+def test_waiting_records_run_on_demand_after_max_wait(aws, jobs, monkeypatch):
+    start_job(aws, "job-0", 0)
+    assert jobs.jobs == {}
+
+    monkeypatch.setattr(batch, 'max_wait', 1)
+    monkeypatch.setattr(time, 'time', lambda now=time.time(): now + 10)
+
+    assert batch.tick(bucket)['submitted'] == 1
+    assert pending_keys() == []
+    assert jobs.jobs == {}
+    assert manifest.read_manifest(bucket)["job-0"]['stage'] == 'batch_overview_on_demand'
+
+
+def test_lock_is_exclusive_until_the_lease_expires(aws, monkeypatch):
+    first = batch.acquire_lock(bucket)
+    assert first != ""
+    assert batch.acquire_lock(bucket) == ""
+
+    monkeypatch.setattr(batch, 'flush_lease', -1)
+    second = batch.acquire_lock(bucket)
+    assert second not in ["", first]
+
+    # the first holder's late release must not remove the lock that was taken over
+    assert not batch.release_lock(bucket, first)
+    assert s3.read_json(bucket, batch.get_lock_key())[1] == second
+    assert batch.release_lock(bucket, second)
+    assert not s3.object_exists(bucket, batch.get_lock_key())
+
+
+def test_topics_chapter_mode_is_rejected(aws, jobs, monkeypatch):
+    monkeypatch.setattr(vid_proc, 'chapter_mode', 'topics')
+
+    with pytest.raises(ValueError, match="topics"):
+        start_job(aws, "job-0", 0)
+
+    assert pending_keys() == []
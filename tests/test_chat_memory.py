@@ -0,0 +1,109 @@
+from lib import bedrock, chat_memory
+import pytest
+
+
+pinned = [
+    {'role': 'user', 'content': "<chapters>Chapter 1: Gradients</chapters>"},
+    {'role': 'assistant', 'content': "Understood."},
+]
+
+
+def add_turns(memory: dict, turns: int, words: int = 5) -> None:
+    for i in range(turns):
+        chat_memory.add_message(memory, 'user', f"Question {i} " + "about gradients " * words)
+        chat_memory.add_message(memory, 'assistant', f"Answer {i} " + "gradients point uphill " * words)
+
+
+def get_texts(messages: list) -> list:
+    return [m['content'][0]['text'] for m in messages]
+
+
+def wait_for_summary(memory: dict) -> None:
+    memory['pending'][0].result(timeout=10)
+
+
+def test_messages_start_with_the_pinned_context():
+    memory = chat_memory.new_memory(pinned)
+    add_turns(memory, 1)
+    chat_memory.add_message(memory, 'user', "What is a gradient?")
+
+    texts = get_texts(chat_memory.get_messages(memory, latest_text="<context>...</context> What is a gradient?"))
+
+    assert texts[:2] == [m['content'] for m in pinned]
+    assert texts[-1] == "<context>...</context> What is a gradient?"
+    assert memory['messages'][-1]['content'] == "What is a gradient?"
+    assert memory['stats'][-1]['turn'] == 2 and memory['stats'][-1]['verbatim_messages'] == 3
+
+
+def test_oldest_turns_are_dropped_to_fit_the_budget(monkeypatch):
+    monkeypatch.setattr(chat_memory, 'token_budget', 200)
+    memory = chat_memory.new_memory(pinned)
+    add_turns(memory, 6, words=10)
+    chat_memory.add_message(memory, 'user', "Latest question " + "word " * 400)
+
+    texts = get_texts(chat_memory.get_messages(memory))
+
+    # the pinned context and the latest turn are kept even if they exceed the budget on their own
+    assert texts[:2] == [m['content'] for m in pinned]
+    assert texts[-1].startswith("Latest question")
+    assert len(texts) < 2 + len(memory['messages'])
+
+
+def test_older_turns_are_folded_into_a_summary(aws):
+    memory = chat_memory.new_memory(pinned)
+    add_turns(memory, chat_memory.keep_turns + chat_memory.fold_turns - 1)
+    chat_memory.compact(memory)
+
+    assert memory['pending'] is None
+
+    add_turns(memory, 1)
+    chat_memory.compact(memory)
+    wait_for_summary(memory)
+
+    texts = get_texts(chat_memory.get_messages(memory))
+
+    assert memory['summary'] == f"The student asked {chat_memory.fold_turns} more questions."
+    assert memory['summarized_turns'] == chat_memory.fold_turns
+    assert len(memory['messages']) == 2 * chat_memory.keep_turns
+    assert memory['summary'] in texts[2]
+    assert aws.log.to_dict()['bedrock_calls_by_stage'] == {'summarize_conversation': 1}
+
+
+def test_failed_summary_is_retried(aws, monkeypatch):
+    invoke_model_text = bedrock.invoke_model_text
+    state = {'failed': False}
+
+    def failing_invoke_model_text(prompt, *args, **kwargs):
+        if not state['failed']:
+            state['failed'] = True
+            raise RuntimeError("Injected summary failure")
+        return invoke_model_text(prompt, *args, **kwargs)
+
+    monkeypatch.setattr(bedrock, 'invoke_model_text', failing_invoke_model_text)
+    memory = chat_memory.new_memory(pinned)
+    add_turns(memory, chat_memory.keep_turns + chat_memory.fold_turns)
+
+    chat_memory.compact(memory)
+    with pytest.raises(RuntimeError):
+        wait_for_summary(memory)
+    chat_memory.apply_summary(memory)
+
+    assert memory['summary'] == "" and len(memory['messages']) == 2 * (chat_memory.keep_turns + chat_memory.fold_turns)
+
+    chat_memory.compact(memory)
+    wait_for_summary(memory)
+    chat_memory.apply_summary(memory)
+
+    assert memory['summarized_turns'] == chat_memory.fold_turns
+
+
+def test_record_usage_updates_the_latest_turn():
+    memory = chat_memory.new_memory(pinned)
+    chat_memory.record_usage(memory, {'inputTokens': 1})
+    assert memory['stats'] == []
+
+    chat_memory.add_message(memory, 'user', "What is a gradient?")
+    chat_memory.get_messages(memory)
+    chat_memory.record_usage(memory, {'inputTokens': 120, 'outputTokens': 30})
+
+    assert memory['stats'][-1]['input_tokens'] == 120 and memory['stats'][-1]['output_tokens'] == 30
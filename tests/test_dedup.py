@@ -0,0 +1,111 @@
+from lib import dedup, manifest, outputs, s3, search_index
+import json
+
+
+bucket = "test-bucket"
+original = "course-a/lecture-1"
+duplicate = "course-b/lecture-1"
+content_hash = "sha256:abc123"
+
+
+def make_chapters() -> list:
+    return [
+        {'id': i, 'title': f"Chapter {i}", 'start_time': 60.0 * i, 'end_time': 60.0 * (i + 1),
+         'transcript': f"Chapter {i} explains backpropagation through convolutional layers.", 'summary': f"Summary of chapter {i}.",
+         'quiz': []}
+        for i in range(2)
+    ]
+
+
+def upload_video(aws, job_prefix: str) -> dict:
+    '''
+    Uploads a video with the shared content hash and returns the event the transcribe video Lambda receives.
+    '''
+
+    video_key = f"{job_prefix}/vid-lecture.mp4"
+    aws.s3.put(bucket, video_key, b"video", metadata={'sha256': content_hash[len('sha256:'):]})
+    return {'Records': [{'body': json.dumps({'detail': {'bucket': {'name': bucket}, 'object': {'key': video_key}}})}]}
+
+
+def start_original(aws) -> None:
+    '''
+    Records the original as in flight: registered in the hash index and transcribing, without any outputs yet.
+    '''
+
+    upload_video(aws, original)
+    dedup.register_job(bucket, content_hash, original, f"{original}/vid-lecture.mp4")
+    manifest.update_job(bucket, original, status='transcribing', stage='transcribe')
+
+
+def finish_original() -> None:
+    s3.write_json(bucket, f"{original}/transcript.json", {'results': {}})
+    outputs.write_outputs(bucket, original, {'summary': "s", 'topics': ["t"]}, make_chapters())
+
+
+def test_duplicate_of_in_flight_job_waits_for_it(aws):
+    import transcribe_video
+
+    start_original(aws)
+    response = transcribe_video.lambda_handler(upload_video(aws, duplicate), None)
+
+    assert response['statusCode'] == 202
+    assert 'transcribe.start_transcription_job' not in aws.log.to_dict()['operations']
+    assert dedup.find_prior_job(bucket, content_hash)['job_prefix'] == original
+    assert manifest.get_job(bucket, duplicate)['status'] == 'processing'
+
+    finish_original()
+
+    assert s3.read_json(bucket, f"{duplicate}/chapters.json")[0] == make_chapters()
+    assert manifest.get_job(bucket, duplicate)['status'] == 'complete'
+    assert not s3.object_exists(bucket, f"{original}/{dedup.followers_filename}")
+
+
+def test_duplicate_linked_after_original_completed_is_released(aws):
+    start_original(aws)
+    finish_original()
+
+    # the link is written after the original released its followers, as in a race with write_outputs
+    dedup.add_follower(bucket, original, duplicate, f"{duplicate}/vid-lecture.mp4")
+
+    assert dedup.release_followers(bucket, original) == [duplicate]
+    assert manifest.get_job(bucket, duplicate)['status'] == 'complete'
+    assert dedup.release_followers(bucket, original) == []
+
+
+def test_copied_job_is_searchable(aws):
+    import transcribe_video
+
+    start_original(aws)
+    finish_original()
+    response = transcribe_video.lambda_handler(upload_video(aws, duplicate), None)
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['deduplicated_from'] == original
+    assert set([r['job_id'] for r in search_index.search(bucket, "backpropagation")]) == set([original, duplicate])
+
+
+def test_failed_original_fails_followers_and_is_replaced(aws):
+    import transcribe_video
+
+    start_original(aws)
+    transcribe_video.lambda_handler(upload_video(aws, duplicate), None)
+
+    manifest.update_job(bucket, original, status='failed', stage='transcribe')
+
+    assert manifest.get_job(bucket, duplicate)['status'] == 'failed'
+
+    # a new upload of the same media no longer waits for the failed job and takes over its hash index entry
+    third = "course-c/lecture-1"
+    response = transcribe_video.lambda_handler(upload_video(aws, third), None)
+
+    assert 'job_name' in json.loads(response['body'])
+    assert dedup.find_prior_job(bucket, content_hash)['job_prefix'] == third
+
+
+def test_job_artifacts_exclude_uploads_and_state():
+    assert dedup.is_job_artifact(f"{original}/chapters.json", original)
+    assert dedup.is_job_artifact(f"{original}/transcript.json", original)
+    assert not dedup.is_job_artifact(f"{original}/vid-lecture.mp4", original)
+    assert not dedup.is_job_artifact(f"{original}/kb/notes.pdf", original)
+    assert not dedup.is_job_artifact(f"{original}/_enrichment/0.json", original)
+    assert not dedup.is_job_artifact(f"{original}/{dedup.followers_filename}", original)
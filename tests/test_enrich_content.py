@@ -0,0 +1,80 @@
+from lib import enrich_content
+import pytest
+
+
+def make_question(level: str, answer: str = "B", choices: list = None) -> dict:
+    return {
+        'level': level,
+        'question': f"Question for {level}?",
+        'choices': choices if choices is not None else ["A", "B", "C", "D"],
+        'answer': answer,
+    }
+
+
+@pytest.mark.parametrize('level_text, expected', [
+    ("Remember", "Remember (Knowledge)"),
+    ("understand", "Understand (Comprehension)"),
+    ("2) Understand (Comprehension)", "Understand (Comprehension)"),
+    ("Knowledge", "Remember (Knowledge)"),
+    ("Synthesis", "Create (Synthesis)"),
+    ("Evaluate (not remember)", "Evaluate"),
+    ("Analyze: breaking down information", "Analyze"),
+    ("Using learned materials in new and concrete situations.", "Apply"),
+    ("making judgments or decisions based on criteria and standards", "Evaluate"),
+    ("", ""),
+    ("Memorize", ""),
+])
+def test_get_bloom_level(level_text, expected):
+    assert enrich_content.get_bloom_level(level_text) == expected
+
+
+def test_validate_quiz_complete():
+    quiz = [make_question(lvl) for lvl, description in enrich_content.bloom_levels]
+
+    valid, missing = enrich_content.validate_quiz(quiz)
+
+    assert [qn['level'] for qn in valid] == [lvl for lvl, description in enrich_content.bloom_levels]
+    assert missing == []
+
+
+def test_validate_quiz_normalizes_level_and_answer():
+    valid, missing = enrich_content.validate_quiz([make_question("3) apply", answer=" b ")])
+
+    assert valid[0]['level'] == "Apply"
+    assert valid[0]['answer'] == "B"
+    assert "Apply" not in missing
+
+
+@pytest.mark.parametrize('question', [
+    make_question("Apply", answer="E"),
+    make_question("Apply", choices=["A", "B", "C"]),
+    make_question("Apply", choices=["A", "B", "B", "D"]),
+    {**make_question("Apply"), 'question': ""},
+    make_question("Recall"),
+])
+def test_validate_quiz_rejects_invalid_questions(question):
+    valid, missing = enrich_content.validate_quiz([question])
+
+    assert valid == []
+    assert len(missing) == len(enrich_content.bloom_levels)
+
+
+def test_validate_quiz_keeps_first_valid_question_per_level():
+    first = make_question("Analyze", answer="A")
+    valid, missing = enrich_content.validate_quiz([make_question("Analyze", answer="X"), first, make_question("Analyze", answer="C")])
+
+    assert valid == [{**first, 'level': "Analyze"}]
+    assert "Analyze" not in missing
+
+
+def test_get_chapter_summaries_raises_failed_summary(monkeypatch):
+    def fail(prompt, *args, **kwargs):
+        raise RuntimeError("model call failed")
+
+    monkeypatch.setattr(enrich_content.bedrock, 'invoke_model_text', fail)
+    chapters = [{'id': 0, 'title': "Intro", 'transcript': "Some text."}]
+
+    with pytest.raises(RuntimeError, match="model call failed"):
+        enrich_content.get_chapter_summaries(chapters)
+
+    assert 'summary' not in chapters[0]
@@ -0,0 +1,79 @@
+from lib import job_tracker
+import datetime
+
+
+bucket = "test-bucket"
+
+
+def add_transcribe_job(aws, name: str, status: str, minutes_ago: int) -> None:
+    created = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=minutes_ago)
+    aws.transcribe.jobs[name] = {
+        'TranscriptionJobName': name,
+        'TranscriptionJobStatus': status,
+        'LanguageCode': 'en-US',
+        'CreationTime': created,
+        'StartTime': created,
+        'CompletionTime': created,
+    }
+
+
+def calls(aws, operation: str) -> int:
+    return aws.log.to_dict()['operations'].get(f"transcribe.{operation}", 0)
+
+
+def test_events_do_not_move_a_job_back(aws):
+    job_tracker.apply_state_change_events(bucket, [
+        {'source': 'aws.transcribe', 'detail-type': 'Transcribe Job State Change', 'detail': {'TranscriptionJobName': "job-1", 'TranscriptionJobStatus': 'COMPLETED'}},
+    ])
+    table = job_tracker.register_job(bucket, "job-1", "course/vid-lecture.mp4")
+
+    assert job_tracker.get_status(table, "job-1") == 'COMPLETED'
+    assert table['jobs']["job-1"][job_tracker.MEDIA_KEY] == "course/vid-lecture.mp4"
+
+
+def test_reconcile_applies_missed_state_changes(aws):
+    for name in ["job-1", "job-2", "job-3"]:
+        job_tracker.register_job(bucket, name, f"{name}/vid-lecture.mp4")
+    add_transcribe_job(aws, "job-1", 'IN_PROGRESS', 5)
+    add_transcribe_job(aws, "job-2", 'COMPLETED', 5)
+    add_transcribe_job(aws, "job-3", 'FAILED', 5)
+
+    table, changes = job_tracker.reconcile(bucket)
+
+    assert sorted(changes) == [("job-1", 'IN_PROGRESS'), ("job-2", 'COMPLETED'), ("job-3", 'FAILED')]
+    assert job_tracker.load_table(bucket) == table
+
+
+def test_refresh_caps_paging_of_finished_history(aws):
+    # a long COMPLETED history, and a pending job that failed long ago and is not in the listed pages
+    for i in range(1000):
+        add_transcribe_job(aws, f"done-{i}", 'COMPLETED', i)
+    add_transcribe_job(aws, "job-old", 'FAILED', 5000)
+    for i in range(300):
+        add_transcribe_job(aws, f"failed-{i}", 'FAILED', i)
+    table = job_tracker.set_status(job_tracker.new_table(), "job-old", 'IN_PROGRESS')
+
+    job_tracker.refresh_statuses(table)
+
+    assert job_tracker.get_status(table, "job-old") == 'FAILED'
+    assert calls(aws, 'list_transcription_jobs') <= len(job_tracker.in_flight_statuses) + 2 * job_tracker.max_list_pages
+    assert calls(aws, 'get_transcription_job') == 1
+
+
+def test_refresh_marks_unknown_job_failed(aws):
+    table = job_tracker.set_status(job_tracker.new_table(), "job-deleted", 'QUEUED')
+
+    job_tracker.refresh_statuses(table)
+
+    assert job_tracker.get_status(table, "job-deleted") == 'FAILED'
+
+
+def test_prune_keeps_in_flight_and_recent_jobs():
+    table = job_tracker.new_table()
+    job_tracker.set_status(table, "old-done", 'COMPLETED')
+    job_tracker.set_status(table, "old-queued", 'QUEUED')
+    job_tracker.set_status(table, "new-done", 'COMPLETED')
+    for name in ["old-done", "old-queued"]:
+        table['jobs'][name][job_tracker.UPDATED] -= job_tracker.max_finished_age + 1
+
+    assert sorted(job_tracker.prune(table)['jobs'].keys()) == ["new-done", "old-queued"]
@@ -0,0 +1,115 @@
+from lib import manifest, s3
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+
+bucket = "test-bucket"
+
+
+def put_legacy_jobs(aws) -> None:
+    '''
+    Writes jobs as they were before the manifest existed: one complete, one transcribed, and one only uploaded.
+    '''
+
+    for key in ["old-complete/vid-a.mp4", "old-complete/transcript.json", "old-complete/chapters.json", "old-complete/kb/notes.pdf",
+                "old-processing/vid-b.mp4", "old-processing/transcript.json",
+                "old-uploaded/vid-c.mp4",
+                "_search/catalog.json"]:
+        aws.s3.put(bucket, key, b"{}")
+
+
+def count(aws, operation: str) -> int:
+    return aws.log.to_dict()['operations'].get(f"s3.{operation}", 0)
+
+
+def test_read_jobs_backfills_the_manifest_once(aws):
+    put_legacy_jobs(aws)
+    manifest.update_job(bucket, "new-job", status='transcribing', stage='transcribe')
+
+    jobs = manifest.read_jobs(bucket)
+
+    assert sorted(jobs.keys()) == ["new-job", "old-complete", "old-processing", "old-uploaded"]
+    assert jobs['old-complete']['status'] == 'complete'
+    assert jobs['old-complete']['chapters_s3_key'] == "old-complete/chapters.json"
+    assert jobs['old-complete']['video_s3_key'] == "old-complete/vid-a.mp4"
+    assert jobs['old-processing']['status'] == 'processing'
+    assert jobs['old-uploaded']['status'] == 'uploaded'
+    assert jobs['new-job']['status'] == 'transcribing'
+    assert s3.object_exists(bucket, manifest.backfilled_key)
+
+    # later reads do not list the bucket again
+    listings = count(aws, 'list_objects_v2')
+    manifest.read_jobs(bucket)
+    assert count(aws, 'list_objects_v2') == listings
+
+
+def test_backfill_keeps_existing_entries(aws):
+    put_legacy_jobs(aws)
+    manifest.update_job(bucket, "old-processing", status='failed', stage='process')
+
+    jobs = manifest.rebuild_manifest(bucket)
+
+    assert jobs['old-processing']['status'] == 'failed'
+    assert jobs['old-complete']['status'] == 'complete'
+
+
+def test_update_job_records_status_and_artifacts(aws):
+    manifest.update_job(bucket, "job", status='processing', stage='start', transcript_s3_key="job/transcript.json")
+    entry = manifest.update_job(bucket, "job", stage='chapters')
+
+    assert entry['status'] == 'processing' and entry['stage'] == 'chapters'
+    assert entry['transcript_s3_key'] == "job/transcript.json"
+    assert manifest.get_job(bucket, "job") == entry
+    assert manifest.get_job(bucket, "other-job") == {}
+
+    with pytest.raises(ValueError):
+        manifest.update_job(bucket, "job", status='done')
+
+
+def test_update_json_retries_on_a_conflicting_write(aws):
+    key = "_manifest/shard-00.json"
+    s3.write_json(bucket, key, {'jobs': {}})
+    calls = {'n': 0}
+
+    def add_job(shard):
+        # another writer changes the object between this read and write, once
+        calls['n'] += 1
+        if calls['n'] == 1:
+            s3.write_json(bucket, key, {'jobs': {'other': {'status': 'uploaded'}}})
+        shard['jobs']['mine'] = {'status': 'uploaded'}
+        return shard
+
+    data = s3.update_json(bucket, key, add_job)
+
+    assert calls['n'] == 2
+    assert sorted(data['jobs'].keys()) == ["mine", "other"]
+    assert s3.read_json(bucket, key)[0] == data
+
+
+def test_update_json_gives_up_after_retries(aws):
+    key = "_manifest/shard-00.json"
+    s3.write_json(bucket, key, {'jobs': {}})
+    calls = {'n': 0}
+
+    def always_conflicting(shard):
+        calls['n'] += 1
+        s3.write_json(bucket, key, {'jobs': {}, 'writes': calls['n']})
+        return {'jobs': {'mine': {}}}
+
+    with pytest.raises(Exception) as e:
+        s3.update_json(bucket, key, always_conflicting, retries=2)
+
+    assert s3.is_error(e.value, 'PreconditionFailed', 'ConditionalRequestConflict')
+    assert calls['n'] == 3
+
+
+def test_concurrent_updates_of_one_shard(aws):
+    job_ids = [f"job-{i}" for i in range(100)]
+    shard_key = manifest.get_shard_key(job_ids[0])
+    same_shard = [j for j in job_ids if manifest.get_shard_key(j) == shard_key]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda j: manifest.update_job(bucket, j, status='uploaded'), same_shard))
+
+    assert sorted(s3.read_json(bucket, shard_key)[0]['jobs'].keys()) == sorted(same_shard)
+    assert len(manifest.read_manifest(bucket)) == len(same_shard)
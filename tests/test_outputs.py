@@ -0,0 +1,73 @@
+from benchmarks import synthetic
+from lib import manifest, outputs, s3
+import json
+import pytest
+
+
+bucket = "test-bucket"
+folder_key = "course-lecture-1"
+
+
+def make_chapters() -> list:
+    return [
+        {'id': i, 'title': f"Chapter {i}", 'start_time': 60.0 * i, 'end_time': 60.0 * (i + 1),
+         'transcript': f"Chapter {i} explains gradient descent and learning rates in detail.", 'summary': f"Summary of chapter {i}.",
+         'quiz': []}
+        for i in range(3)
+    ]
+
+
+def fail_once(aws, key: str):
+    '''
+    Makes the next put_object of the key fail, as if S3 returned an error.
+    '''
+
+    put_object = aws.s3.put_object
+    state = {'failed': False}
+
+    def failing_put_object(Bucket, Key, **kwargs):
+        if Key == key and not state['failed']:
+            state['failed'] = True
+            raise RuntimeError(f"Injected failure writing {Key}")
+        return put_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    aws.s3.put_object = failing_put_object
+
+
+@pytest.mark.parametrize('failing_key', [
+    f"{folder_key}/retrieval_index.json",
+    f"{folder_key}/context_pack.json",
+    f"{folder_key}/overview.json",
+])
+def test_write_outputs_retry_finishes_job(aws, failing_key):
+    chapters = make_chapters()
+    fail_once(aws, failing_key)
+
+    with pytest.raises(RuntimeError):
+        outputs.write_outputs(bucket, folder_key, {'summary': "s", 'topics': ["t"]}, chapters)
+
+    # the job is not treated as finished, so a redelivered message processes it again
+    assert not s3.object_exists(bucket, f"{folder_key}/chapters.json")
+
+    outputs.write_outputs(bucket, folder_key, {'summary': "s", 'topics': ["t"]}, chapters)
+
+    assert s3.read_json(bucket, f"{folder_key}/chapters.json")[0] == chapters
+    assert s3.object_exists(bucket, f"{folder_key}/retrieval_index.json")
+    assert s3.object_exists(bucket, f"{folder_key}/context_pack.json")
+    assert manifest.read_manifest(bucket)[folder_key]['status'] == 'complete'
+
+
+def test_redelivered_transcript_event_finishes_job(aws):
+    import process_transcript
+
+    aws.s3.put(bucket, f"{folder_key}/transcript.json", json.dumps(synthetic.make_transcript('small', 0)).encode('utf-8'))
+    event = {'Records': [{'body': json.dumps({'detail': {'bucket': {'name': bucket}, 'object': {'key': f"{folder_key}/transcript.json"}}})}]}
+    fail_once(aws, f"{folder_key}/context_pack.json")
+
+    assert process_transcript.lambda_handler(event, None)['statusCode'] == 500
+    assert manifest.read_manifest(bucket)[folder_key]['status'] == 'failed'
+
+    # the redelivered message is not skipped as already processed
+    assert process_transcript.lambda_handler(event, None)['statusCode'] == 200
+    assert s3.object_exists(bucket, f"{folder_key}/context_pack.json")
+    assert manifest.read_manifest(bucket)[folder_key]['status'] == 'complete'
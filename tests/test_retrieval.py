@@ -0,0 +1,87 @@
+from lib import retrieval
+import json
+import pytest
+
+
+def make_chapters() -> list:
+    segments = [
+        {'id': i, 'start_time': 10 * i, 'end_time': 10 * (i + 1), 'transcript': f"part {i} " + "backpropagation computes gradients layer by layer " * 5}
+        for i in range(12)
+    ]
+    return [
+        {'id': 0, 'title': "Backpropagation", 'start_time': 0, 'transcript': ' '.join([s['transcript'] for s in segments]),
+         'segments': segments, 'summary': "How gradients flow backwards through a network.",
+         'quiz': [{'question': "What does backpropagation compute?", 'choices': ["Gradients", "Labels", "Batches", "Images"],
+                   'answer': "Gradients", 'explanation': "It applies the chain rule."}]},
+        {'id': 1, 'title': "Regularization", 'start_time': 120, 'transcript': "Dropout randomly disables neurons to reduce overfitting. " * 10,
+         'summary': "Dropout and weight decay.", 'quiz': []},
+    ]
+
+
+def test_text_chunks_overlap():
+    words = [f"w{i}" for i in range(300)]
+    chunks = retrieval.get_text_chunks(' '.join(words))
+
+    assert [len(c.split()) for c in chunks] == [150, 150, 60]
+    assert chunks[1].split()[:retrieval.overlap_words] == chunks[0].split()[-retrieval.overlap_words:]
+    assert retrieval.get_text_chunks("short text") == ["short text"]
+
+
+def test_transcript_chunks_keep_segments_whole():
+    chapter = make_chapters()[0]
+    chunks = retrieval.get_transcript_chunks(chapter)
+
+    assert len(chunks) > 1
+    assert all([c['start_time'] % 10 == 0 for c in chunks])
+    assert chunks[0]['start_time'] == 0 and chunks[1]['start_time'] > 0
+    assert all([c['text'].startswith("part ") for c in chunks])
+
+    # without audio segments, the chunks start at the chapter's start
+    assert set([c['start_time'] for c in retrieval.get_transcript_chunks(make_chapters()[1])]) == set([120])
+
+
+def test_get_chunks_covers_transcripts_summaries_and_quizzes():
+    chunks = retrieval.get_chunks(make_chapters())
+    kinds = [(c['chapter_id'], c['kind']) for c in chunks]
+
+    assert kinds.count((0, 'summary')) == 1 and kinds.count((0, 'quiz')) == 1 and kinds.count((1, 'quiz')) == 0
+    assert len(set([c['id'] for c in chunks])) == len(chunks)
+    assert "Explanation: It applies the chain rule." in [c for c in chunks if c['kind'] == 'quiz'][0]['text']
+
+
+def test_search_ranks_relevant_chunks():
+    index = retrieval.build_index(retrieval.get_chunks(make_chapters()))
+
+    results = retrieval.search(index, "How does dropout reduce overfitting?", k=3)
+    assert results[0]['chapter_id'] == 1
+    assert results == sorted(results, key=lambda r: -r['score'])
+
+    # the chapter title is indexed along with the text
+    assert retrieval.search(index, "regularization", k=10)[0]['chapter_id'] == 1
+    assert retrieval.search(index, "what is it about", k=3) == []
+
+
+def test_index_survives_json_round_trip():
+    index = retrieval.build_index(retrieval.get_chunks(make_chapters()))
+    stored = json.loads(json.dumps(index))
+
+    assert retrieval.search(stored, "chain rule gradients") == retrieval.search(index, "chain rule gradients")
+
+
+def test_add_and_remove_sources_match_a_rebuilt_index():
+    chapter_chunks = retrieval.get_chunks(make_chapters())
+    document_chunks = [
+        {'id': f"doc-{i}", 'source': "kb/notes.pdf", 'chapter_id': -1, 'title': "Notes", 'kind': 'document', 'start_time': 0, 'text': t}
+        for i, t in enumerate(["Weight decay penalizes large weights.", "Batch normalization rescales activations."])
+    ]
+
+    index = retrieval.add_chunks(retrieval.build_index(chapter_chunks), document_chunks)
+    assert index == retrieval.build_index(chapter_chunks + document_chunks)
+    assert retrieval.search(index, "batch normalization")[0]['source'] == "kb/notes.pdf"
+
+    retrieval.remove_source(index, "kb/notes.pdf")
+    assert index == retrieval.build_index(chapter_chunks)
+
+    retrieval.remove_source(index, 'chapters')
+    assert index['df'] == {} and index['avg_length'] == 0
+    assert retrieval.search(index, "gradients") == []
@@ -0,0 +1,100 @@
+from lib import s3
+import io
+import pytest
+import threading
+
+
+bucket = "test-bucket"
+
+
+class TrickleReader:
+    '''
+    Reads a bytes payload in small chunks, like a pipe from a downloader. Optionally fails after fail_after bytes.
+    '''
+
+    def __init__(self, data: bytes, chunk_size: int, fail_after: int = None):
+        self.stream = io.BytesIO(data)
+        self.chunk_size = chunk_size
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self, size: int) -> bytes:
+        if self.fail_after is not None and self.stream.tell() >= self.fail_after:
+            raise IOError("Stream interrupted")
+        self.reads += 1
+        return self.stream.read(min(size, self.chunk_size))
+
+
+def test_upload_stream_assembles_parts_from_small_reads(aws):
+    data = bytes(range(256)) * 1000
+    reader = TrickleReader(data, chunk_size=97)
+
+    s3.upload_stream(reader.read, bucket, "video.mp4", part_size=64 * 1024)
+
+    assert aws.s3.get(bucket, "video.mp4", 'GetObject')['data'] == data
+    assert aws.log.to_dict()['operations']['s3.upload_part'] == 4
+
+
+def test_upload_stream_resumes_and_skips_uploaded_parts(aws):
+    data = bytes(range(256)) * 1000
+    resume = {}
+
+    with pytest.raises(IOError):
+        s3.upload_stream(TrickleReader(data, 4096, fail_after=150 * 1024).read, bucket, "video.mp4", resume=resume, part_size=64 * 1024, max_concurrency=1)
+
+    assert resume['upload_id'] != ""
+    uploaded_parts = aws.log.to_dict()['operations']['s3.upload_part']
+
+    s3.upload_stream(TrickleReader(data, 4096).read, bucket, "video.mp4", resume=resume, part_size=64 * 1024)
+
+    assert aws.s3.get(bucket, "video.mp4", 'GetObject')['data'] == data
+    assert aws.log.to_dict()['operations']['s3.upload_part'] == uploaded_parts + 4 - 2
+
+
+def test_upload_stream_empty_stream(aws):
+    s3.upload_stream(io.BytesIO(b"").read, bucket, "empty.bin")
+
+    assert aws.s3.get(bucket, "empty.bin", 'GetObject')['data'] == b""
+
+
+class FakeTransfer:
+    '''
+    Transfer future whose progress is reported by several threads, like the parts of a multipart transfer.
+    '''
+
+    def __init__(self, subscribers: list, parts: int, part_bytes: int):
+        def report():
+            for i in range(1000):
+                for s in subscribers:
+                    s.on_progress(future=self, bytes_transferred=part_bytes)
+
+        self.threads = [threading.Thread(target=report) for i in range(parts)]
+        for t in self.threads:
+            t.start()
+
+    def result(self):
+        for t in self.threads:
+            t.join()
+
+
+def test_run_transfers_counts_progress_from_concurrent_parts():
+    progress = []
+
+    reports = s3.run_transfers(
+        [lambda subscribers: FakeTransfer(subscribers, parts=8, part_bytes=3) for i in range(2)],
+        ["a.mp4", "b.mp4"],
+        callback=lambda name, n: progress.append(n),
+    )
+
+    assert [r['bytes'] for r in reports] == [8 * 1000 * 3, 8 * 1000 * 3]
+    assert sum(progress) == 2 * 8 * 1000 * 3
+    assert all([r['error'] == "" for r in reports])
+
+
+def test_run_transfers_reports_submit_errors():
+    def fail(subscribers):
+        raise ValueError("No such file")
+
+    reports = s3.run_transfers([fail], ["missing.mp4"])
+
+    assert reports[0]['error'] == "No such file"
@@ -0,0 +1,119 @@
+from lib import scheduler
+import pytest
+import threading
+import time
+
+
+class FakeContext:
+    def __init__(self, remaining_ms: int):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_ms
+
+
+@pytest.fixture
+def blocked_workers():
+    '''
+    Occupies every worker thread with a task that waits for its own release event, so that tasks submitted by the test
+    stay queued until the test releases a worker. Yields the list of release events.
+    '''
+
+    scheduler.start()
+    started = [threading.Event() for w in scheduler.workers]
+    releases = [threading.Event() for w in scheduler.workers]
+
+    def block(i):
+        started[i].set()
+        releases[i].wait(10)
+
+    for i in range(len(scheduler.workers)):
+        scheduler.submit(block, i, priority=-1)
+    for e in started:
+        assert e.wait(5)
+
+    yield releases
+
+    for e in releases:
+        e.set()
+    scheduler.set_deadline(None)
+
+
+def test_tasks_run_by_priority_then_submission(blocked_workers):
+    order = []
+    futures = [
+        scheduler.submit(order.append, 'optional', priority=scheduler.OPTIONAL),
+        scheduler.submit(order.append, 'enrichment-1', priority=scheduler.ENRICHMENT),
+        scheduler.submit(order.append, 'chapterization', priority=scheduler.CHAPTERIZATION),
+        scheduler.submit(order.append, 'enrichment-2', priority=scheduler.ENRICHMENT),
+    ]
+
+    # a single free worker runs the queued tasks one at a time
+    blocked_workers[0].set()
+    scheduler.gather(futures)
+
+    assert order == ['chapterization', 'enrichment-1', 'enrichment-2', 'optional']
+
+
+def test_deadline_raises_timeout_and_cancels_pending(blocked_workers):
+    scheduler.set_deadline(FakeContext(200), margin=0)
+    futures = [scheduler.submit(time.sleep, 0) for i in range(3)]
+
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        scheduler.gather(futures)
+
+    assert time.time() - start < 2
+    assert all([f.cancelled() for f in futures])
+
+
+def test_set_deadline_uses_remaining_time_minus_margin():
+    scheduler.set_deadline(FakeContext(60000), margin=30)
+    assert abs(scheduler.deadline['time'] - (time.time() + 30)) < 1
+
+    scheduler.set_deadline(None)
+    assert scheduler.deadline['time'] is None
+
+
+def test_task_that_cannot_finish_before_deadline_expires(blocked_workers):
+    scheduler.durations[scheduler.OPTIONAL] = 60.0
+    scheduler.set_deadline(FakeContext(5000), margin=0)
+    ran = []
+
+    try:
+        future = scheduler.submit(ran.append, 1, priority=scheduler.OPTIONAL)
+        blocked_workers[0].set()
+
+        with pytest.raises(TimeoutError):
+            scheduler.gather([future])
+
+        assert ran == []
+
+    finally:
+        del scheduler.durations[scheduler.OPTIONAL]
+
+
+def test_gather_raises_task_exception_and_cancels_queued(blocked_workers):
+    def fail():
+        raise ValueError("task failed")
+
+    # the freed worker runs the failing task, then blocks again, so the other tasks stay queued
+    release = threading.Event()
+    failing = scheduler.submit(fail, priority=scheduler.CHAPTERIZATION)
+    scheduler.submit(release.wait, 10, priority=scheduler.CHAPTERIZATION)
+    queued = [scheduler.submit(time.sleep, 0, priority=scheduler.OPTIONAL) for i in range(3)]
+    blocked_workers[0].set()
+
+    try:
+        with pytest.raises(ValueError, match="task failed"):
+            scheduler.gather([failing] + queued)
+
+        assert all([f.cancelled() for f in queued])
+
+    finally:
+        release.set()
+
+
+def test_gather_returns_results_in_order():
+    futures = [scheduler.submit(lambda x: x * x, i) for i in range(20)]
+    assert scheduler.gather(futures) == [i * i for i in range(20)]
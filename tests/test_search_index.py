@@ -0,0 +1,139 @@
+from lib import manifest, s3, search_index
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+
+bucket = "test-bucket"
+
+
+def make_chapters(words: str, chapters: int = 2) -> list:
+    return [
+        {'id': i, 'title': f"Chapter {i}", 'start_time': 60.0 * i, 'end_time': 60.0 * (i + 1),
+         'transcript': f"This chapter covers {words} in detail.", 'summary': "", 'quiz': []}
+        for i in range(chapters)
+    ]
+
+
+def get_catalog() -> dict:
+    return s3.read_json(bucket, search_index.catalog_key)[0]
+
+
+@pytest.fixture
+def merge_factor(monkeypatch):
+    monkeypatch.setattr(search_index, 'merge_factor', 2)
+    return 2
+
+
+def test_index_job_writes_segment_with_chunk_ids(aws):
+    assert search_index.index_job(bucket, "job-a", make_chapters("gradient descent")) == 2
+
+    catalog = get_catalog()
+    segment_id, chunks, length = catalog['jobs']['job-a']
+    segment = catalog['segments'][segment_id]
+
+    assert segment['width'] == search_index.posting_width and segment['jobs'] == ["job-a"]
+    assert s3.read_json(bucket, search_index.get_titles_key(segment_id))[0] == {'job-a': {'0': "Chapter 0", '1': "Chapter 1"}}
+
+    term = "gradient"
+    postings = s3.read_json(bucket, search_index.get_shard_key(segment_id, search_index.get_term_shard(term)))[0]['postings'][term]['job-a']
+    assert postings[::search_index.posting_width] == [0, 1]
+
+
+def test_chunks_with_the_same_start_time_are_scored_separately(aws):
+    # without audio segments, all transcript chunks of a chapter start at the chapter's start time
+    filler = " ".join(["lecture"] * 200)
+    chapters = [{'id': 0, 'title': "Chapter 0", 'start_time': 0.0, 'end_time': 60.0,
+                 'transcript': f"alpha {filler} beta", 'summary': "", 'quiz': []}]
+    search_index.index_job(bucket, "job-a", chapters)
+    search_index.index_job(bucket, "job-b", make_chapters("something else"))
+
+    both = search_index.search(bucket, "alpha beta")[0]['score']
+    alpha = search_index.search(bucket, "alpha")[0]['score']
+    beta = search_index.search(bucket, "beta")[0]['score']
+
+    assert both == pytest.approx(max(alpha, beta))
+
+
+def test_search_ranks_by_term_frequency_and_skips_stale_postings(aws):
+    search_index.index_job(bucket, "job-a", make_chapters("convolution"))
+    search_index.index_job(bucket, "job-b", make_chapters("convolution convolution convolution kernels"))
+
+    results = search_index.search(bucket, "convolution kernels")
+    assert [r['job_id'] for r in results][:2] == ["job-b", "job-b"]
+    assert set([r['job_id'] for r in results]) == set(["job-a", "job-b"])
+
+    # reprocessing a job replaces its postings
+    search_index.index_job(bucket, "job-b", make_chapters("recurrent networks"))
+
+    assert set([r['job_id'] for r in search_index.search(bucket, "convolution")]) == set(["job-a"])
+    assert set([r['job_id'] for r in search_index.search(bucket, "recurrent")]) == set(["job-b"])
+
+
+def test_merge_keeps_live_postings_and_deletes_sources(aws, merge_factor):
+    search_index.index_job(bucket, "job-a", make_chapters("attention heads"))
+    first_segment = get_catalog()['jobs']['job-a'][0]
+    search_index.index_job(bucket, "job-b", make_chapters("attention masks"))
+
+    catalog = get_catalog()
+    merged_id = catalog['jobs']['job-a'][0]
+
+    assert list(catalog['segments'].keys()) == [merged_id]
+    assert catalog['segments'][merged_id]['tier'] == 1
+    assert catalog['segments'][merged_id]['jobs'] == ["job-a", "job-b"]
+    assert not s3.object_exists(bucket, search_index.get_titles_key(first_segment))
+    assert set([r['job_id'] for r in search_index.search(bucket, "attention")]) == set(["job-a", "job-b"])
+    assert search_index.search(bucket, "masks")[0]['title'] == "Chapter 0"
+
+
+def test_failed_segment_write_leaves_catalog_unchanged(aws):
+    search_index.index_job(bucket, "job-a", make_chapters("transformers"))
+    put_object = aws.s3.put_object
+
+    def failing_put_object(Bucket, Key, **kwargs):
+        if Key.startswith(search_index.segment_prefix):
+            raise RuntimeError(f"Injected failure writing {Key}")
+        return put_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    aws.s3.put_object = failing_put_object
+
+    assert search_index.index_job(bucket, "job-b", make_chapters("transformers")) == -1
+    assert list(get_catalog()['jobs'].keys()) == ["job-a"]
+    assert 'search_error' in manifest.get_job(bucket, "job-b")
+
+
+def test_concurrent_index_jobs(aws, merge_factor):
+    job_ids = [f"job-{i}" for i in range(4)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        counts = list(pool.map(lambda j: search_index.index_job(bucket, j, make_chapters(f"topic {j}")), job_ids))
+
+    catalog = get_catalog()
+
+    assert counts == [2, 2, 2, 2]
+    assert sorted(catalog['jobs'].keys()) == job_ids
+    assert sorted([j for s in catalog['segments'].values() for j in s['jobs'] if catalog['jobs'][j][0] in catalog['segments']]) == job_ids
+    assert set([r['job_id'] for r in search_index.search(bucket, "topic")]) == set(job_ids)
+
+
+def test_legacy_segments_are_searched_and_migrated(aws):
+    # a segment written before postings carried a chunk ID: no width in the catalog and postings without the chunk ID
+    chapters = make_chapters("dropout regularization")
+    titles, postings, chunks, length = search_index.get_job_postings(chapters)
+    legacy = {t: {'job-a': [v for i, v in enumerate(p) if i % search_index.posting_width != 0]} for t, p in postings.items()}
+    shards = search_index.write_segment(bucket, "legacy", legacy, {'job-a': titles})
+    s3.write_json(bucket, search_index.catalog_key, {
+        'segments': {'legacy': {'tier': 0, 'jobs': ["job-a"], 'shards': shards, 'created': 0}},
+        'jobs': {'job-a': ["legacy", chunks, length]},
+        'merging': {},
+    })
+    s3.write_json(bucket, "job-a/chapters.json", chapters)
+
+    assert [r['job_id'] for r in search_index.search(bucket, "dropout")] == ["job-a", "job-a"]
+
+    search_index.index_job(bucket, "job-b", make_chapters("batch normalization"))
+    catalog = get_catalog()
+
+    assert "legacy" not in catalog['segments']
+    assert all([s['width'] == search_index.posting_width for s in catalog['segments'].values()])
+    assert not s3.object_exists(bucket, search_index.get_titles_key("legacy"))
+    assert [r['job_id'] for r in search_index.search(bucket, "dropout")] == ["job-a", "job-a"]
@@ -0,0 +1,103 @@
+from lib import retrieval, segmentation, transcribe, vid_proc
+from collections import Counter
+import pytest
+
+
+# three topics with disjoint vocabularies, each spoken over ten 10-second segments
+topics = [
+    ("Neural networks", "neurons weights layers activation perceptron"),
+    ("Sorting algorithms", "quicksort mergesort pivot partition comparisons"),
+    ("Database indexes", "btree pages lookup clustered secondary"),
+]
+
+
+def make_transcript(segments_per_topic: int = 10, seconds: int = 10) -> dict:
+    '''
+    Returns a Transcribe response whose topic changes after every segments_per_topic audio segments.
+    '''
+
+    audio_segments = []
+    for t, (title, words) in enumerate(topics):
+        for i in range(segments_per_topic):
+            n = len(audio_segments)
+            text = f"Section {t + 1}: {title}. {words}" if i == 0 else f"{words} {words.split()[i % 5]}"
+            audio_segments.append({'id': n, 'start_time': f"{n * seconds}.000", 'end_time': f"{(n + 1) * seconds}.000", 'transcript': text})
+
+    return {'results': {'audio_segments': audio_segments, 'transcripts': [{'transcript': ' '.join([s['transcript'] for s in audio_segments])}]}}
+
+
+def test_depth_scores():
+    assert segmentation.get_depth_scores([1.0, 0.2, 1.0]) == pytest.approx([0.0, 1.6, 0.0])
+
+    # a valley is measured against the peaks reached by climbing on each side, not the direct neighbours
+    assert segmentation.get_depth_scores([0.9, 0.6, 0.3, 0.5, 0.8]) == pytest.approx([0.0, 0.3, 1.1, 0.3, 0.0])
+
+
+def test_gap_scores_drop_at_topic_changes():
+    segments = transcribe.get_audio_segments(make_transcript())
+    scores = segmentation.get_gap_scores([Counter(retrieval.tokenize(s['transcript'])) for s in segments])
+
+    assert len(scores) == 29
+    assert scores[9] < scores[4] and scores[19] < scores[14]
+
+
+def test_blocks_split_at_topic_changes():
+    blocks = segmentation.get_blocks(make_transcript())
+
+    assert [(b['start_time'], b['end_time']) for b in blocks] == [(0, 100), (100, 200), (200, 300)]
+    assert [b['id'] for b in blocks] == [0, 1, 2]
+    assert blocks[0]['depth'] == 0 and blocks[1]['depth'] > 0 and blocks[2]['depth'] > 0
+    assert blocks[1]['transcript'].startswith("Section 2: Sorting algorithms.")
+
+
+def test_blocks_respect_minimum_block_size(monkeypatch):
+    # topics of 40 seconds are shorter than min_block_seconds, so some of their boundaries are dropped
+    blocks = segmentation.get_blocks(make_transcript(segments_per_topic=4))
+
+    assert len(blocks) < 3
+    assert all([b['end_time'] - b['start_time'] >= segmentation.min_block_seconds for b in blocks])
+
+    # both topic changes of the 300-second transcript lie within 150 seconds of its start or end
+    monkeypatch.setattr(segmentation, 'min_block_seconds', 150)
+    assert len(segmentation.get_blocks(make_transcript())) == 1
+    monkeypatch.setattr(segmentation, 'min_block_seconds', 100)
+    assert len(segmentation.get_blocks(make_transcript())) == 3
+
+
+def test_blocks_are_capped(monkeypatch):
+    monkeypatch.setattr(segmentation, 'max_blocks', 2)
+    blocks = segmentation.get_blocks(make_transcript())
+
+    assert len(blocks) == 2
+    assert sum([len(b['segments']) for b in blocks]) == 30
+
+
+@pytest.mark.parametrize('segments', [0, 1, 2])
+def test_very_short_transcript(segments):
+    transcript = make_transcript()
+    transcript['results']['audio_segments'] = transcript['results']['audio_segments'][:segments]
+    blocks = segmentation.get_blocks(transcript)
+
+    assert len(blocks) == min(segments, 1)
+    assert sum([len(b['segments']) for b in blocks]) == segments
+
+
+def test_chapters_from_blocks(aws, monkeypatch):
+    monkeypatch.setattr(vid_proc, 'chapter_mode', 'blocks')
+    chapters = vid_proc.get_chapters(make_transcript(), [t for t, w in topics])
+
+    assert [c['title'] for c in chapters] == [t for t, w in topics]
+    assert [(c['start_time'], c['end_time']) for c in chapters] == [(0, 100), (100, 200), (200, 300)]
+    assert sum([len(c['segments']) for c in chapters]) == 30
+    assert aws.log.to_dict()['bedrock_calls_by_stage'] == {'get_chapters': 1}
+
+
+def test_unusable_block_groups_are_rejected():
+    blocks = segmentation.get_blocks(make_transcript())
+
+    with pytest.raises(ValueError):
+        vid_proc.parse_block_groups("<chapter><title>Intro</title><first>7</first></chapter>", blocks)
+
+    # the first chapter always starts at the first block, whichever block the model named first
+    chapters = vid_proc.parse_block_groups("<chapter><title>Later</title><first>2</first></chapter>", blocks)
+    assert [(c['title'], c['start_time']) for c in chapters] == [("Later", 0)]
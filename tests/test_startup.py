@@ -0,0 +1,17 @@
+from benchmarks import startup
+from cdk_stacks.lambda_modules import lambda_modules
+import pytest
+
+
+@pytest.mark.parametrize('handler_module', list(lambda_modules.keys()))
+def test_handler_import_within_budget(handler_module):
+    report = startup.measure(handler_module, repeats=5)
+
+    assert report['import_ms']['median'] <= startup.import_budget_ms, f"{handler_module} imports {report['modules_imported']} modules"
+
+
+def test_main_fails_over_budget(tmp_path):
+    output = tmp_path / "startup.json"
+
+    assert startup.main(['--handlers', 'track_transcribe_job', '--repeats', '1', '--import-budget-ms', '0', '--output', str(output)]) == 1
+    assert output.exists()
@@ -0,0 +1,120 @@
+from lib import bedrock, tokens, transcribe, vid_proc
+import pytest
+
+
+model_id = "anthropic.claude-3-5-sonnet-20241022-v2:0"
+
+
+@pytest.fixture(autouse=True)
+def uncalibrated(monkeypatch):
+    monkeypatch.setattr(tokens, 'calibrated', {})
+
+
+def make_messages(text: str) -> list:
+    return [{'role': 'user', 'content': [{'text': text}]}]
+
+
+def make_transcript(segments: int, words: int) -> dict:
+    audio_segments = [
+        {'id': i, 'start_time': f"{i * 10}.000", 'end_time': f"{(i + 1) * 10}.000", 'transcript': f"segment {i} " + "word " * words}
+        for i in range(segments)
+    ]
+    return {'results': {'audio_segments': audio_segments, 'transcripts': [{'transcript': ' '.join([s['transcript'] for s in audio_segments])}]}}
+
+
+def test_pack_keeps_batches_within_budget():
+    items = ["x" * n for n in [40, 120, 80, 200, 40, 40, 160, 8]]
+    batches = tokens.pack(items, 100, overhead=20)
+
+    assert [i for b in batches for i in b] == items
+    assert all([20 + sum([tokens.estimate_tokens(i) for i in b]) <= 100 for b in batches])
+    assert [len(b) for b in batches] == [3, 3, 2]
+
+
+def test_pack_puts_an_item_over_budget_in_its_own_batch():
+    items = ["a" * 40, "b" * 800, "c" * 40]
+    batches = tokens.pack(items, 50)
+
+    assert batches == [[items[0]], [items[1]], [items[2]]]
+    assert tokens.pack([], 50) == []
+
+
+def test_check_prompt_budget():
+    budget = tokens.get_prompt_budget(model_id)
+    assert budget == 200000 - tokens.response_tokens
+    assert tokens.get_prompt_budget("us." + model_id) == budget
+    assert tokens.get_prompt_budget("unknown-model") == tokens.default_context_window - tokens.response_tokens
+
+    # the estimate is inflated by the safety margin before it is compared with the budget
+    fits = int(budget / tokens.safety_margin) * tokens.chars_per_token
+    assert tokens.check_prompt(make_messages("x" * fits), model_id) == fits // tokens.chars_per_token
+
+    with pytest.raises(ValueError):
+        tokens.check_prompt(make_messages("x" * (budget * tokens.chars_per_token)), model_id)
+
+
+def test_oversized_prompt_is_rejected_before_it_is_sent(aws):
+    with pytest.raises(ValueError):
+        bedrock.invoke_model(make_messages("x" * (tokens.get_prompt_budget(model_id) * tokens.chars_per_token)), model_id)
+
+    assert 'bedrock-runtime.converse' not in aws.log.to_dict()['operations']
+
+
+def test_calibration_changes_estimates():
+    text = "x" * 1200
+    assert tokens.estimate_tokens(text, model_id) == 300
+
+    tokens.record_usage(model_id, make_messages(text), 600)
+    assert tokens.get_chars_per_token(model_id) == 2.0
+    assert tokens.estimate_tokens(text, model_id) == 600
+
+    # later calls move the ratio as a moving average, and other models keep the default
+    tokens.record_usage(model_id, make_messages(text), 200)
+    assert tokens.get_chars_per_token(model_id) == pytest.approx(0.9 * 2.0 + 0.1 * 6.0)
+    assert tokens.estimate_tokens(text, "other-model") == 300
+
+
+def test_calibration_ignores_short_prompts_and_clamps_the_ratio():
+    tokens.record_usage(model_id, make_messages("x" * 100), 10)
+    assert model_id not in tokens.calibrated
+
+    tokens.record_usage(model_id, make_messages("x" * 1200), 10)
+    assert tokens.get_chars_per_token(model_id) == tokens.chars_per_token_range[1]
+
+
+def test_overview_windows_fit_the_budget(monkeypatch):
+    response = make_transcript(40, 50)
+    assert vid_proc.get_overview_windows(response) == [transcribe.get_transcript_text(response)]
+
+    monkeypatch.setattr(vid_proc, 'overview_budget', 300)
+    windows = vid_proc.get_overview_windows(response)
+
+    assert len(windows) > 1
+    assert all([tokens.estimate_tokens(w, bedrock.default_model) <= 300 for w in windows])
+    assert ' '.join(windows) == ' '.join([s['transcript'] for s in transcribe.get_audio_segments(response)])
+
+
+def test_long_transcript_is_summarized_in_windows(aws, monkeypatch):
+    monkeypatch.setattr(vid_proc, 'overview_budget', 300)
+    windows = vid_proc.get_overview_windows(make_transcript(40, 50))
+
+    overview = vid_proc.get_summary_and_topics(make_transcript(40, 50))
+
+    assert overview['summary'] != ""
+    assert aws.log.to_dict()['bedrock_calls_by_stage'] == {'get_summary_and_topics': len(windows), 'merge_summary_and_topics': 1}
+
+
+def test_timestamp_batches_handle_segments_over_budget(aws, monkeypatch):
+    # every segment alone exceeds the batch budget, so each batch holds a single segment
+    monkeypatch.setattr(vid_proc, 'timestamp_batch_tokens', 10)
+    response = make_transcript(6, 50)
+    segments = transcribe.get_audio_segments(response)
+    chapters = [
+        {'id': 0, 'title': "First", 'transcript': ' '.join([s['transcript'] for s in segments[:3]])},
+        {'id': 1, 'title': "Second", 'transcript': ' '.join([s['transcript'] for s in segments[3:]])},
+    ]
+
+    chapters = vid_proc.get_chapter_timestamps(response, chapters)
+
+    assert [(c['start_time'], c['end_time']) for c in chapters] == [(0, 30), (30, 60)]
+    assert sum([len(c['segments']) for c in chapters]) == 6
@@ -1,30 +1,67 @@
 from lambdas.lib import (
+    answer_cache,
+    artifact_cache,
     s3,
-    utils,
-    bedrock
+    bedrock,
+    chat_memory,
+    context_pack,
+    manifest,
+    retrieval,
+    search_index,
+    tokens
 )
 import streamlit as st
 import yt_dlp as youtube_dl
 import uuid
-import glob
+import re
+import subprocess
+import sys
+import time
 
 
 # region globals
 # TODO: update the bucket name with the CDK output, which should be named "ai-tutor-uploads-<your account id>"
 bucket = "REPLACE THIS WITH THE BUCKET FROM THE CDK DEPLOYMENT"
 
+# presigned video URLs are valid for video_url_expiry seconds and regenerated video_url_refresh seconds before they expire
+video_url_expiry = 6 * 3600
+video_url_refresh = 300
+
+# number of retrieved chunks sent with each question, within a budget of tokens for the excerpts
+retrieval_top_k = 6
+retrieval_budget = 3000
+
+# number of chapters listed when searching all videos
+search_top_k = 10
+
+# ordinals recognized in chat questions about a quiz question, e.g. "explain the third quiz question"; -1 is the last question
+quiz_ordinals = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6, 'last': -1}
+
+# models available to the tutor chat and the tokens available to their pinned context, which selects the context pack variant
+models = {
+    'Claude 3.5 Sonnet v2': {'model_id': bedrock.default_model, 'context_budget': 8000},
+    'Claude 3 Haiku': {'model_id': "anthropic.claude-3-haiku-20240307-v1:0", 'context_budget': context_pack.trimmed_budget},
+}
+
 session_vars = {
     'stage': 'init',
     'jobs': {},
     'summary': "",
     'chapters': "",
+    'retrieval_index': None,
+    'context_pack': None,
+    'model': list(models.keys())[0],
     'video_filename': "",
-    'video_bytes': "",
+    'video_s3_key': "",
+    'video_url': "",
+    'video_url_expires': 0,
     'selected_job': "",
+    'job_id': "",
     'selected_job_id': 0,
     'selected_chapter': 0,
     'start_time': 0,
     'chat_history': [],
+    'chat_memory': None,
     'context': "",
 }
 
@@ -35,104 +72,121 @@ for k, v in session_vars.items():
 # endregion
 
 # region functions
-def download_youtube_video(url, retries=0) -> str:
+def ingest_youtube_video(job_prefix: str, url: str, retries: int = 5) -> str:
     '''
-    Downloads the video from the URL in low quality (width < 720).    
-    Returns local filepath to the downloaded video.
+    Streams the video from the URL in low quality (width < 720) straight into a multipart upload to S3, which triggers
+    Transcribe and GenAI-based analysis and content enrichment such as quiz generation. No local copy is written.
+    On failure the download is restarted, and the parts already uploaded are not sent again.
+    Returns the uploaded video's S3 object key, or an empty string if the video could not be fetched.
     '''
 
-    # uuid for temp dir
-    id = uuid.uuid4() 
-    temp_dir = f'temp/vid_{id}'
+    ydl_opts = {'format': 'best[width<=720]'}
 
-    # download options
-    ydl_opts = {
-        'format': 'best[width<=720]',
-        'outtmpl': f'{temp_dir}/%(title)s.%(ext)s',
-        }
+    try:
+        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+
+    except Exception as e:
+        print(f"\nERROR: Failed to fetch video info! {e}")
+        return ""
+
+    # yt-dlp writes the video to stdout, which is read in parts by the multipart upload
+    video_filename = f"{info['title']}.{info['ext']}".replace('/', '_')
+    s3_key = f"{job_prefix}/vid-{video_filename}"
+    command = [sys.executable, '-m', 'yt_dlp', '--quiet', '--format', ydl_opts['format'], '--output', '-', url]
+    resume = {}
+
+    for attempt in range(1, retries + 1):
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def read(size):
+            data = proc.stdout.read(size)
+            if data == b"" and proc.wait() != 0:
+                raise RuntimeError(f"yt-dlp exited with code {proc.returncode}")
+            return data
 
-    # download video and return filepath to downloaded video    
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
         try:
-            ydl.download([url])
-            vid_dir = glob.glob(f"{temp_dir}/*", recursive=False)[0]
-            return str(vid_dir)
+            return s3.upload_stream(read, bucket, s3_key, resume)
 
-        except:
-            retries += 1
+        except Exception as e:
+            print(f"\n\nERROR: Couldn't fetch video. Retrying [{attempt}/{retries}]... {e}")
 
-            if retries > 5:
-                print(f"\nERROR: Failed to fetch video!")
-                return ""
-            
-            print(f"\n\nERROR: Couldn't fetch video. Retrying [{retries}/5]...")
-            return download_youtube_video(url, retries)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    print(f"\nERROR: Failed to fetch video!")
+    s3.abort_upload(bucket, s3_key, resume)
+    return ""
         
 
-def upload_video(module_name: str, video_filepath: str) -> str:
+def get_job_prefix(module_name: str) -> str:
     '''
-    Uploads the video to S3, which triggers Transcribe and GenAI-based analysis and content enrichment such as quiz generation.
-    Returns the uploaded video's S3 object key.
+    Returns a new, unique S3 prefix for a job, e.g. "<module_name>-uuid-<uuid>".
     '''
 
-    # upload to s3 and return the s3 uri
-    junk, sep, video_filename = video_filepath.rpartition('/')
-    s3_key = s3.upload_file(video_filepath, bucket, f"{module_name}-uuid-{uuid.uuid4()}/vid-{video_filename}")
-    return s3_key
+    return f"{module_name.strip().replace(' ', '-').replace('/', '-')}-uuid-{uuid.uuid4()}"
 
 
-def upload_file(module_name: str, filepath: str, prefix: str = "") -> str:
+def upload_video(job_prefix: str, video_file) -> str:
     '''
-    Uploads files to S3. Optionally specify a prefix.
-    Returns the uploaded file's S3 object key.
+    Uploads the video (a local path or an uploaded file) to S3, which triggers Transcribe and GenAI-based analysis and
+    content enrichment such as quiz generation.
+    Returns the uploaded video's S3 object key, or an empty string if the upload failed.
     '''
 
-    # upload to s3 and return the s3 uri
-    junk, sep, filename = filepath.rpartition('/')
-    s3_key = s3.upload_file(filepath, bucket, f"{module_name}-uuid-{uuid.uuid4()}/kb/{filename}")
-    return s3_key
+    source = video_file if isinstance(video_file, str) else video_file.name
+    junk, sep, video_filename = source.rpartition('/')
+    report = s3.upload_files([video_file], bucket, job_prefix, object_names=[f"vid-{video_filename}"])[0]
+
+    if report['error'] != "":
+        print(f"\nERROR in upload_video: {report['error']}")
+        return ""
+
+    return report['key']
+
+
+def upload_files(job_prefix: str, files: list) -> list:
+    '''
+    Uploads the additional content files (local paths or uploaded files) concurrently to the job's kb/ prefix.
+    Returns the per-file upload reports, see s3.upload_files().
+    '''
+
+    if len(files) == 0:
+        return []
+
+    return s3.upload_files(files, bucket, f"{job_prefix}/kb")
 
 
 def list_jobs() -> dict:
     '''
-    Gets a list of videos that have been uploaded (based on prefix) and then checks if the processed chapters are available (looks for "chapters.json").    
+    Reads the job manifest maintained by the pipeline Lambdas. The first read after a deployment backfills the manifest
+    with the jobs processed before it existed (see manifest.read_jobs).
     Returns a dictionary containing 
     {job_id: {
         'is_complete': bool, 
+        'status': str(),
         'chapters_s3_key': str(), 
         'video_s3_key': str()
         }
     }
     '''
 
-    bucket_contents = s3.list_bucket(bucket)
-    jobs = {}
-
-    for object_key in bucket_contents:
-        folder, sep, junk = object_key.partition('/')
-        junk, sep, filename = object_key.rpartition('/')
-
-        if folder not in jobs.keys():
-            jobs[folder] = {}
-            jobs[folder]['is_complete'] = False
-
-        if filename[:4] == 'vid-':
-            jobs[folder]['video_s3_key'] = object_key
+    entries = manifest.read_jobs(bucket)
 
-        elif filename == 'overview.json':
-            jobs[folder]['overview_s3_key'] = object_key
+    jobs = {}
 
-        elif filename == 'chapters.json':
-            jobs[folder]['is_complete'] = True
-            jobs[folder]['chapters_s3_key'] = object_key
+    for job_id, entry in entries.items():
+        jobs[job_id] = dict(entry)
+        jobs[job_id]['is_complete'] = entry['status'] == 'complete'
 
     return jobs
 
 
 def get_job_results(job_id: str) -> None:
     '''
-    Retrieves the video file, overview.json, and chapters.json for the given job_id.
-    Parses the video filename as a string and stores the bytes. Stores the summary as a string and chapters as dictionary.
+    Retrieves overview.json, chapters.json, retrieval_index.json, and context_pack.json for the given job_id. The video is not downloaded.
+    Parses the video filename as a string and stores a presigned URL for the video. Stores the summary as a string, chapters as dictionary, the retrieval index, and the context pack.
     Updates the session state in-place. Nothing is returned.
     '''
 
@@ -143,38 +197,29 @@ def get_job_results(job_id: str) -> None:
         if job['is_complete'] == False:
             return {}
         
-        overview_s3_key = job['overview_s3_key']
-        chapters_s3_key = job['chapters_s3_key']
         video_s3_key = job['video_s3_key']
-        temp_folder = f"temp/{job_id}/"
-
-        # download overview.json from s3, read as a dict, and delete the local copy
-        overview_json = s3.download_file(bucket, overview_s3_key, temp_folder)
-        overview = utils.read_json_as_dict(overview_json)
-        utils.delete_file(overview_json)
-        st.session_state['summary'] = overview['summary']
-
-        # download chapters.json from s3, read as a dict, and delete the local copy
-        chapters_json = s3.download_file(bucket, chapters_s3_key, temp_folder)
-        chapters = utils.read_json_as_dict(chapters_json)
-        utils.delete_file(chapters_json)
-        st.session_state['chapters'] = chapters
-
-        # download the video from s3 and store the filename and bytes, then delete the local copy
-        video_filepath = s3.download_file(bucket, video_s3_key, temp_folder)
 
-        junk, sep, filename_ext = video_filepath.rpartition('/')
-        filename, sep, ext = video_filepath.rpartition('.')
+        # fetch the artifacts concurrently through the shared artifact cache
+        artifact_fields = ['overview_s3_key', 'chapters_s3_key', 'retrieval_index_s3_key', 'context_pack_s3_key']
+        artifact_keys = [job[f] for f in artifact_fields if f in job]
+        artifacts = dict(zip([f for f in artifact_fields if f in job], artifact_cache.fetch_json_many(bucket, artifact_keys)))
+        st.session_state['summary'] = artifacts['overview_s3_key']['summary']
+        st.session_state['chapters'] = artifacts['chapters_s3_key']
+        st.session_state['job_id'] = job_id
+
+        # jobs processed before the retrieval index and context pack existed are indexed and packed on the fly
+        chapters = artifacts['chapters_s3_key']
+        st.session_state['retrieval_index'] = artifacts.get('retrieval_index_s3_key') or retrieval.build_index(retrieval.get_chunks(chapters))
+        st.session_state['context_pack'] = artifacts.get('context_pack_s3_key') or context_pack.build_pack(chapters)
+
+        # store the video filename and a presigned URL, so that the browser streams the video from s3 with range requests
+        junk, sep, filename_ext = video_s3_key.rpartition('/')
+        filename, sep, ext = filename_ext.rpartition('.')
         junk, sep, video_filename = filename.partition('vid-')
         st.session_state['video_filename'] = video_filename
-
-        with open(video_filepath, 'rb') as file:
-            video_bytes = file.read()
-        st.session_state['video_bytes'] = video_bytes
-        utils.delete_file(video_filepath)
-
-        # delete temp folder
-        utils.delete_file(temp_folder)
+        st.session_state['video_s3_key'] = video_s3_key
+        st.session_state['video_url_expires'] = 0
+        get_video_url()
 
         # update session context
         format_context_message()
@@ -184,28 +229,151 @@ def get_job_results(job_id: str) -> None:
         return {}
 
 
+def read_search_shard(bucket_name: str, key: str):
+    '''
+    Reads a file of the cross-course search index, i.e. the catalog or a segment file, through the shared artifact cache,
+    so that repeated searches only revalidate the files.
+    Returns the parsed file, or None if it does not exist (yet).
+    '''
+
+    try:
+        return artifact_cache.fetch_json(bucket_name, key)
+
+    except Exception as e:
+        if s3.is_error(e, 'NoSuchKey', '404'):
+            return None
+        raise e
+
+
+def open_search_result(result: dict) -> None:
+    '''
+    Retrieves the results of the search result's job and selects its chapter, starting the video at the matching chunk.
+    Updates the session state in-place. Nothing is returned.
+    '''
+
+    get_job_results(result['job_id'])
+
+    chapter_ids = [c['id'] for c in st.session_state['chapters']]
+    if result['chapter_id'] in chapter_ids:
+        st.session_state['selected_chapter'] = chapter_ids.index(result['chapter_id'])
+        st.session_state['start_time'] = int(result['start_time'])
+
+
+def get_video_url() -> str:
+    '''
+    Returns a presigned URL for the selected video. The URL is kept in the session state so that the video element
+    is not reloaded on every rerun, and is only regenerated when it is about to expire.
+    '''
+
+    if time.time() > st.session_state['video_url_expires'] - video_url_refresh:
+        st.session_state['video_url'] = s3.get_presigned_url(bucket, st.session_state['video_s3_key'], video_url_expiry)
+        st.session_state['video_url_expires'] = time.time() + video_url_expiry
+
+    return st.session_state['video_url']
+
+
+def get_answer_version() -> str:
+    '''
+    Returns the version of the selected job's content that cached answers are valid for, i.e. the ETags of chapters.json
+    and the retrieval index. The ETags are revalidated by the artifact cache, so changed content invalidates the answers.
+    '''
+
+    job = st.session_state['jobs'][st.session_state['job_id']]
+    keys = [job[k] for k in ['chapters_s3_key', 'retrieval_index_s3_key'] if k in job]
+
+    return '/'.join([artifact_cache.fetch_entry(bucket, k)[1] for k in keys])
+
+
+def get_quiz_explanation(prompt: str) -> str:
+    '''
+    Matches chat questions about a quiz answer, e.g. "Can you explain the answer to the 3rd quiz question?", to the
+    explanation precomputed with the quiz. The question must name the quiz question explicitly, i.e. "quiz question 2",
+    "2nd quiz question", "question 2 of the quiz" or "second question in the quiz", so that other questions about the
+    quiz, e.g. "why is the first chapter's quiz so hard?", are answered by the model. The question refers to the
+    selected chapter unless it names one, e.g. "why is the answer to quiz question 2 of chapter 4 correct?".
+    Returns the formatted explanation, or an empty string if the prompt is not such a question or there is no explanation.
+    '''
+
+    text = ' '.join(re.findall(r"[a-z0-9]+", prompt.lower()))
+
+    if 'quiz' not in text or re.search(r"\b(explain|explanation|why)\b", text) is None:
+        return ""
+
+    chapters = st.session_state['chapters']
+    chapter_index = st.session_state['selected_chapter']
+    chapter_match = re.search(r"\bchapter (\d+)\b", text)
+
+    if chapter_match is not None:
+        chapter_index = int(chapter_match.group(1)) - 1
+        text = text.replace(chapter_match.group(0), "")
+
+    ordinal = r"(\d+(?:st|nd|rd|th)?|" + '|'.join(quiz_ordinals.keys()) + r")"
+    patterns = [
+        rf"\bquiz (?:question|qn) {ordinal}\b",
+        rf"\b{ordinal} quiz (?:question|qn)\b",
+        rf"\b(?:question|qn) {ordinal} (?:of|in|on) (?:the |this )?quiz\b",
+        rf"\b{ordinal} (?:question|qn) (?:of|in|on) (?:the |this )?quiz\b",
+    ]
+    number_matches = [m for m in [re.search(p, text) for p in patterns] if m is not None]
+
+    if len(number_matches) == 0 or chapter_index < 0 or chapter_index >= len(chapters):
+        return ""
+
+    quiz = chapters[chapter_index].get('quiz', [])
+    word = number_matches[0].group(1)
+    number = quiz_ordinals[word] if word in quiz_ordinals else int(word.rstrip('stndrh'))
+    number = len(quiz) if number == -1 else number
+
+    if number < 1 or number > len(quiz) or quiz[number - 1].get('explanation', "") == "":
+        return ""
+
+    qn = quiz[number - 1]
+    return f"**Quiz question {number}:** {qn['question']}\n\n**Answer:** {qn['answer']}\n\n{qn['explanation']}"
+
+
 def ask_qn(prompt: str) -> None:
     '''
     Displays the user prompt, then invokes Bedrock and the streams the response.
-    The user prompt and Bedrock response are appended to the chat history.
+    The chunks of the course most relevant to the prompt are retrieved and sent with the latest user prompt only.
+    The request is bounded by the chat memory, which sends the pinned context, a summary of older turns, and the most recent turns.
+    The first question of a conversation does not depend on earlier turns, so it is answered from the answer cache if
+    the same or a near-duplicate question was answered before for the job, and the answer is cached otherwise.
+    Questions about a quiz answer are answered with the explanation precomputed with the quiz, without invoking Bedrock.
+    The user prompt and Bedrock response are appended to the chat history and the chat memory.
     '''
 
+    memory = st.session_state['chat_memory']
+    is_first_question = len(memory['messages']) == 0 and memory['summary'] == ""
+    cached_answer = None
+
+    # answers are cached per job and model
+    cache_key = f"{st.session_state['job_id']}:{st.session_state['model']}"
+    explanation = get_quiz_explanation(prompt)
+
+    if explanation != "":
+        cached_answer = explanation
+        is_first_question = False
+
+    elif is_first_question:
+        version = get_answer_version()
+        cached_answer = answer_cache.lookup(cache_key, version, prompt)
+
     # print the user prompt and update session state
     st.chat_message('user').write(prompt)
     st.session_state['chat_history'].append({'role': 'user', 'content': prompt})
+    chat_memory.add_message(memory, 'user', prompt)
 
-    # format the messages payload
-    messages = [{
-        'role': m['role'],
-        'content': [{'text': m['content']}]
-        }
-        for m in st.session_state['chat_history']
-    ]
-
-    # invoke bedrock and stream the response
+    # invoke bedrock and stream the response, or replay the cached answer as a stream
     with st.chat_message('assistant'):
-        with st.spinner("One moment please..."):
-            response = bedrock.invoke_model(messages, streaming=True)
+        if cached_answer is not None:
+            response = {'stream': answer_cache.replay_stream(cached_answer)}
+
+        else:
+            # format the messages payload, adding the retrieved excerpts to the latest user prompt
+            messages = chat_memory.get_messages(memory, format_question_message(prompt))
+
+            with st.spinner("One moment please..."):
+                response = bedrock.invoke_model(messages, models[st.session_state['model']]['model_id'], streaming=True)
         
         full_response = ""
         message_placeholder = st.empty()
@@ -216,54 +384,70 @@ def ask_qn(prompt: str) -> None:
             for event in stream:
                 if 'contentBlockDelta' in event:
                     full_response += event['contentBlockDelta']['delta']['text']
+                elif 'metadata' in event:
+                    chat_memory.record_usage(memory, event['metadata'].get('usage', {}))
                 message_placeholder.markdown(full_response + "▌")
+
+    if is_first_question and cached_answer is None and full_response != "":
+        answer_cache.store(cache_key, version, prompt, full_response)
     
-    # update the session state and rerun
+    # update the session state, fold older turns into the summary in the background, and rerun
     st.session_state['chat_history'].append({'role': 'assistant', 'content': full_response})
+    chat_memory.add_message(memory, 'assistant', full_response)
+    chat_memory.compact(memory)
     st.rerun()
 
 
-def format_context_message() -> None:
+def format_question_message(prompt: str) -> str:
     '''
-    Formats the chapter summaries and quizzes into a prompt.
+    Retrieves the chunks of the chapter transcripts, summaries, quizzes, and additional documents that are most relevant
+    to the prompt, keeping the best chunks that fit retrieval_budget.
+    Returns the prompt with the retrieved chunks as a string.
     '''
 
-    chapters = ""
+    chunks = retrieval.search(st.session_state['retrieval_index'], prompt, retrieval_top_k)
+    chunks = tokens.pack(chunks, retrieval_budget, get_text=lambda c: c['text'], model_id=models[st.session_state['model']]['model_id'])[0] if len(chunks) > 0 else []
+    excerpts = ""
 
-    for c in st.session_state['chapters']:
-        chapters += f"\n<chapter>"
+    for c in chunks:
+        if c['kind'] == 'document':
+            excerpts += f"\n<excerpt document=\"{c['title']}\" type=\"{c['kind']}\">\n{c['text']}\n</excerpt>\n"
+            continue
 
-        for k, v in c.items():
-            if k in ['title', 'summary']:
-                chapters += f"\n<{k}>\n{v}\n</{k}>\n"
+        minutes, seconds = divmod(int(float(c['start_time'])), 60)
+        excerpts += f"\n<excerpt chapter=\"{c['chapter_id'] + 1}. {c['title']}\" type=\"{c['kind']}\" time=\"{minutes}:{seconds:02d}\">\n{c['text']}\n</excerpt>\n"
 
-            elif k == 'quiz':
-                chapters += f"\n<quiz>"
-                for qn in v:
-                    chapters += f"\n<question>"
-                    chapters += f"\nQuestion: {qn['question']}\n"
-                    chapters += f"\nChoices:"
-                    for i in range(len(qn['choices'])):
-                        chapters += f"\n({i+1}) {qn['choices'][i]}"
-                    chapters += f"\n\nCorrect answer: {qn['answer']}\n"
-                    chapters += f"\n</question>"
-                chapters += f"\n</quiz>"
+    return f"""
+    <excerpts>
+    {excerpts}
+    </excerpts>
 
-        chapters += f"\n</chapter>\n"
+    {prompt}
+    """
 
-    instructions = f"""
-    <content>
-    {chapters}
-    </content>
 
-    You are strictly required to answer questions based on the information available above within <content></content> tags. If the question cannot be answered using this information, you must tell the user that you are unable to answer the question. 
-    """
+def format_context_message(reset: bool = True) -> None:
+    '''
+    Pins the variant of the job's prebuilt context prompt that fits the selected model's context budget.
+    The transcripts and quizzes are not included, since the relevant excerpts are retrieved for each question.
+    Unless reset is True, the conversation is kept and only the pinned context is replaced, e.g. when switching models.
+    '''
 
-    st.session_state['chat_history'] = [
-        {'role': 'user', 'content': instructions},
-        {'role': 'assistant', 'content': 'Understood. I will answer questions strictly based on the information available above. If the question cannot be answered using the given information, I will inform you that I am unable to answer the question.'},
+    pack = st.session_state['context_pack']
+    variant = context_pack.choose_variant(pack, models[st.session_state['model']]['context_budget'])
+
+    pinned = [
+        {'role': 'user', 'content': variant['prompt']},
+        {'role': 'assistant', 'content': pack['acknowledgement']},
     ]
 
+    if not reset and st.session_state['chat_memory'] is not None:
+        st.session_state['chat_history'][:2] = pinned
+        st.session_state['chat_memory']['pinned'] = pinned
+    else:
+        st.session_state['chat_history'] = list(pinned)
+        st.session_state['chat_memory'] = chat_memory.new_memory(pinned)
+
 # endregion
 
 # region app
@@ -285,12 +469,38 @@ if st.session_state['stage'] == 'init':
     in_prog_jobs = [job_id for job_id, status in jobs.items() if not status['is_complete']]
     all_jobs = complete_jobs + in_prog_jobs
 
+    # search the chapters of all processed videos without loading any of them
+    query = st.text_input("**Search all videos**")
+
+    if query.strip() != "":
+        results = [r for r in search_index.search(bucket, query, search_top_k, read_search_shard) if r['job_id'] in complete_jobs]
+
+        if len(results) == 0:
+            st.info("No matching chapters found.")
+
+        for i, r in enumerate(results):
+            minutes, seconds = divmod(int(r['start_time']), 60)
+            col1, col2 = st.columns([5, 1])
+            col1.markdown(f"**{r['title']}** ({minutes}:{seconds:02d})  \n*{r['job_id']}*")
+
+            if col2.button("Open", key=f"search-result-{i}"):
+                with st.spinner("Retrieving results..."):
+                    open_search_result(r)
+
+                st.session_state['stage'] = 'res'
+                st.rerun()
+
+        st.divider()
+
     # dropdown menu to select completed jobs
     selected_job = st.selectbox("**Select job**", all_jobs, st.session_state['selected_job_id'])
 
     # retrieve job results
     if selected_job is not None:
-        if selected_job in in_prog_jobs:
+        if selected_job in in_prog_jobs and jobs[selected_job]['status'] == 'failed':
+            st.error("Processing failed for this job.")
+
+        elif selected_job in in_prog_jobs:
             st.info("Job is still in progress. Please check again later.")
 
         elif selected_job in complete_jobs:
@@ -306,22 +516,49 @@ if st.session_state['stage'] == 'init':
                     st.session_state['stage'] = 'res'
                     st.rerun()
 
-    # TODO: create new job
+    # create new job
     st.divider()
     st.subheader("Create new job")
 
+    module_name = st.text_input("**Module name**")
     video_file = st.file_uploader("**Upload a video file (must be mp4)**", type=['mp4'], accept_multiple_files=False)
+    video_url = st.text_input("**Or enter a YouTube URL**")
     other_files = st.file_uploader("**Upload additional content**", type=['txt', 'md', 'html', 'doc', 'docx', 'csv', 'xls', 'xlsx', 'pdf', 'jpg', 'jpeg', 'png'], accept_multiple_files=True)
 
     if st.button("Submit new job"):
-        st.info("Placeholder to upload files to S3 and trigger workflow.")
+        if module_name.strip() == "" or (video_file is None and video_url.strip() == ""):
+            st.warning("Please enter a module name and upload a video or enter a YouTube URL.")
+
+        else:
+            job_prefix = get_job_prefix(module_name)
+
+            # upload the additional content first, so that it is in place when the video triggers the pipeline
+            with st.spinner("Uploading additional content..."):
+                reports = upload_files(job_prefix, other_files)
+
+            with st.spinner("Uploading video..."):
+                if video_file is not None:
+                    video_s3_key = upload_video(job_prefix, video_file)
+                else:
+                    video_s3_key = ingest_youtube_video(job_prefix, video_url.strip())
+
+            failed = [r for r in reports if r['error'] != ""]
+            if video_s3_key == "":
+                st.error("Failed to upload the video.")
+            elif len(failed) > 0:
+                st.warning(f"Submitted job {job_prefix}, but {len(failed)} file(s) failed to upload: {', '.join([r['file'] for r in failed])}")
+            else:
+                st.success(f"Submitted job {job_prefix}")
+
+            if len(reports) > 0:
+                st.dataframe([{k: r[k] for k in ['file', 'bytes', 'seconds', 'error']} for r in reports])
 
 # display job results
 if st.session_state['stage'] == 'res':
 
     # show video
     st.header(st.session_state['video_filename'])
-    st.video(st.session_state['video_bytes'], start_time=st.session_state['start_time'])
+    st.video(get_video_url(), start_time=st.session_state['start_time'])
 
     # select chapter
     chapter_options = [f"{c['id']+1}) {c['title']}" for c in st.session_state['chapters']]
@@ -356,6 +593,8 @@ if st.session_state['stage'] == 'res':
             
             with st.expander("Reveal answer"):                  
                 st.markdown(f"**Answer:** *{ans}*")
+                if quiz_content.get('explanation', "") != "":
+                    st.markdown(quiz_content['explanation'])
                 
             st.divider()
 
@@ -363,12 +602,27 @@ if st.session_state['stage'] == 'res':
     # region chat sidebar
     with st.sidebar:
 
+        # model selection, which also selects the pinned context variant that fits the model
+        model = st.selectbox("**Model**", list(models.keys()), list(models.keys()).index(st.session_state['model']))
+        if model != st.session_state['model']:
+            st.session_state['model'] = model
+            format_context_message(reset=False)
+
         # chat history
         chat_area = st.container(height=400)
 
         for message in st.session_state['chat_history'][2:]:
             chat_area.chat_message(message["role"]).write(message["content"])
 
+        # prompt size of the latest turn
+        if st.session_state['chat_memory'] is not None and len(st.session_state['chat_memory']['stats']) > 0:
+            stats = st.session_state['chat_memory']['stats'][-1]
+            st.caption(f"Prompt tokens: {stats.get('input_tokens', stats['prompt_tokens'])} ({stats['summarized_turns']} earlier turns summarized)")
+
+        cache_stats = answer_cache.get_stats()
+        if cache_stats['lookups'] > 0:
+            st.caption(f"Answer cache hit rate: {cache_stats['hit_rate']:.0%} of {cache_stats['lookups']} questions")
+
         # Q&A
         if prompt := st.chat_input("Ask anything"):
             with chat_area: